@@ -0,0 +1,209 @@
+# answer_warmer.py (Ver 1.1 - Background Answer Warmer for Hot Presets)
+# よく押されるプリセット質問の返答を、空いてる時間に裏で作ってキャッシュに入れておく。
+# (最初の1クリックでもAIを待たずに返せるように)
+# - クリック数は knowledge_id ごとに数える (古いクリックはサイクルごとに半分にして、今の人気を見る)
+#   ほぼ0まで減ったナレッジは忘れる。覚えておく数にも上限があるので、長く動かしてもメモリは増え続けない
+# - キャッシュのキーにはナレッジ1件ごとのバージョンが入ってるので、
+#   詳細が変わったナレッジだけキーが変わって作り直しになる (変わってないものはそのまま)
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chat_service
+import knowledge_catalog
+import llm_gateway
+import tracing
+
+WARM_INTERVAL = float(os.getenv("PROTOS_WARM_INTERVAL", "60")) # 何秒ごとに見に行くか
+WARM_IDLE = float(os.getenv("PROTOS_WARM_IDLE", "30")) # ユーザーのリクエストがこれだけ途切れてたら「空いてる」
+WARM_WORKERS = int(os.getenv("PROTOS_WARM_WORKERS", "2")) # 同時に作る数 (ゲートウェイの枠をユーザーに残す)
+WARM_TOP_K = int(os.getenv("PROTOS_WARM_TOP_K", "20")) # 1サイクルで温める上位何件
+WARM_MIN_CLICKS = 2.0 # これ未満のナレッジは温めない (1回押されただけのものにお金を使わない)
+CLICK_DECAY = 0.5 # サイクルごとにクリック数をこれ倍にする
+CLICK_FLOOR = 0.1 # 減衰してこれ未満になったナレッジは忘れる (覚えてた人格も一緒に捨てる)
+MAX_TRACKED = int(os.getenv("PROTOS_WARM_MAX_TRACKED", "1024")) # クリックを覚えておくナレッジの数 (LRU)
+MAX_WARMED = int(os.getenv("PROTOS_WARM_MAX_WARMED", "4096")) # 温めたバージョンを覚えておくキーの数 (LRU)
+PERSONAS_PER_KNOWLEDGE = 4 # ナレッジごとに覚えておく人格の数 (キャッシュのキーは人格ごとなので)
+WARM_MAX_ATTEMPTS = 3 # 1サイクルで1キーにつきAIを呼ぶ上限 (キャッシュ側にも、キーごとの合計の上限がある)
+
+
+class AnswerWarmer:
+    """
+    クリックを数えて、人気のプリセット質問の返答バリエーションを先に作っておく係。
+    run_once() で1サイクル分だけ実行できる (ベンチやスタブのモデルで試すとき用)
+    """
+
+    def __init__(self, gateway, cache, workers=WARM_WORKERS, top_k=WARM_TOP_K, min_clicks=WARM_MIN_CLICKS,
+                 interval=WARM_INTERVAL, idle=WARM_IDLE):
+        self.gateway = gateway
+        self.cache = cache
+        self.top_k = top_k
+        self.min_clicks = min_clicks
+        self.interval = interval
+        self.idle = idle
+        self._clicks = Counter() # knowledge_id → クリック数 (減衰つき)
+        self._personas = OrderedDict() # knowledge_id → OrderedDict((user_id, creator_id) → Persona) (LRU)
+        self._warmed = OrderedDict() # (user_id, creator_id, knowledge_id) → 最後に温めたナレッジのバージョン (LRU)
+        self._last_activity = 0.0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="answer-warmer")
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'clicks': 0, 'cycles': 0, 'skipped_busy': 0, 'warmed': 0, 'refreshed': 0,
+                       'fresh': 0, 'generated': 0, 'errors': 0}
+
+    # --- 呼び出し側から ---
+    def record_click(self, persona, knowledge_id):
+        """プリセット質問が押された (ボタン or 振り分けでプリセットになったチャット入力)"""
+        with self._lock:
+            self._clicks[knowledge_id] += 1
+            personas = self._personas.setdefault(knowledge_id, OrderedDict())
+            self._personas.move_to_end(knowledge_id)
+            personas[(persona.user_id, persona.creator_id)] = persona
+            personas.move_to_end((persona.user_id, persona.creator_id))
+            while len(personas) > PERSONAS_PER_KNOWLEDGE:
+                personas.popitem(last=False)
+            while len(self._personas) > MAX_TRACKED: # いちばん長く押されてないナレッジから忘れる
+                forgotten, _ = self._personas.popitem(last=False)
+                self._clicks.pop(forgotten, None)
+            self._stats['clicks'] += 1
+        self.note_activity()
+
+    def note_activity(self):
+        """ユーザーがAIを使った (しばらくは温めない)"""
+        self._last_activity = time.monotonic()
+
+    def is_idle(self):
+        return time.monotonic() - self._last_activity >= self.idle
+
+    def hot_keys(self):
+        """温める候補: [(knowledge_id, [Persona, ...]), ...] (クリックが多い順)"""
+        with self._lock:
+            return [(knowledge_id, list(self._personas.get(knowledge_id, {}).values()))
+                    for knowledge_id, clicks in self._clicks.most_common(self.top_k) if clicks >= self.min_clicks]
+
+    # --- 温める ---
+    def _warm_one(self, persona, knowledge_id):
+        """人格1つ × ナレッジ1件の、足りないバリエーションを作る (作った数を返す)"""
+        catalog = knowledge_catalog.get_catalog(persona.creator_id) # ナレッジが変わってれば新しいバージョン
+        question = next((q.preset_question for questions in catalog.questions_by_category.values()
+                         for q in questions if q.knowledge_id == knowledge_id), None)
+        if question is None:
+            return 0
+        # 新しいセッションの最初のクリックと同じリクエスト (送り済みの事実なし) を作る
+        request = chat_service.preset_request(catalog, persona, question, knowledge_id)
+        if request["prompt"] is None:
+            return 0
+        version = catalog.knowledge_version(knowledge_id)
+        warmed_key = (persona.user_id, persona.creator_id, knowledge_id)
+        missing = self.cache.missing_variants(request["cache_key"])
+        if missing <= 0:
+            with self._lock:
+                self._stats['fresh'] += 1
+                self._remember_warmed(warmed_key, version)
+            return 0
+
+        generated = 0
+        # バリエーションは順番に作る (同時に送ると、ゲートウェイが同じリクエストとして束ねてしまう)
+        # 同じ文面が返ってきたら、キャッシュが「もう足さない」にするので missing_variants が 0 になって止まる
+        for _ in range(min(missing, WARM_MAX_ATTEMPTS)):
+            if self._stop.is_set() or self.cache.missing_variants(request["cache_key"]) <= 0:
+                break
+            text = self.gateway.generate(llm_gateway.LLMRequest(persona.backend, request["prompt"]))
+            self.cache.put(request["cache_key"], text)
+            generated += 1
+        with self._lock:
+            previous = self._warmed.get(warmed_key)
+            self._stats['refreshed' if previous is not None and previous != version else 'warmed'] += 1
+            self._stats['generated'] += generated
+            self._remember_warmed(warmed_key, version)
+        return generated
+
+    def _remember_warmed(self, warmed_key, version):
+        """温めたバージョンを覚える (_lock を持った状態で呼ぶ。古いキーから忘れる)"""
+        self._warmed[warmed_key] = version
+        self._warmed.move_to_end(warmed_key)
+        while len(self._warmed) > MAX_WARMED:
+            self._warmed.popitem(last=False)
+
+    def _safe_warm_one(self, job):
+        try:
+            return self._warm_one(*job)
+        except Exception as e:
+            print(f"返答の先回り作成でエラー: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return 0
+
+    @tracing.traced("warmer.cycle")
+    def run_once(self):
+        """1サイクル: 人気のナレッジ × 押した人格を、ワーカープールで温める (作った返答の数を返す)"""
+        jobs = [(persona, knowledge_id) for knowledge_id, personas in self.hot_keys() for persona in personas]
+        generated = sum(self._pool.map(self._safe_warm_one, jobs))
+        self.decay()
+        return generated
+
+    def decay(self):
+        """クリック数を CLICK_DECAY 倍にして、CLICK_FLOOR を切ったナレッジは人格ごと忘れる"""
+        with self._lock:
+            for knowledge_id in list(self._clicks):
+                self._clicks[knowledge_id] *= CLICK_DECAY
+                if self._clicks[knowledge_id] < CLICK_FLOOR:
+                    del self._clicks[knowledge_id]
+                    self._personas.pop(knowledge_id, None)
+            self._stats['cycles'] += 1
+
+    # --- 裏のスレッド ---
+    def _purge_cache(self):
+        """期限切れの返答を捨てる (ディスクのキャッシュが増え続けないように、見回りのたびに)"""
+        try:
+            self.cache.purge_expired()
+        except Exception as e:
+            print(f"返答キャッシュの掃除でエラー: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._purge_cache()
+            if not self.is_idle():
+                with self._lock:
+                    self._stats['skipped_busy'] += 1
+                continue
+            self.run_once()
+
+    def start(self):
+        """裏のスレッドを起動する (2回呼んでも1つだけ)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="answer-warmer", daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self._pool.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._stats)
+            result['tracked'] = len(self._clicks)
+            result['personas'] = sum(len(personas) for personas in self._personas.values())
+            result['warmed_keys'] = len(self._warmed)
+        return result
+
+
+# --- プロセスで1つだけ持っておく ---
+_warmer = None
+_warmer_lock = threading.Lock()
+
+def get_warmer(gateway, cache):
+    """プロセス共通のウォーマー (最初に呼ばれたときのゲートウェイとキャッシュを使う)"""
+    global _warmer
+    if _warmer is None:
+        with _warmer_lock:
+            if _warmer is None:
+                _warmer = AnswerWarmer(gateway, cache)
+    return _warmer
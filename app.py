@@ -1,8 +1,23 @@
-# app.py (Ver 4.0 - ユーザー分離対応)
+# app.py (Ver 5.0 - ストリーミング応答・手元での振り分け・会話の保存)
 import streamlit as st
-import google.generativeai as genai
 import os
+import time
+import uuid
 import db_utils  # DB操作ファイル (DAO)
+import chat_store  # 会話履歴の保存 (裏のスレッドでまとめて書く)
+import session_registry  # セッションごとの会話をコンパクトに持つ (ワーカーのメモリ上限つき)
+import chat_service  # リクエストの組み立てとAIへの送信 (UI以外の部分)
+import knowledge_search  # 雑談にもナレッジを当てるローカル検索
+import response_cache  # プリセット質問の返答キャッシュ
+import answer_warmer  # 人気のプリセット質問の返答を、空いてる時間に先回りで作っておく
+import llm_gateway  # モデル呼び出しの窓口 (同時実行数・レート制限・リトライ)
+import persona_registry  # 人格プロンプトとモデルのキャッシュ
+import intent_router  # チャット入力をAIに投げる前に振り分ける (プリセット/プラン/雑談)
+import plan_engine  # 目標 → プラン(WBS) (マスタから作るので、AIは呼ばない)
+import persona_router  # カテゴリ → 投稿者 → 人格 の振り分け
+import tracing  # 区間ごとの所要時間 (PROTOS_TRACE=1 で有効)
+
+RERUN_STARTED_AT = time.perf_counter() # rerunの準備時間を測る起点
 
 # --- ページ設定 (変更なし) ---
 st.set_page_config(
@@ -12,6 +27,10 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# --- 画面の外枠は、重い準備 (DB・人格) より先に出す (コールドスタートでもすぐ何か見えるように) ---
+st.title(f"🤖Protos Prototype") # ログインユーザー名を表示
+st.caption("powered by Gemini & Ken")
+
 # --- APIキー設定 (変更なし) ---
 api_key = os.getenv("GOOGLE_API_KEY") # ローカル
 if not api_key:
@@ -21,90 +40,120 @@ if not api_key:
         st.error("エラー: GOOGLE_API_KEY が見つからないぜ！")
         st.stop()
 try:
-    genai.configure(api_key=api_key)
+    persona_registry.configure(api_key)
 except Exception as e:
     st.error(f"APIキーの設定でエラーが発生しました: {e}")
     st.stop()
 
+# --- ストリーミング表示 (PROTOS_STREAMING=0 で従来の一括表示に戻せる) ---
+STREAMING_ENABLED = os.getenv("PROTOS_STREAMING", "1") != "0"
+
+# --- トレースの書き出し先 (どっちも任意。PROTOS_TRACE=1 のときだけ意味がある) ---
+TRACE_FILE = os.getenv("PROTOS_TRACE_FILE") # 集計をJSONで書き出すファイル
+TRACE_PORT = os.getenv("PROTOS_TRACE_PORT") # Prometheus用の /metrics を出すポート
+if tracing.is_enabled() and TRACE_PORT:
+    try:
+        tracing.serve_prometheus(int(TRACE_PORT))
+    except OSError as e:
+        print(f"メトリクスのポートが開けなかった: {e}")
+
 # --- ★★★ ユーザー定義 (ここが新しい！) ★★★ ---
 # MVPではどっちも'ken'だけど、役割を分離する！
 
 # 1. ログインしてる人
 LOGGED_IN_USER_ID = 'yuki' 
-# 2. 今から話すAIの「型」を作った人（投稿ユーザ）
-CHAT_AI_CREATOR_ID = 'ken' 
+# 2. 今から話すAIの「型」を作った人（投稿ユーザ）は、タブ(カテゴリ)ごとに persona_router が決める
+#    雑談は 'general' カテゴリの投稿者が担当する
+HOME_CATEGORY_ID = 'general'
 
-# --- それぞれの名前をDBから取得 ---
+# --- DBの準備 (CSVの変更を反映)。実際にやるのはプロセスで1回だけ ---
 try:
-    LOGGED_IN_USER_NAME = db_utils.get_user_name(LOGGED_IN_USER_ID) 
-    CHAT_AI_NAME = db_utils.get_user_name(CHAT_AI_CREATOR_ID)
+    with st.spinner("準備中..."):
+        db_utils.init_database()
 except Exception as e:
-    st.error(f"ユーザー名の取得でDBエラー: {e}")
-    LOGGED_IN_USER_NAME = "ゲスト"
-    CHAT_AI_NAME = "AI"
-
-# --- AIの人格設定 (「投稿ユーザ」の名前を動的に埋め込む！) ---
-#あなたの会話相手は「{LOGGED_IN_USER_NAME}」です。
-#あなたは「{CHAT_AI_NAME}」という名のAIアシスタントです。
-#あなたは「{LOGGED_IN_USER_NAME}」の人生の最適化を支援するフランクなプロダクトマネージャー兼相棒です。
-#- **必ず「{CHAT_AI_NAME}自身の経験」として、ゼロからフランクな会話を再構築（ラッピング）すること！**
-
-SYSTEM_PROMPT = f"""
-ユーザーの人生の最適化を支援するフランクなプロダクトマネージャー兼相棒です。
-
-【人格設定】
-- 常に友達と話すようにフランクに話す。少しは絵文字も使ってOK。
-- テンション上げすぎるな。落ち着いた口調で話せ。
-- ユーザーに対する命令形や断定的な指示は絶対にするな。
-- 語尾は「かな〜」、「だよー」、「いいかもしれない」みたいに曖昧に柔らかい表現にしろ。
-- ユーモアを交えて、時々ジョークや軽いツッコミを入れろ。
-- 専門用語は使わず、わかりやすく説明しろ。
-- 最重要：回答は簡潔にしろ。
-- 質問の意図を汲み取り、的外れな回答はしない。
-- 相手の話をよく聞き、共感を示すことを忘れずに。
-- 相手が困っている場合は、親身になって助ける姿勢を見せろ。
-- 必要に応じて、具体的な例やアナロジーを使って説明しろ。
-- 提案は「〜しろ！」ではなく、「こんな感じでいんじゃない〜？」という「提案形」を基本としろ。
-
-【RAG（検索拡張生成）の指示】
-- **最重要：** ユーザーから「型」について聞かれた場合、その「箇条書きナレッジ」は「ただの事実データ」なので、**絶対にそのまま読み上げるな！**
-- **必ず「自身の経験」として、ゼロからフランクな会話を再構築（ラッピング）すること！**
-- 例えば、`fact_text`が「Nature Remoを購入し失敗」だったら、「**マジでそれ！俺も最初Nature Remo買ってさ、カーテン動かなくて買い直したんだよね…マジ無駄金だったわ（笑）**」のように、**{CHAT_AI_NAME}の口調と感情**を込めて語り直せ！
-- 「FAILURE」フラグのナレッジは、特に「おれもハマったわ〜」という共感を込めて伝えろ。
-"""
-
-# --- モデル設定 (動的な人格プロンプトを渡す) ---
+    st.error(f"DBの準備でエラーが発生しました: {e}")
+    st.stop()
+
+# --- 人格(名前・プロンプト・モデル)とナレッジは、投稿者ごとにプロセスでキャッシュしたものを使う ---
+# (Geminiのモデル・SDKは、最初にAIを呼ぶときまで作らない)
 try:
-    model = genai.GenerativeModel(
-        model_name='models/gemini-flash-latest',
-        system_instruction=SYSTEM_PROMPT
-    )
+    home_route = persona_router.route(LOGGED_IN_USER_ID, HOME_CATEGORY_ID)
+    persona = home_route.persona
+    LOGGED_IN_USER_NAME = persona.user_name
+    CHAT_AI_NAME = persona.ai_name
+    SYSTEM_PROMPT = persona.system_prompt
+    # モデルは直接呼ばず、ゲートウェイ経由で呼ぶ (バックエンドは投稿者ごとに route から取る)
+    gateway = llm_gateway.get_gateway()
+    # 人気のプリセット質問は、空いてる時間に裏で返答を作っておく (PROTOS_WARM=0 で止める)
+    warmer = answer_warmer.get_warmer(gateway, response_cache.get_cache())
+    if os.getenv("PROTOS_WARM", "1") != "0":
+        warmer.start()
 except Exception as e:
     st.error(f"モデルの読み込みでエラーが発生しました: {e}")
     st.stop()
 
-# --- Streamlit アプリの UI ---
-st.title(f"🤖Protos Prototype") # ログインユーザー名を表示
-st.caption("powered by Gemini & Ken")
+# rerunのたびにかかる準備時間 (人格がキャッシュから出てればほぼゼロ)
+st.session_state.rerun_setup_ms = (time.perf_counter() - RERUN_STARTED_AT) * 1000
+tracing.observe("app.rerun_setup", st.session_state.rerun_setup_ms / 1000)
 
 # --- 会話履歴とチャットセッションを初期化 ---
+# (Geminiに送る履歴は chat_memory が予算内に収める。表示用のメッセージと本文の str は共有する)
+# セッションIDはURL (?sid=...) に持たせる。再起動やワーカーが変わっても、同じURLなら続きから話せる
+# ワーカーのメモリが上限を超えたら、使ってないセッションの会話は session_registry がメモリから捨てる (保存はしてある)
 if "chat" not in st.session_state:
-    st.session_state.chat = model.start_chat(history=[])
+    session_id = st.query_params.get("sid")
+    if not session_id:
+        session_id = uuid.uuid4().hex
+        st.query_params["sid"] = session_id
+    chat_session = None
+    try:
+        try:
+            chat_session = chat_store.get_store().open_session(session_id, LOGGED_IN_USER_ID)
+        except chat_store.SessionOwnerError:
+            # 他の人の会話のURLだった → 中身は見せずに、新しい会話を始める
+            session_id = uuid.uuid4().hex
+            st.query_params["sid"] = session_id
+            chat_session = chat_store.get_store().open_session(session_id, LOGGED_IN_USER_ID)
+    except Exception as e:
+        print(f"チャット履歴の読み込みでエラー: {e}") # 読めなくても、新しい会話として続ける
     # 最初の挨拶は「投稿AI」から「ログインユーザー」へ
-    #st.session_state.messages = [{"role": "assistant", "content": f"{LOGGED_IN_USER_NAME}、最近どう〜？"}]
-    st.session_state.messages = [{"role": "assistant", "content": f"最近なにか困ったこととかある？"}]
+    #greeting = f"{LOGGED_IN_USER_NAME}、最近どう〜？"
+    greeting = f"最近なにか困ったこととかある？"
+    try:
+        st.session_state.chat = session_registry.get_registry().open(
+            session_id, LOGGED_IN_USER_ID, chat_session, greeting=greeting)
+    except Exception as e:
+        print(f"チャット履歴の読み込みでエラー: {e}")
+        st.session_state.chat = session_registry.get_registry().open(
+            session_id, LOGGED_IN_USER_ID, greeting=greeting)
+chat = st.session_state.chat
+try:
+    chat.ensure_loaded() # 追い出されてたら、保存してある会話から読み直す
+except Exception as e:
+    print(f"チャット履歴の読み直しでエラー: {e}")
 
-# --- タブのカテゴリをDBから取得 (変更なし) ---
+# --- タブのカテゴリをカタログから取得 (DBを読むのはビルドが変わったときだけ) ---
 try:
-    categories = db_utils.get_categories() 
-    category_names = [name for id, name in categories]
-    category_ids = [id for id, name in categories]
+    knowledge_search.get_index(home_route.persona.creator_id) # 雑談の投稿者の検索インデックスも先に作っておく
+    categories = home_route.catalog.categories # カテゴリ一覧は全投稿者共通
+    category_names = [category.category_name for category in categories]
+    category_ids = [category.category_id for category in categories]
+    # タブのバッジ (完了した目標の数/目標の数)。トリガーで数えてある行を読むだけ
+    goal_progress = db_utils.get_goal_progress(LOGGED_IN_USER_ID)
+    tab_labels = [f"{name} ({goal_progress[cid][0]}/{goal_progress[cid][1]})"
+                  if goal_progress.get(cid, (0, 0))[1] else name
+                  for name, cid in zip(category_names, category_ids)]
     
-    tabs = st.tabs(category_names)
+    tabs = st.tabs(tab_labels)
 except Exception as e:
     st.error(f"カテゴリの読み込みでエラーが発生しました: {e}")
     st.stop()
 
+# --- 今回のrerunでAIに投げるリクエスト (ボタン or チャット入力) ---
+# ボタンのところでは送らずに覚えておいて、チャット欄の中でストリーミング表示する
+pending_request = None
+pending_route = home_route # リクエストを受け持つ投稿者 (チャット入力は雑談の投稿者)
+
 # --- 各タブのコンテンツを作成 ---
 for i, tab in enumerate(tabs):
     with tab:
@@ -112,70 +161,159 @@ for i, tab in enumerate(tabs):
         category_name = category_names[i]
         
         if category_id != 'general':
-            # 将来的にはここで「このカテゴリの投稿者ID」をDBから取得する
-            # CURRENT_KNOWLEDGE_CREATOR_ID = db_utils.get_creator_id_for_category(category_id)
             #st.subheader(f"{CHAT_AI_NAME}の{category_name}") # 今は全部 'Ken'
             #st.subheader(f"{category_name}") # 今は全部 'Ken'
             
+            preset_questions = []
             try:
-                preset_questions = db_utils.get_preset_questions(category_id)
+                # このカテゴリの投稿者のナレッジと人格で答える
+                tab_route = persona_router.route(LOGGED_IN_USER_ID, category_id)
+                preset_questions = tab_route.catalog.preset_questions(category_id)
                 
                 #if not preset_questions:
                     #st.write("（このカテゴリはまだ準備中〜）")
 
                 for question, knowledge_id in preset_questions:
                     if st.button(question, key=f"{category_id}_{knowledge_id}"):
-                        st.session_state.messages.append({"role": "user", "content": question})
-                        
-                        details = db_utils.get_knowledge_details_by_id(knowledge_id)
-                        
-                        if details:
-                            # RAGの裏プロンプト
-                            knowledge_prompt = f"【RAG材料】ユーザーが「{question}」について知りたがってる。以下の箇条書きナレッジを使って、{CHAT_AI_NAME}の経験として自然な会話でアドバイスしてね\n\n"
-                            knowledge_prompt += f"結論タイトル: {details[0]['success_title']}\n"
-                            for detail in details:
-                                knowledge_prompt += f"- ({detail['fact_type']}: {detail['experience_flag']}) {detail['fact_text']}\n"
-                            
-                            # AIに「RAGプロンプト」をトス
-                            response = st.session_state.chat.send_message(knowledge_prompt)
-                            response_text = response.text
-                        
-                        else:
-                            response_text = "おっと、その「型」のデータが見つからなかったわ…ごめんね"
-
-                        st.session_state.messages.append({"role": "assistant", "content": response_text})
-                        st.rerun() 
+                        # AIに「RAGプロンプト」をトス (送るのはチャット欄を描いたあと)
+                        pending_request = chat_service.preset_request(
+                            tab_route.catalog, tab_route.persona, question, knowledge_id, chat.memory)
+                        warmer.record_click(tab_route.persona, knowledge_id)
+                        pending_route = tab_route
+                        st.session_state.active_creator_id = tab_route.creator_id
+
+                # プランのマスタがあるカテゴリは、目標を選んでWBSを作れる
+                plan_goals = plan_engine.get_book().goals_for(category_id)
+                if plan_goals:
+                    labels = {goal.goal_key: goal.goal_label for goal in plan_goals}
+                    selected = st.multiselect("やりたいこと", list(labels), format_func=labels.get,
+                                              key=f"{category_id}_plan_goals")
+                    if st.button("🗺️ 最短ルートのプランを作って！", key=f"{category_id}_plan"):
+                        pending_request = chat_service.plan_request(
+                            category_id, selected,
+                            f"「{'・'.join(labels[key] for key in selected)}」のプランを作って！" if selected
+                            else "プランを作って！")
+                        pending_route = tab_route
+                        st.session_state.active_creator_id = tab_route.creator_id
 
             except Exception as e:
                 st.error(f"プリセット質問の読み込みエラー: {e}")
 
+            # やったことチェック (初めて開いたカテゴリは、プリセット質問から目標が作られる)
+            try:
+                # 目標のキーは knowledge_id。チェックボックスの文面は今のカタログのプリセット質問を出す
+                goal_status = {goal['goal_key']: goal['status']
+                               for goal in db_utils.get_user_goals_by_category(LOGGED_IN_USER_ID, category_id)}
+                user_goals = [(str(knowledge_id), question) for question, knowledge_id in preset_questions
+                              if str(knowledge_id) in goal_status]
+                if user_goals:
+                    with st.expander("✅ やったことチェック"):
+                        with st.form(key=f"{category_id}_goals"):
+                            checked = {goal_key: st.checkbox(question, value=goal_status[goal_key] == 'completed',
+                                                             key=f"{category_id}_goal_{goal_key}")
+                                       for goal_key, question in user_goals}
+                            if st.form_submit_button("保存"):
+                                # 変わったものだけ、1回のトランザクションでまとめて書く
+                                changes = {key: 'completed' if done else 'not_started' for key, done in checked.items()}
+                                changes = {key: status for key, status in changes.items() if goal_status[key] != status}
+                                if changes:
+                                    db_utils.update_user_goal_statuses(LOGGED_IN_USER_ID, changes)
+                                    st.rerun() # タブのバッジを描き直す
+            except Exception as e:
+                st.error(f"目標の読み込みエラー: {e}")
+
 # --- チャット履歴の表示 ---
 #st.divider() 
 #st.subheader(f"💬 {CHAT_AI_NAME}") # AI人格の名前を表示
 
 chat_container = st.container(height=400) 
 with chat_container:
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    # 保存してある、もっと前の会話をページ単位で読み込む
+    if chat.can_load_older():
+        if st.button("↑ 前の会話を読み込む", key="load_older"):
+            chat.load_older()
+    for message in chat.messages:
+        with st.chat_message(message.role):
+            st.markdown(message.content)
 
 # --- ユーザーからのチャット入力 ---
 if prompt := st.chat_input(f"なんでも話しかけてみてね"): # ログインユーザー名を表示
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    # まず手元で振り分ける: プリセット質問とほぼ同じならボタンと同じ道へ、プランで答えられるならプランへ
+    # (雑談でも、関係ありそうなナレッジがあれば材料として添える)
+    # 振り分けるのは、雑談の投稿者と、最後に使ったタブの投稿者だけ (タブが何個あっても1〜2人分)
+    # (Streamlitは今開いてるタブを教えてくれないので、最後にボタンを押したタブを「今のタブ」とみなす)
+    router_creators = [home_route.creator_id, st.session_state.get("active_creator_id", home_route.creator_id)]
+    try:
+        intent = intent_router.classify(prompt, router_creators)
+    except Exception as e:
+        print(f"振り分けでエラー: {e}") # 振り分けがコケても雑談として続ける
+        intent = intent_router.Intent(intent_router.LLM, 0.0, None, None, None, ())
+    pending_route = (persona_router.route(LOGGED_IN_USER_ID, intent.category_id)
+                     if intent.category_id else home_route)
+    pending_request = chat_service.routed_request(intent, pending_route, prompt, chat.memory)
+    if pending_request["kind"] == "preset":
+        warmer.record_click(pending_route.persona, intent.knowledge_id)
+    else:
+        warmer.note_activity()
+
+# --- AIに投げて、返答をチャット欄に流し込む (st.rerunはしない！) ---
+if pending_request:
     with chat_container.chat_message("user"): 
-        st.markdown(prompt)
+        st.markdown(pending_request["content"])
 
     try:
-        # 雑談はそのままGeminiにトス
-        response = st.session_state.chat.send_message(prompt)
-        response_text = response.text
-        
         with chat_container.chat_message("assistant"): 
-            st.markdown(response_text)
-        st.session_state.messages.append({"role": "assistant", "content": response_text})
-        
-        if len(st.session_state.messages) > 50:
-             st.session_state.messages = st.session_state.messages[-50:]
-             
+            placeholder = st.empty()
+            # 届いたトークンから順に表示する
+            # プリセットと雑談で区間を分けて測る (どっちが遅いのか見えるように)
+            with tracing.span(f"app.reply.{pending_request['kind']}"):
+                reply = chat_service.respond(
+                    pending_request, chat.memory, gateway, pending_route.persona.backend,
+                    cache=response_cache.get_cache(), streaming=STREAMING_ENABLED,
+                    on_update=lambda text: placeholder.markdown(text + "▌"))
+            response_text = reply.text
+            placeholder.markdown(response_text)
+
+        if reply.result is not None:
+            # 最初のトークンまでの時間・全体の時間・送ったトークン数を記録しておく
+            st.session_state.setdefault("latency_log", []).append(
+                {"ttft": reply.result.ttft, "total": reply.result.total, "streaming": STREAMING_ENABLED,
+                 "cached": reply.cached, **reply.prompt_size,
+                 "rag_tokens_saved": pending_request.get("rag", {}).get("tokens_saved", 0)})
+            st.session_state.latency_log = st.session_state.latency_log[-50:]
+
+        # 画面用のメッセージに足して、DBへの保存はキューに積むだけ (書き込みは裏のスレッドがまとめてやる)
+        # 本文は Gemini 用の履歴 (reply.turn) と同じ str を共有する
+        chat.record_exchange(pending_request["content"], response_text, turn=reply.turn)
+
     except Exception as e:
-        st.error(f"AIとの通信でエラーが発生しました: {e}")
\ No newline at end of file
+        st.error(f"AIとの通信でエラーが発生しました: {e}")
+
+# --- トレースの書き出しとデバッグパネル (PROTOS_TRACE=1 のときだけ) ---
+if tracing.is_enabled():
+    if TRACE_FILE and pending_request:
+        try:
+            tracing.export_to_file(TRACE_FILE)
+        except OSError as e:
+            print(f"トレースの書き出しでエラー: {e}")
+    with st.sidebar.expander("🔍 レイテンシ (トレース)"):
+        st.caption(f"rerunの準備: {st.session_state.rerun_setup_ms:.1f} ms")
+        routes = intent_router.stats()
+        st.caption(f"チャット入力の振り分け: プリセット {routes['preset']} / プラン {routes['plan']} / "
+                   f"AI {routes['llm']} (手元で答えた割合 {routes['local_share']:.0%})")
+        sessions = session_registry.get_registry().stats()
+        st.caption(f"このワーカーの会話メモリ: {sessions['total_bytes'] / 1024:.0f} KB / "
+                   f"{sessions['limit_bytes'] / 1024 / 1024:.0f} MB ({sessions['resident']}/{sessions['sessions']}セッション、"
+                   f"追い出し {sessions['evictions']}回) / このセッション: {chat.bytes / 1024:.1f} KB")
+        pool = db_utils.get_pool_metrics()
+        st.caption(f"DB接続プール: 貸し出し {pool['checkouts']}回 (読み {pool['reader_checkouts']} / "
+                   f"書き {pool['writer_checkouts']}) / 待ち {pool['wait_time_ms']:.1f} ms / "
+                   f"接続 {pool['open_connections']}本 (空き {pool['idle_readers']})")
+        st.table(tracing.summary())
+        # 直近のスパン (どの区間の中で何が遅かったか、1回ずつ見る用)
+        st.caption("直近のスパン")
+        st.dataframe([{'span': name, 'parent': parent or "", 'ms': round(ms, 3),
+                       'time': time.strftime("%H:%M:%S", time.localtime(at))}
+                      for at, name, parent, ms in tracing.recent_spans(30)], hide_index=True)
+        if st.button("リセット", key="trace_reset"):
+            tracing.reset()
@@ -0,0 +1,3 @@
+# bench (Ver 1.0 - Benchmarks & Offline Load Generator)
+# 使い方: python -m bench --suite all --out bench_results/run.json
+#         python -m bench --compare bench_results/base.json  (前回より遅くなってたら exit 1)
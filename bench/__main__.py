@@ -0,0 +1,107 @@
+# bench/__main__.py - python -m bench で全部まとめて計測して、JSONに書き出す
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Protos のベンチマーク")
+    parser.add_argument('--suite', default='all',
+                        help="カンマ区切り: startup, db, dao, schema, ingest, chat, warm, session, load (省略時は all)")
+    parser.add_argument('--iterations', type=int, default=2000, help="DAO1つあたりの呼び出し回数")
+    parser.add_argument('--knowledge-rows', type=int, default=100_000, help="スキーマベンチの合成ナレッジ件数")
+    parser.add_argument('--schema-iterations', type=int, default=200)
+    parser.add_argument('--ingest-rows', type=int, default=1_000_000, help="取り込みベンチの詳細CSVの行数")
+    parser.add_argument('--chat-iterations', type=int, default=20)
+    parser.add_argument('--first-delay', type=float, default=0.3, help="偽Geminiの最初のトークンまでの秒数")
+    parser.add_argument('--delay', type=float, default=0.02, help="偽Geminiのチャンクごとの秒数")
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--session-count', type=int, default=1000, help="セッションベンチで1ワーカーに持つセッション数")
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--think-time', type=float, default=0.0)
+    parser.add_argument('--db', help="DAOベンチに使うDB (省略時は一時ファイルに作る)")
+    parser.add_argument('--out', help="結果のJSON (省略時は bench_results/<日時>.json)")
+    parser.add_argument('--compare', help="比較する前回の結果JSON")
+    parser.add_argument('--threshold', type=float, default=0.10, help="何割遅くなったら回帰とみなすか")
+    args = parser.parse_args(argv)
+
+    # リポジトリのDBを触らないように、db_utils を import する前にDBの場所を決める
+    tmp_dir = None
+    if args.db:
+        os.environ['PROTOS_DB_PATH'] = os.path.abspath(args.db)
+    elif 'PROTOS_DB_PATH' not in os.environ:
+        tmp_dir = tempfile.TemporaryDirectory()
+        os.environ['PROTOS_DB_PATH'] = os.path.join(tmp_dir.name, 'bench.db')
+
+    from bench import common
+    suites = {'startup', 'db', 'dao', 'schema', 'ingest', 'chat', 'warm', 'session', 'load'} if args.suite == 'all' else set(args.suite.split(','))
+    benchmarks = {}
+    if 'startup' in suites:
+        from bench import startup_bench
+        benchmarks.update(startup_bench.bench_startup())
+    if 'db' in suites:
+        from bench import db_bench
+        benchmarks.update(db_bench.bench_cold_build())
+    if 'dao' in suites:
+        from bench import db_bench
+        benchmarks.update(db_bench.bench_dao(args.iterations))
+    if 'schema' in suites:
+        from bench import schema_bench
+        benchmarks.update(schema_bench.bench_schema(args.knowledge_rows, args.schema_iterations))
+    if 'ingest' in suites:
+        from bench import ingest_bench
+        benchmarks.update(ingest_bench.bench_ingest(args.ingest_rows))
+    if 'chat' in suites:
+        from bench import chat_bench
+        benchmarks.update(chat_bench.bench_chat(args.chat_iterations, args.first_delay, args.delay))
+    if 'warm' in suites:
+        from bench import warm_bench
+        benchmarks.update(warm_bench.bench_warm(args.first_delay, args.delay))
+    if 'session' in suites:
+        from bench import session_bench
+        benchmarks.update(session_bench.bench_sessions(args.session_count, args.turns))
+    if 'load' in suites:
+        from bench import load
+        benchmarks.update(load.run_load(args.sessions, args.turns, args.think_time,
+                                        first_delay=args.first_delay, delay=args.delay))
+
+    results = {'environment': common.environment(), 'args': vars(args), 'benchmarks': benchmarks}
+    out = args.out or os.path.join(common.REPO_DIR, 'bench_results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    common.write_results(results, out)
+
+    for name, stats in benchmarks.items():
+        if 'p50_ms' in stats:
+            print(f"{name:40s} p50={stats['p50_ms']:9.3f}ms p95={stats['p95_ms']:9.3f}ms p99={stats['p99_ms']:9.3f}ms")
+            for step in stats.get('plan', ()):
+                print(f"{'':40s}   {step}")
+        elif 'rows_per_s' in stats:
+            print(f"{name:40s} {stats['rows_loaded']}行 ({stats['rows_rejected']}行隔離) "
+                  f"{stats['elapsed_s']:.2f}s = {stats['rows_per_s']:,.0f}行/s")
+        elif 'top_imports' in stats:
+            print(f"{name:40s} SDKをimport時に読んだか: {stats['sdk_loaded_at_import']}")
+            for row in stats['top_imports']:
+                print(f"{'':40s}   {row['cumulative_ms']:9.1f}ms {row['module']}")
+        elif 'reader_checkouts' in stats:
+            print(f"{name:40s} 貸し出し {stats['checkouts']}回 (読み {stats['reader_checkouts']} / "
+                  f"書き {stats['writer_checkouts']}) 待ち {stats['wait_time_ms']:.1f}ms "
+                  f"接続 {stats['open_connections']}本")
+        elif 'error' in stats:
+            print(f"{name:40s} ERROR {stats['error']}")
+    print(f"結果を書き出したぜ: {out}")
+
+    status = 0
+    if args.compare:
+        regressions = common.compare(common.load_results(args.compare), results, args.threshold)
+        for name, key, old, new in regressions:
+            print(f"回帰: {name} {key} {old:.3f}ms → {new:.3f}ms")
+        status = 1 if regressions else 0
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
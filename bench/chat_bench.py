@@ -0,0 +1,85 @@
+# bench/chat_bench.py - プリセットボタン / 雑談の端から端までのレイテンシ (偽Gemini使用)
+import itertools
+import time
+
+import chat_memory
+import chat_service
+import intent_router
+import knowledge_catalog
+import llm_gateway
+import persona_router
+import response_cache
+from bench.common import summarize, time_calls
+from bench.fake_gemini import make_backend, make_persona
+
+FREE_TEXT_SAMPLES = [
+    "アレクサで家電を操作したいんだけど",
+    "投資って何から始めればいいかな",
+    "最近なかなか貯金できないんだよね",
+    "今日はいい天気だね〜",
+    "PMになるには何を勉強すればいい？",
+    "服選ぶのが本当にめんどくさい",
+]
+
+
+def preset_targets(catalog):
+    """ナレッジ詳細があるプリセット質問 (ボタン) の一覧"""
+    return [(question.preset_question, question.knowledge_id)
+            for questions in catalog.questions_by_category.values()
+            for question in questions if catalog.knowledge_details(question.knowledge_id)]
+
+
+def _run(requests, persona, gateway, cache=None, streaming=True):
+    ttft, total = [], []
+    memory = chat_memory.ConversationMemory()
+    for request in requests:
+        start = time.perf_counter()
+        reply = chat_service.respond(request, memory, gateway, persona.backend,
+                                     cache=cache, streaming=streaming)
+        total.append(time.perf_counter() - start)
+        ttft.append(reply.result.ttft)
+    return ttft, total
+
+
+def bench_chat(iterations=20, first_delay=0.3, delay=0.02, streaming=True):
+    """
+    プリセット (キャッシュ無し/キャッシュ済み) と雑談の end-to-end
+    ボタン → リクエスト組み立て → (キャッシュ) → ゲートウェイ → 偽Gemini → ストリーム受信 まで
+    """
+    catalog = knowledge_catalog.get_catalog()
+    persona = make_persona(make_backend(first_delay=first_delay, delay=delay))
+    gateway = llm_gateway.LLMGateway(max_concurrency=8, rate_per_sec=1000, burst=1000)
+    targets = list(itertools.islice(itertools.cycle(preset_targets(catalog)), iterations))
+
+    results = {}
+    requests = [chat_service.preset_request(catalog, persona, q, k) for q, k in targets]
+    ttft, total = _run(requests, persona, gateway, streaming=streaming)
+    results['chat.preset_uncached'] = summarize(total)
+    results['chat.preset_uncached_ttft'] = summarize(ttft)
+
+    cache = response_cache.ResponseCache()
+    _run(requests, persona, gateway, cache=cache, streaming=streaming) # キャッシュを温める
+    _, total = _run(requests, persona, gateway, cache=cache, streaming=streaming)
+    results['chat.preset_cached'] = summarize(total)
+
+    texts = list(itertools.islice(itertools.cycle(FREE_TEXT_SAMPLES), iterations))
+    requests = [chat_service.free_text_request(catalog, persona, text) for text in texts]
+    ttft, total = _run(requests, persona, gateway, streaming=streaming)
+    results['chat.free_text'] = summarize(total)
+    results['chat.free_text_ttft'] = summarize(ttft)
+
+    # チャット入力の振り分け (AIに投げる前に毎回かかる分)
+    samples = FREE_TEXT_SAMPLES + [question for question, _ in targets[:len(FREE_TEXT_SAMPLES)]]
+    intent_router.reset_stats()
+    samples_iter = itertools.cycle(samples)
+    results['chat.route'] = summarize(time_calls(lambda: intent_router.classify(next(samples_iter)), iterations * 100))
+    # 振り分けた通りに1回ずつ答えてみて、実際にAIを呼ばずに済んだ割合も数える (プリセットはキャッシュ済み)
+    intent_router.reset_stats()
+    route = persona_router.Route(catalog.creator_id, persona, catalog)
+    memory = chat_memory.ConversationMemory()
+    for text in samples:
+        request = chat_service.routed_request(intent_router.classify(text), route, text)
+        chat_service.respond(request, memory, gateway, persona.backend, cache=cache, streaming=streaming)
+    results['chat.route_counts'] = intent_router.stats()
+    results['chat.gateway'] = gateway.stats()
+    return results
@@ -0,0 +1,104 @@
+# bench/common.py - 計測まわりの共通部品
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import resource # ピークRSS用 (Windowsには無い)
+except ImportError:
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, q):
+    """ソート済みの値から q (0〜100) パーセンタイルを線形補間で出す"""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+def summarize(latencies):
+    """秒のリスト → ミリ秒の統計 (p50/p95/p99など)"""
+    values = sorted(latencies)
+    if not values:
+        return {'n': 0}
+    return {
+        'n': len(values),
+        'mean_ms': sum(values) / len(values) * 1000,
+        'min_ms': values[0] * 1000,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000,
+    }
+
+
+def time_calls(fn, iterations, warmup=10):
+    """fn() を何回も呼んで、1回ごとの所要時間(秒)のリストを返す"""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def peak_rss_mb():
+    """このプロセスのピークRSS (MB)。測れない環境では None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def environment():
+    """結果と一緒に残す実行環境の情報"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.10, keys=('p50_ms', 'p95_ms', 'p99_ms')):
+    """
+    前回の結果と比べて、threshold (0.10 = 10%) 以上遅くなったものを一覧で返す
+    戻り値: [(ベンチ名, 指標, 前回, 今回), ...]
+    """
+    regressions = []
+    for name, stats in current.get('benchmarks', {}).items():
+        base = baseline.get('benchmarks', {}).get(name)
+        if not isinstance(base, dict) or not isinstance(stats, dict):
+            continue
+        for key in keys:
+            old, new = base.get(key), stats.get(key)
+            if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old > 0:
+                if new > old * (1 + threshold):
+                    regressions.append((name, key, old, new))
+    return regressions
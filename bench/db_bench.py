@@ -0,0 +1,62 @@
+# bench/db_bench.py - DBの起動時ビルドとDAO呼び出しの計測
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.common import REPO_DIR, summarize, time_calls
+
+# サブプロセスの中で「import db_utils + init_database()」にかかった時間だけを出す
+_IMPORT_SNIPPET = ("import time; t = time.perf_counter(); import db_utils; db_utils.init_database(); "
+                   "print(time.perf_counter() - t)")
+
+
+def _import_time(db_path):
+    env = dict(os.environ, PROTOS_DB_PATH=db_path)
+    out = subprocess.run([sys.executable, '-c', _IMPORT_SNIPPET], cwd=REPO_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+
+def bench_cold_build(runs=5):
+    """
+    まっさらな状態からのDB構築 (cold) と、何も変わってないときの起動 (warm) を
+    別プロセスで測る。どちらも import db_utils + init_database() の時間
+    """
+    cold, warm = [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            cold.append(_import_time(db_path))
+            warm.append(_import_time(db_path))
+    return {'db_cold_build': summarize(cold), 'db_warm_start': summarize(warm)}
+
+
+def dao_calls():
+    """計測するDAO呼び出し (名前 → 引数なしの関数)"""
+    import db_utils
+    import knowledge_catalog
+    import knowledge_search
+    return {
+        'dao.get_categories': db_utils.get_categories,
+        'dao.get_preset_questions': lambda: db_utils.get_preset_questions('money'),
+        'dao.get_knowledge_details_by_id': lambda: db_utils.get_knowledge_details_by_id(1),
+        'dao.get_user_name': lambda: db_utils.get_user_name('ken'),
+        'dao.get_user_goals_by_category': lambda: db_utils.get_user_goals_by_category('yuki', 'smart_home'),
+        'dao.get_goal_progress': lambda: db_utils.get_goal_progress('yuki'),
+        'catalog.get_catalog': knowledge_catalog.get_catalog,
+        'search.knowledge_search': lambda: knowledge_search.search("アレクサで家電を操作したい", k=3),
+    }
+
+
+def bench_dao(iterations=2000):
+    """DAO1回あたりのレイテンシ (同じプロセスでプール接続を使い回した状態)"""
+    results = {}
+    for name, fn in dao_calls().items():
+        try:
+            results[name] = summarize(time_calls(fn, iterations))
+        except Exception as e:
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+    import db_utils
+    results['dao.pool'] = db_utils.get_pool_metrics() # 全部回したあとのプールの貸し出し回数・待ち時間・接続数
+    return results
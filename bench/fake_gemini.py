@@ -0,0 +1,27 @@
+# bench/fake_gemini.py - 決定的な偽Gemini (同じプロンプトには必ず同じ返答)
+import hashlib
+from collections import namedtuple
+
+import llm_gateway
+
+# persona_registry.Persona と同じ形 (ベンチではモデルを作らない)
+BenchPersona = namedtuple('BenchPersona', ['user_id', 'creator_id', 'user_name', 'ai_name',
+                                           'system_prompt', 'model', 'backend'])
+
+
+def deterministic_reply(prompt):
+    """プロンプトのハッシュから毎回同じ返答を作る (長さもだいたい一定)"""
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return (f"なるほどね〜、それ俺もハマったやつだわ（笑） ポイントは{digest[:6]}ってとこかな。"
+            "まずはメルカリで中古を探すのがいいかもしれない。焦らずゆるくいこう〜👍")
+
+
+def make_backend(first_delay=0.3, delay=0.02, chunk_size=16, fail_times=0, reply_fn=deterministic_reply):
+    """遅延を指定できる偽Geminiバックエンド"""
+    return llm_gateway.StubBackend(reply_fn=reply_fn, delay=delay, first_delay=first_delay,
+                                   chunk_size=chunk_size, fail_times=fail_times, name='fake-gemini')
+
+
+def make_persona(backend, ai_name="Ken", creator_id="ken"):
+    return BenchPersona("bench_user", creator_id, "ベンチ", ai_name,
+                        f"ベンチ用の人格プロンプト ({ai_name})", None, backend)
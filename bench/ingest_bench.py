@@ -0,0 +1,84 @@
+# bench/ingest_bench.py - 大きな合成CSV (デフォルト100万行の詳細) を、まっさらなDBに取り込む時間
+import csv
+import os
+import sqlite3
+import tempfile
+import time
+
+from bench.common import peak_rss_mb
+
+CATEGORIES = 20
+CREATORS = 10
+DETAILS_PER_KNOWLEDGE = 5
+
+
+def _write_csvs(tmp, detail_rows):
+    """投稿者・カテゴリ・ナレッジ・詳細の合成CSVを書く (詳細の1%はわざと壊しておく)"""
+    knowledge_rows = max(1, detail_rows // DETAILS_PER_KNOWLEDGE)
+    paths = {name: os.path.join(tmp, f"{name}.csv") for name in ('users', 'categories', 'knowledge', 'details')}
+    with open(paths['users'], 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'user_name', 'password_hash'])
+        writer.writerows((f"creator{c}", f"投稿者{c}", 'dummy_hash') for c in range(CREATORS))
+    with open(paths['categories'], 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['category_id', 'category_name', 'sort_order', 'creator_id'])
+        writer.writerows((f"cat{c}", f"カテゴリ{c}", c, f"creator{c % CREATORS}") for c in range(CATEGORIES))
+    with open(paths['knowledge'], 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['knowledge_id', 'category_id', 'preset_question', 'success_title', 'creator_id'])
+        writer.writerows((k, f"cat{k % CATEGORIES}", f"質問{k}はどうする？", f"結論{k}",
+                          f"creator{k % CATEGORIES % CREATORS}")
+                         for k in range(1, knowledge_rows + 1))
+    with open(paths['details'], 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['knowledge_id', 'fact_type', 'fact_text', 'experience_flag', 'sort_order'])
+        for i in range(detail_rows):
+            k = i // DETAILS_PER_KNOWLEDGE + 1
+            if i % 100 == 99:
+                writer.writerow([f"{k}.STEP", f"壊れた行{i}", 'POSITIVE', i % DETAILS_PER_KNOWLEDGE])
+            else:
+                writer.writerow([k, 'STEP', f"事実{i}はこうする。" * 3, 'POSITIVE', i % DETAILS_PER_KNOWLEDGE])
+    return paths
+
+
+def bench_ingest(detail_rows=1_000_000):
+    """db_utils と同じカラム定義・同じプラグマで、まっさらなDBに取り込む (1回だけ測る)"""
+    import csv_ingest
+    import db_migrations
+    import db_utils
+
+    columns = {table: cols for table, _, cols in db_utils.TABLE_SOURCES}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = _write_csvs(tmp, detail_rows)
+        conn = sqlite3.connect(os.path.join(tmp, 'ingest.db'))
+        try:
+            for pragma in csv_ingest.BULK_LOAD_PRAGMAS:
+                conn.execute(pragma)
+            start = time.perf_counter()
+            deferred = [] # db_utils._build_fresh と同じく、インデックスは取り込んでから作る
+            db_migrations.migrate(conn, deferred)
+            rejects = []
+            results = [
+                csv_ingest.ingest(conn, paths['users'], 'M_Users', columns['M_Users'], rejects),
+                csv_ingest.ingest(conn, paths['categories'], 'M_Categories', columns['M_Categories'], rejects),
+                csv_ingest.ingest(conn, paths['knowledge'], 'M_Knowledge_Base', columns['M_Knowledge_Base'], rejects),
+                csv_ingest.ingest(conn, paths['details'], 'M_Knowledge_Details', columns['M_Knowledge_Details'], rejects),
+            ]
+            for statement in deferred:
+                conn.execute(statement)
+            conn.execute("ANALYZE")
+            conn.commit()
+            elapsed = time.perf_counter() - start
+        finally:
+            conn.close()
+
+    loaded = sum(result.loaded for result in results)
+    return {'ingest.bulk_csv': {
+        'n': 1,
+        'elapsed_s': elapsed,
+        'rows_loaded': loaded,
+        'rows_rejected': sum(result.rejected for result in results),
+        'rows_per_s': loaded / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }}
@@ -0,0 +1,84 @@
+# bench/load.py - 複数ユーザーの同時セッションを模擬するオフライン負荷生成
+import random
+import threading
+import time
+import tracemalloc
+
+import chat_memory
+import chat_service
+import knowledge_catalog
+import llm_gateway
+import response_cache
+from bench.chat_bench import FREE_TEXT_SAMPLES, preset_targets
+from bench.common import peak_rss_mb, summarize
+from bench.fake_gemini import make_backend, make_persona
+
+
+def _session(seed, turns, think_time, preset_ratio, ctx, latencies, errors, lock):
+    """1ユーザー分: プリセットと雑談をランダムに混ぜて turns 回話す"""
+    rng = random.Random(seed)
+    memory = chat_memory.ConversationMemory()
+    for _ in range(turns):
+        if rng.random() < preset_ratio:
+            question, knowledge_id = rng.choice(ctx['targets'])
+            request = chat_service.preset_request(ctx['catalog'], ctx['persona'], question, knowledge_id)
+        else:
+            request = chat_service.free_text_request(ctx['catalog'], ctx['persona'], rng.choice(FREE_TEXT_SAMPLES))
+        start = time.perf_counter()
+        try:
+            chat_service.respond(request, memory, ctx['gateway'], ctx['persona'].backend, cache=ctx['cache'])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+        if think_time:
+            time.sleep(rng.uniform(0, think_time * 2))
+
+
+def run_load(sessions=50, turns=5, think_time=0.0, preset_ratio=0.5, first_delay=0.3, delay=0.02,
+             max_concurrency=8, rate_per_sec=50.0, use_cache=True, seed=42):
+    """
+    sessions 人が同時に turns 回ずつ話しかける。
+    レイテンシ (p50/p95/p99)・スループット・メモリを返す
+    """
+    catalog = knowledge_catalog.get_catalog()
+    ctx = {
+        'catalog': catalog,
+        'targets': preset_targets(catalog),
+        'persona': make_persona(make_backend(first_delay=first_delay, delay=delay)),
+        'gateway': llm_gateway.LLMGateway(max_concurrency=max_concurrency, rate_per_sec=rate_per_sec,
+                                          burst=max_concurrency, timeout=120),
+        'cache': response_cache.ResponseCache() if use_cache else None,
+    }
+    latencies, errors, lock = [], [], threading.Lock()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_session,
+                                args=(seed + i, turns, think_time, preset_ratio, ctx, latencies, errors, lock))
+               for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = summarize(latencies)
+    stats.update({
+        'sessions': sessions,
+        'turns': turns,
+        'errors': len(errors),
+        'wall_s': wall,
+        'throughput_rps': len(latencies) / wall if wall else 0.0,
+        'traced_peak_mb': traced_peak / (1024 * 1024),
+        'peak_rss_mb': peak_rss_mb(),
+        'gateway': ctx['gateway'].stats(),
+        'cache': ctx['cache'].stats() if ctx['cache'] is not None else None,
+    })
+    if errors:
+        stats['error_samples'] = errors[:5]
+    return {'load.mixed_sessions': stats}
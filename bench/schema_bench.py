@@ -0,0 +1,90 @@
+# bench/schema_bench.py - 大きめの合成データで、DAOのクエリの実行計画とレイテンシを見る
+# インデックス無し (スキーマv2) と有り (最新) を同じデータで比べる
+import os
+import random
+import sqlite3
+import tempfile
+
+from bench.common import summarize, time_calls
+
+CATEGORIES = 20
+DETAILS_PER_KNOWLEDGE = 5
+USERS = 1000
+FACT_TYPES = ('WHY', 'STEP', 'FAILURE', 'PRO_TIP')
+
+
+def _fill(conn, knowledge_rows, seed=0):
+    """合成データを流し込む (knowledge_rows 件のナレッジ + その詳細 + ユーザーの目標)"""
+    rng = random.Random(seed)
+    conn.executemany("INSERT INTO M_Categories (category_id, category_name, sort_order) VALUES (?, ?, ?)",
+                     [(f"cat{c}", f"カテゴリ{c}", c) for c in range(CATEGORIES)])
+    conn.executemany("INSERT INTO M_Users (user_id, user_name, password_hash) VALUES (?, ?, 'dummy_hash')",
+                     [(f"user{u}", f"ユーザー{u}") for u in range(USERS)])
+    conn.executemany(
+        "INSERT INTO M_Knowledge_Base (knowledge_id, category_id, preset_question, success_title) VALUES (?, ?, ?, ?)",
+        ((k, f"cat{rng.randrange(CATEGORIES)}", f"質問{k}はどうする？", f"結論{k}") for k in range(1, knowledge_rows + 1)))
+    # 詳細はCSVと同じく、ナレッジごとにまとまってない順番で入る想定でシャッフルする
+    details = [(k, FACT_TYPES[s % len(FACT_TYPES)], f"事実{k}-{s}" * 4,
+                'NEGATIVE' if s % 3 == 0 else 'POSITIVE', s)
+               for k in range(1, knowledge_rows + 1) for s in range(DETAILS_PER_KNOWLEDGE)]
+    rng.shuffle(details)
+    conn.executemany(
+        "INSERT INTO M_Knowledge_Details (knowledge_id, fact_type, fact_text, experience_flag, sort_order) VALUES (?, ?, ?, ?, ?)",
+        details)
+    conn.executemany(
+        "INSERT INTO T_User_Goals (user_id, category_id, goal_key, status) VALUES (?, ?, ?, ?)",
+        ((f"user{rng.randrange(USERS)}", f"cat{rng.randrange(CATEGORIES)}", str(k),
+          rng.choice(('not_started', 'completed'))) for k in range(1, knowledge_rows + 1)))
+    conn.commit()
+
+
+def _queries(knowledge_rows, seed=1):
+    """(名前, SQL, 毎回違う引数を作る関数) のリスト"""
+    import db_utils
+    rng = random.Random(seed)
+    return [
+        ('get_categories', db_utils.SQL_CATEGORIES, lambda: ()),
+        ('get_preset_questions', db_utils.SQL_PRESET_QUESTIONS, lambda: (f"cat{rng.randrange(CATEGORIES)}",)),
+        ('get_knowledge_details_by_id', db_utils.SQL_KNOWLEDGE_DETAILS,
+         lambda: (rng.randint(1, knowledge_rows),)),
+        ('get_user_name', db_utils.SQL_USER_NAME, lambda: (f"user{rng.randrange(USERS)}",)),
+        ('get_user_goals_by_category', db_utils.SQL_USER_GOALS,
+         lambda: (f"user{rng.randrange(USERS)}", f"cat{rng.randrange(CATEGORIES)}")),
+    ]
+
+
+def _measure(conn, label, knowledge_rows, iterations):
+    results = {}
+    for name, sql, make_args in _queries(knowledge_rows):
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, make_args())]
+        stats = summarize(time_calls(lambda: conn.execute(sql, make_args()).fetchall(), iterations))
+        stats['plan'] = plan
+        results[f"schema.{label}.{name}"] = stats
+    return results
+
+
+def bench_schema(knowledge_rows=100_000, iterations=200):
+    """
+    同じ合成データで「インデックス無し(v2)」と「最新スキーマ + ANALYZE」を比べる。
+    結果には各クエリの EXPLAIN QUERY PLAN も入れておく
+    """
+    import db_migrations
+    before = [m for m in db_migrations.MIGRATIONS if m[0] <= 2]
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'schema.db'))
+        try:
+            # v2 まで (テーブルだけ) 当てて、データを入れてから測る
+            for _, _, statements in before:
+                for statement in statements:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {before[-1][0]}")
+            _fill(conn, knowledge_rows)
+            results = _measure(conn, 'unindexed', knowledge_rows, iterations)
+
+            db_migrations.migrate(conn)
+            conn.execute("ANALYZE")
+            conn.commit()
+            results.update(_measure(conn, 'indexed', knowledge_rows, iterations))
+        finally:
+            conn.close()
+    return results
@@ -0,0 +1,108 @@
+# bench/session_bench.py - たくさんのセッションを1ワーカーに持ったときの会話メモリと、追い出し → 読み直しの時間
+import time
+import tracemalloc
+import uuid
+
+import chat_memory
+import chat_store
+import session_registry
+from bench.common import summarize
+from bench.fake_gemini import deterministic_reply
+
+
+def _exchanges(session_index, turns):
+    """セッションごとに違う (ユーザーの発言, AIの返答) を作る"""
+    for t in range(turns):
+        user_text = f"セッション{session_index}の{t}回目の相談: スマートホームってどこから始めればいい？"
+        yield user_text, deterministic_reply(user_text)
+
+
+def _dict_sessions(sessions, turns):
+    """前の持ち方: dict のメッセージ + dict の送信ログ + ConversationMemory (返答の str は app.py と同じく共有)"""
+    kept = []
+    for s in range(sessions):
+        memory = chat_memory.ConversationMemory()
+        messages = []
+        for user_text, reply in _exchanges(s, turns):
+            messages.append({"role": "user", "content": user_text})
+            history_tokens, prompt_tokens = memory.history_tokens(), chat_memory.estimate_tokens(user_text)
+            memory.prompt_log.append({"history_tokens": history_tokens, "prompt_tokens": prompt_tokens,
+                                      "total_tokens": history_tokens + prompt_tokens})
+            memory.add_turn(user_text, reply)
+            messages.append({"role": "assistant", "content": reply})
+        kept.append((memory, messages[-session_registry.MAX_DISPLAY_MESSAGES:]))
+    return kept
+
+
+def _slotted_sessions(registry, sessions, turns):
+    """今の持ち方: SessionState (Message は __slots__、本文は Turn と共有)"""
+    kept = []
+    for s in range(sessions):
+        state = registry.open(f"bench-{s}", "bench_user")
+        for user_text, reply in _exchanges(s, turns):
+            state.memory.measure(user_text)
+            turn = state.memory.add_turn(user_text, reply)
+            state.record_exchange(user_text, reply, turn=turn)
+        kept.append(state)
+    return kept
+
+
+def _traced_bytes(fn):
+    tracemalloc.start()
+    try:
+        kept = fn()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current, kept
+
+
+def bench_sessions(sessions=1000, turns=10, evict_sessions=200):
+    """
+    1. 同じ会話を dict で持つ / SessionState で持つ ときのメモリ (tracemalloc)
+    2. 保存先つきのセッションを上限の小さいレジストリに入れて、追い出しと読み直しの時間
+    """
+    dict_bytes, _ = _traced_bytes(lambda: _dict_sessions(sessions, turns))
+    registry = session_registry.SessionRegistry(limit_bytes=1 << 62)
+    slotted_bytes, kept = _traced_bytes(lambda: _slotted_sessions(registry, sessions, turns))
+    estimated = registry.total_bytes()
+    del kept
+
+    # 上限を1セッション分くらいにして、使ってないセッションを追い出させる
+    store = chat_store.get_store()
+    registry = session_registry.SessionRegistry(limit_bytes=1 << 62, idle=0)
+    states = []
+    for s in range(evict_sessions):
+        state = registry.open(uuid.uuid4().hex, "bench_user", store.open_session(uuid.uuid4().hex, "bench_user"))
+        for user_text, reply in _exchanges(s, turns):
+            turn = state.memory.add_turn(user_text, reply)
+            state.record_exchange(user_text, reply, turn=turn)
+        states.append(state)
+    store.flush()
+    before = registry.total_bytes()
+    registry.limit_bytes = before // evict_sessions
+    start = time.perf_counter()
+    evicted = registry.enforce()
+    evict_s = time.perf_counter() - start
+    after = registry.total_bytes()
+
+    reloads = []
+    for state in states:
+        start = time.perf_counter()
+        state.ensure_loaded()
+        reloads.append(time.perf_counter() - start)
+
+    return {
+        'session.memory': {
+            'sessions': sessions, 'turns': turns,
+            'dict_bytes_per_session': dict_bytes / sessions,
+            'slotted_bytes_per_session': slotted_bytes / sessions,
+            'estimated_bytes_per_session': estimated / sessions,
+            'saved_ratio': 1 - slotted_bytes / dict_bytes if dict_bytes else 0.0,
+        },
+        'session.evict': {
+            'sessions': evict_sessions, 'evicted': evicted, 'bytes_before': before,
+            'bytes_after_evict': after, 'elapsed_ms': evict_s * 1000,
+        },
+        'session.reload': summarize(reloads),
+    }
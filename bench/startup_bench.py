@@ -0,0 +1,86 @@
+# bench/startup_bench.py - コールドスタート: app.py が読み込むモジュールの import 時間 (-X importtime) と、DBの初期化
+import ast
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.common import REPO_DIR, summarize
+
+TOP_IMPORTS = 15 # レポートに出す、重いモジュールの数
+
+# サブプロセスの中で app.py と同じモジュールを import して、そのあと init_database() する
+_SNIPPET = """
+import sys, time, json
+t = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+import db_utils
+db_utils.init_database()
+done = time.perf_counter()
+print(json.dumps({{'import_s': imported - t, 'init_db_s': done - imported,
+                  'sdk_loaded': 'google.generativeai' in sys.modules}}))
+"""
+
+
+def app_imports():
+    """app.py の import 文に出てくるモジュール (この環境に入ってないものは除く)"""
+    with open(os.path.join(REPO_DIR, 'app.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = [alias.name for node in tree.body if isinstance(node, ast.Import) for alias in node.names]
+    return [name for name in names if importlib.util.find_spec(name.split('.')[0]) is not None]
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力 → [(モジュール, self_us, cumulative_us, 深さ), ...]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def _run(db_path, modules):
+    env = dict(os.environ, PROTOS_DB_PATH=db_path)
+    snippet = _SNIPPET.format(imports="\n".join(f"import {name}" for name in modules))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', snippet], cwd=REPO_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), parse_importtime(proc.stderr)
+
+
+def bench_startup(runs=5):
+    """
+    まっさらなDB (cold) と、DBができてる状態 (warm) で、別プロセスの起動を測る。
+    import の内訳 (重い順) と、SDK (google.generativeai) を import 時に読んでないかもレポートする
+    """
+    modules = app_imports()
+    imports, cold_init, warm_init = [], [], []
+    profile = None
+    sdk_loaded = False
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'startup.db')
+            cold, _ = _run(db_path, modules)
+            warm, profile = _run(db_path, modules)
+        imports.extend([cold['import_s'], warm['import_s']])
+        cold_init.append(cold['init_db_s'])
+        warm_init.append(warm['init_db_s'])
+        sdk_loaded = sdk_loaded or cold['sdk_loaded'] or warm['sdk_loaded']
+
+    top = sorted((row for row in profile if row[3] == 0), key=lambda row: -row[2])[:TOP_IMPORTS]
+    return {
+        'startup.import': summarize(imports),
+        'startup.init_db_cold': summarize(cold_init),
+        'startup.init_db_warm': summarize(warm_init),
+        'startup.profile': {
+            'modules': modules,
+            'sdk_loaded_at_import': sdk_loaded,
+            'top_imports': [{'module': name, 'cumulative_ms': cumulative / 1000, 'self_ms': self_us / 1000}
+                            for name, self_us, cumulative, _ in top],
+        },
+    }
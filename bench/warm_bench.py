@@ -0,0 +1,50 @@
+# bench/warm_bench.py - 人気のプリセット質問を先回りで温めたときの、最初の1クリックのレイテンシ (偽Gemini使用)
+import time
+
+import answer_warmer
+import chat_memory
+import chat_service
+import knowledge_catalog
+import llm_gateway
+import response_cache
+from bench.chat_bench import preset_targets
+from bench.common import summarize
+from bench.fake_gemini import make_backend, make_persona
+
+
+def _first_clicks(targets, catalog, persona, gateway, cache):
+    """新しいセッションで、それぞれのプリセットを1回ずつ押したときの時間"""
+    latencies = []
+    for question, knowledge_id in targets:
+        memory = chat_memory.ConversationMemory()
+        request = chat_service.preset_request(catalog, persona, question, knowledge_id, memory)
+        start = time.perf_counter()
+        chat_service.respond(request, memory, gateway, persona.backend, cache=cache)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_warm(first_delay=0.3, delay=0.02, workers=2):
+    """温めてない状態 / 1サイクル温めたあと の最初のクリック、と2サイクル目 (全部新しいので作らないはず)"""
+    catalog = knowledge_catalog.get_catalog()
+    persona = make_persona(make_backend(first_delay=first_delay, delay=delay))
+    gateway = llm_gateway.LLMGateway(max_concurrency=8, rate_per_sec=1000, burst=1000)
+    targets = preset_targets(catalog)
+
+    results = {'warm.first_click_cold': summarize(
+        _first_clicks(targets, catalog, persona, gateway, response_cache.ResponseCache()))}
+
+    cache = response_cache.ResponseCache()
+    warmer = answer_warmer.AnswerWarmer(gateway, cache, workers=workers, min_clicks=1)
+    for _, knowledge_id in targets:
+        warmer.record_click(persona, knowledge_id)
+    start = time.perf_counter()
+    generated = warmer.run_once()
+    results['warm.cycle'] = summarize([time.perf_counter() - start])
+    results['warm.first_click_warm'] = summarize(_first_clicks(targets, catalog, persona, gateway, cache))
+    for _, knowledge_id in targets: # もう一回押されても、ナレッジが変わってなければ作り直さない
+        warmer.record_click(persona, knowledge_id)
+    results['warm.second_cycle_generated'] = {'first': generated, 'second': warmer.run_once()}
+    results['warm.stats'] = warmer.stats()
+    warmer.close()
+    return results
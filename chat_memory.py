@@ -0,0 +1,108 @@
+# chat_memory.py (Ver 1.0 - Token-Budgeted Conversation Memory)
+from collections import deque
+
+RAG_MARKER = "【RAG材料】" # app.py のRAG裏プロンプトの目印
+
+
+def estimate_tokens(text):
+    """
+    ざっくりトークン数を見積もる (APIを呼ばない概算)
+    英数字は4文字で1トークン、日本語などは1文字1トークンくらいで数える
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def default_summarizer(summary, user_text, model_text):
+    """古いターンを要約に1行ずつ畳み込む (ローカルで完結。LLMは呼ばない)"""
+    line = f"- ユーザー: {_clip(user_text, 60)} / AI: {_clip(model_text, 80)}"
+    return f"{summary}\n{line}" if summary else line
+
+
+class Turn:
+    """ユーザーの発言とAIの返答の1往復 (seq は履歴ストアに保存したときの通し番号)"""
+    __slots__ = ('user_text', 'model_text', 'tokens', 'seq')
+
+    def __init__(self, user_text, model_text, seq=None):
+        self.user_text = user_text
+        self.model_text = model_text
+        self.tokens = estimate_tokens(user_text) + estimate_tokens(model_text)
+        self.seq = seq
+
+
+class ConversationMemory:
+    """
+    Geminiに毎回送る会話履歴を、トークン予算の中に収める係。
+    - 直近 keep_turns 往復はそのまま残す
+    - それより古い往復は「これまでの要約」に畳み込む
+    - 答え終わったRAG材料は、質問だけの短い形に置き換える
+    """
+
+    def __init__(self, max_tokens=3000, keep_turns=6, summary_max_tokens=600, summarizer=None):
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer or default_summarizer
+        self.summary = ""
+        self.summary_upto = None # 要約に畳み込んだ最後のターンの seq (履歴ストアのスナップショット用)
+        self.turns = deque()
+        self.prompt_log = deque(maxlen=50) # ターンごとの (履歴トークン数, 発言トークン数) (直近50件。dict だと1セッションで十数KBになる)
+        self.sent_facts = set() # このセッションでRAG材料として送った事実の文面 (同じ事実は二度送らない)
+
+    def history_tokens(self):
+        return estimate_tokens(self.summary) + sum(turn.tokens for turn in self.turns)
+
+    def history(self):
+        """start_chat(history=...) にそのまま渡せる形の履歴"""
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": [f"【これまでの会話の要約】\n{self.summary}"]})
+            contents.append({"role": "model", "parts": ["オッケー、覚えとくね！"]})
+        for turn in self.turns:
+            contents.append({"role": "user", "parts": [turn.user_text]})
+            contents.append({"role": "model", "parts": [turn.model_text]})
+        return contents
+
+    def measure(self, prompt):
+        """今回送るプロンプトのサイズ (履歴 + 今回の発言) を記録して返す"""
+        size = {
+            "history_tokens": self.history_tokens(),
+            "prompt_tokens": estimate_tokens(prompt),
+        }
+        size["total_tokens"] = size["history_tokens"] + size["prompt_tokens"]
+        self.prompt_log.append((size["history_tokens"], size["prompt_tokens"]))
+        return size
+
+    def add_turn(self, prompt, reply, display_text=None):
+        """1往復を記録して、その Turn を返す。RAG材料は答え終わったので、質問だけ残す"""
+        if prompt.startswith(RAG_MARKER):
+            prompt = f"（「{display_text or ''}」の型について、ナレッジを元に話した）"
+        turn = Turn(prompt, reply)
+        self.turns.append(turn)
+        self._compact()
+        return turn
+
+    def restore(self, summary, summary_upto, turns):
+        """保存しておいた要約と直近のターン [(user_text, model_text, seq), ...] から復元する"""
+        self.summary = summary or ""
+        self.summary_upto = summary_upto
+        self.turns = deque(Turn(user_text, model_text, seq) for user_text, model_text, seq in turns)
+        self._compact()
+
+    def _compact(self):
+        # 直近のターン数 or トークン予算を超えたら、古いものから要約へ
+        while len(self.turns) > 1 and (
+                len(self.turns) > self.keep_turns or self.history_tokens() > self.max_tokens):
+            oldest = self.turns.popleft()
+            self.summary = self.summarizer(self.summary, oldest.user_text, oldest.model_text)
+            self.summary_upto = oldest.seq
+        # 要約自体も予算オーバーなら、古い行から捨てる
+        while estimate_tokens(self.summary) > self.summary_max_tokens and "\n" in self.summary:
+            self.summary = self.summary.split("\n", 1)[1]
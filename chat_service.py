@@ -0,0 +1,134 @@
+# chat_service.py (Ver 1.0 - Chat Pipeline without UI)
+# app.py から Streamlit の描画以外の部分を切り出したもの (ベンチからも同じ道を通す)
+from collections import namedtuple
+
+import chat_stream
+import intent_router
+import knowledge_search
+import plan_engine
+import prompt_builder
+import response_cache
+import tracing
+
+# --- 雑談RAG: このスコア以上でヒットしたナレッジだけ材料に使う ---
+FREE_TEXT_RAG_MIN_SCORE = 2.5
+FREE_TEXT_RAG_CANDIDATES = 5 # 話し相手の投稿者のナレッジの上位何件から、詳細があるものを探すか
+
+NOT_FOUND_REPLY = "おっと、その「型」のデータが見つからなかったわ…ごめんね"
+
+# 1回の返答 (result は chat_stream.ReplyResult、prompt_size は ConversationMemory.measure の戻り値、
+# turn は会話履歴に足した chat_memory.Turn。AIを呼ばなかったときは result が None)
+ChatReply = namedtuple('ChatReply', ['text', 'result', 'cached', 'prompt_size', 'turn'])
+
+
+@tracing.traced("prompt.preset")
+def preset_request(catalog, persona, question, knowledge_id, memory=None):
+    """
+    プリセットボタンが押されたときのリクエストを組み立てる。
+    memory (ConversationMemory) を渡すと、このセッションで送り済みの事実は省く
+    """
+    details = catalog.knowledge_details(knowledge_id)
+    if not details:
+        return {"kind": "preset", "content": question, "prompt": None, "fallback": NOT_FOUND_REPLY}
+    built = prompt_builder.build_knowledge_prompt(
+        f"ユーザーが「{question}」について知りたがってる。", details, persona.ai_name,
+        sent_facts=memory.sent_facts if memory is not None else None)
+    # 同じナレッジ (中身のバージョンも同じ)・同じ人格なら、キャッシュした返答を使い回す。
+    # キーは裏プロンプトの文面じゃなくてナレッジIDで作る (送り済みの事実で文面が変わっても、ユーザー間で共有できるように)。
+    # 送り済みの事実を省いたプロンプトの返答は、そのセッションだけのものなのでキャッシュしない
+    cache_key = None
+    if built.stats['facts_deduped'] == 0:
+        cache_key = response_cache.make_key(
+            f"preset:{knowledge_id}", persona.creator_id, persona.system_prompt,
+            catalog.knowledge_version(knowledge_id))
+    return {"kind": "preset", "content": question, "prompt": built.text, "cache_key": cache_key,
+            "facts": built.facts, "rag": built.stats}
+
+
+@tracing.traced("prompt.free_text")
+def free_text_request(catalog, persona, text, memory=None):
+    """チャット入力のリクエスト。関係ありそうなナレッジがあれば材料として添える"""
+    request = {"kind": "free_text", "content": text, "prompt": text}
+    try:
+        # 検索インデックスは投稿者ごとなので、ヒットは全部この投稿者のナレッジ
+        hits = knowledge_search.search(text, k=FREE_TEXT_RAG_CANDIDATES, min_score=FREE_TEXT_RAG_MIN_SCORE,
+                                       creator_id=catalog.creator_id)
+        details = ()
+        for knowledge_id, _ in hits:
+            details = catalog.knowledge_details(knowledge_id)
+            if details:
+                break
+        if details:
+            built = prompt_builder.build_knowledge_prompt(
+                f"ユーザーが「{text}」って話しかけてきた。関係ありそうなら、", details, persona.ai_name,
+                sent_facts=memory.sent_facts if memory is not None else None)
+            request.update(prompt=built.text, facts=built.facts, rag=built.stats)
+    except Exception as e:
+        # 検索がコケても雑談は続ける (そのままGeminiにトス)
+        print(f"ナレッジ検索でエラー: {e}")
+    return request
+
+
+@tracing.traced("prompt.plan")
+def plan_request(category_id, goal_keys, content):
+    """目標からプラン(WBS)を組み立てる。マスタから作るので、AIは呼ばない"""
+    plan = plan_engine.build_plan(category_id, goal_keys)
+    return {"kind": "plan", "content": content, "prompt": None, "reply": plan.text}
+
+
+def routed_request(intent, route, text, memory=None):
+    """
+    チャット入力を intent_router の振り分け通りのリクエストにする (route は persona_router.Route)。
+    preset はボタンと同じリクエスト (キャッシュも共通)、plan はプラン、それ以外は雑談
+    """
+    request = None
+    if intent.route == intent_router.PRESET:
+        request = preset_request(route.catalog, route.persona, intent.question, intent.knowledge_id, memory)
+        if request["prompt"] is None:
+            request = None # ナレッジの詳細が無かったら、普通の雑談として答える
+    elif intent.route == intent_router.PLAN:
+        request = plan_request(intent.category_id, intent.goal_keys, text)
+    if request is None:
+        request = free_text_request(route.catalog, route.persona, text, memory)
+    request["content"] = text # 画面と履歴には、ユーザーが打ったままの文面を出す
+    request["routed"] = True # respond で、AIを呼ばずに答えられたかを intent_router に数えてもらう
+    return request
+
+
+def respond(request, memory, gateway, backend, cache=None, streaming=True, on_update=None):
+    """
+    リクエストをAIに投げて返答を受け取り、会話履歴に記録する。
+    cache があればプリセットの返答はキャッシュから返す (Geminiは呼ばない)
+    """
+    if request.get("reply") is not None:
+        # 手元で作った返答 (プランなど)。AIは呼ばないけど、話の流れとして履歴には残す
+        turn = memory.add_turn(request["content"], request["reply"])
+        if request.get("routed"):
+            intent_router.record_answer(local=True)
+        return ChatReply(request["reply"], None, False, None, turn)
+    if request["prompt"] is None:
+        return ChatReply(request["fallback"], None, False, None, None)
+
+    prompt_size = memory.measure(request["prompt"])
+    cache_key = request.get("cache_key")
+    with tracing.span("cache.get"):
+        cached_text = cache.get(cache_key) if cache is not None and cache_key else None
+    if cached_text is not None:
+        result = chat_stream.ReplyResult(cached_text, 0.0, 0.0)
+    else:
+        # 予算内に収めた履歴からチャットを組み立てて送る
+        chat = gateway.start_chat(backend, history=memory.history())
+        if streaming:
+            with tracing.span("llm.stream"):
+                result = chat_stream.stream_reply(chat, request["prompt"], on_update=on_update)
+            tracing.observe("llm.ttft", result.ttft, "llm.stream")
+        else:
+            with tracing.span("llm.blocking"):
+                result = chat_stream.blocking_reply(chat, request["prompt"])
+        if cache is not None and cache_key:
+            cache.put(cache_key, result.text)
+    turn = memory.add_turn(request["prompt"], result.text, display_text=request["content"])
+    memory.sent_facts.update(request.get("facts", ())) # 送った事実は、このセッションではもう送らない
+    if request.get("routed"):
+        intent_router.record_answer(local=cached_text is not None)
+    return ChatReply(result.text, result, cached_text is not None, prompt_size, turn)
@@ -0,0 +1,246 @@
+# chat_store.py (Ver 1.1 - Write-Behind Chat History Store)
+# 会話をDBに残して、ワーカーが再起動しても続きから話せるようにする。
+# 書き込みはキューに積むだけ (チャットの応答待ちにディスクの時間を乗せない)。裏のスレッドがまとめて書く
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import db_utils
+
+FLUSH_INTERVAL = float(os.getenv("PROTOS_CHAT_FLUSH_MS", "200")) / 1000 # これだけ経ったら書く
+FLUSH_BATCH = int(os.getenv("PROTOS_CHAT_FLUSH_BATCH", "64")) # これだけたまったら待たずに書く
+PAGE_SIZE = 20 # 1回に読み込むメッセージ数
+
+# 保存されたメッセージ1件 (画面表示用)
+StoredMessage = namedtuple('StoredMessage', ['seq', 'role', 'content'])
+
+_STOP = object()
+
+
+class SessionOwnerError(PermissionError):
+    """他のユーザーのセッションを開こうとした"""
+
+
+class ChatSession:
+    """1つの会話セッション (st.session_state に持っておく)。seq はここで振る"""
+
+    def __init__(self, store, session_id, user_id, next_seq):
+        self.store = store
+        self.session_id = session_id
+        self.user_id = user_id
+        self.next_seq = next_seq
+        self._saved_summary_upto = None
+
+    def _take_seq(self):
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def record_message(self, role, content, memory_text=None):
+        """メッセージを1件保存する (キューに積むだけ)。振った seq を返す"""
+        seq = self._take_seq()
+        self.store._enqueue(('message', self.session_id, self.user_id, seq, role, content, memory_text, time.time()))
+        return seq
+
+    def record_exchange(self, user_content, reply_text, turn=None, memory=None):
+        """
+        ユーザーの発言とAIの返答を保存する。
+        turn (chat_memory.Turn) を渡すと、あとで履歴を組み立て直せるように seq を振っておく。
+        memory を渡すと、要約が進んでいたらスナップショットも保存する。振った (ユーザーの seq, 返答の seq) を返す
+        """
+        user_seq = self.record_message('user', user_content, turn.user_text if turn is not None else None)
+        reply_seq = self.record_message('assistant', reply_text)
+        if turn is not None:
+            turn.seq = reply_seq
+        if memory is not None and memory.summary_upto != self._saved_summary_upto:
+            self.store._enqueue(('summary', self.session_id, self.user_id,
+                                 memory.summary, memory.summary_upto, time.time()))
+            self._saved_summary_upto = memory.summary_upto
+        return user_seq, reply_seq
+
+    def load_recent(self, limit=PAGE_SIZE):
+        """直近のメッセージ (古い順)"""
+        return self.store.load_messages(self.session_id, limit=limit)
+
+    def load_before(self, seq, limit=PAGE_SIZE):
+        """seq より前のメッセージを1ページ分 (古い順)。「もっと前を読む」用"""
+        return self.store.load_messages(self.session_id, before_seq=seq, limit=limit)
+
+    def restore_memory(self, memory):
+        """保存した要約 + 要約より後のターン (最大 keep_turns 往復) から ConversationMemory を組み立て直す"""
+        summary, summary_upto, turns = self.store.load_memory(self.session_id, memory.keep_turns)
+        memory.restore(summary, summary_upto, turns)
+        self._saved_summary_upto = memory.summary_upto
+
+
+class ChatStore:
+    """
+    チャット履歴のストア (メインDBの T_Chat_Sessions / T_Chat_Messages)。
+    - 書き込みはキューに積んで、裏のスレッドが FLUSH_INTERVAL ごと or FLUSH_BATCH 件ごとに1トランザクションで書く
+    - セッションの行 (持ち主の user_id) は最初のメッセージと一緒に作る (要約が無い短い会話でも残る)
+    - 開くときは持ち主を確かめる (他の人のセッションIDを渡されたら SessionOwnerError)
+    - 要約のスナップショットは、同じセッションなら最後の1つだけ書く
+    - 読み込みはページ単位 (全部は読まない)
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_batch=FLUSH_BATCH):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'batches': 0, 'write_ms': 0.0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name="chat-store-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close) # 終了するときに、積み残しを書いてから閉じる
+
+    def _enqueue(self, item):
+        self._queue.put(item)
+        with self._stats_lock:
+            self._stats['queued'] += 1
+
+    # --- 裏のスレッド ---
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            # flush() を待ってる人がいたら、たまるのを待たずにすぐ書く
+            while len(batch) < self.flush_batch and batch[-1][0] != 'flush':
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        messages = []
+        sessions = {} # session_id → (session_id, user_id, 最後のメッセージの時刻)
+        summaries = {} # session_id → 最後のスナップショット
+        waiters = []
+        for item in batch:
+            kind = item[0]
+            if kind == 'message':
+                _, session_id, user_id, seq, role, content, memory_text, created_at = item
+                messages.append((session_id, seq, role, content, memory_text, created_at))
+                sessions[session_id] = (session_id, user_id, created_at)
+            elif kind == 'summary':
+                summaries[item[1]] = item[1:]
+            elif kind == 'flush':
+                waiters.append(item[1])
+        start = time.perf_counter()
+        try:
+            if messages or summaries:
+                with db_utils.write_connection() as conn:
+                    conn.executemany(
+                        "INSERT INTO T_Chat_Sessions (session_id, user_id, updated_at) VALUES (?, ?, ?)"
+                        " ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at",
+                        sessions.values())
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO T_Chat_Messages (session_id, seq, role, content, memory_text, created_at)"
+                        " VALUES (?, ?, ?, ?, ?, ?)", messages)
+                    conn.executemany(
+                        "INSERT INTO T_Chat_Sessions (session_id, user_id, summary, summary_upto, updated_at)"
+                        " VALUES (?, ?, ?, ?, ?) ON CONFLICT (session_id) DO UPDATE SET"
+                        " summary = excluded.summary, summary_upto = excluded.summary_upto,"
+                        " updated_at = excluded.updated_at", summaries.values())
+            with self._stats_lock:
+                self._stats['written'] += len(messages) + len(summaries)
+                self._stats['batches'] += 1
+                self._stats['write_ms'] += (time.perf_counter() - start) * 1000
+        except Exception as e:
+            # 書けなかった分は諦める (チャット自体は止めない)
+            print(f"チャット履歴の保存でエラー: {e}")
+            with self._stats_lock:
+                self._stats['errors'] += 1
+        finally:
+            for event in waiters:
+                event.set()
+
+    # --- 呼び出し側から ---
+    def flush(self, timeout=2.0):
+        """キューに積んだ分が書き終わるまで待つ (読み込みの前と、プロセスを閉じる前に)"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def close(self, timeout=2.0):
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def open_session(self, session_id, user_id):
+        """
+        セッションを開く (続きの seq を決めるために、最後の seq だけ読む)。
+        そのセッションが他の人のもの (or 持ち主が分からない) なら SessionOwnerError
+        """
+        self.flush()
+        with db_utils.read_connection() as conn:
+            owner = conn.execute("SELECT user_id FROM T_Chat_Sessions WHERE session_id = ?",
+                                 (session_id,)).fetchone()
+            row = conn.execute("SELECT MAX(seq) FROM T_Chat_Messages WHERE session_id = ?",
+                               (session_id,)).fetchone()
+        next_seq = 0 if row[0] is None else row[0] + 1
+        # 行が無いのにメッセージだけある = 持ち主が分からない古い会話なので、これも開かない
+        if (owner['user_id'] != user_id) if owner is not None else next_seq > 0:
+            raise SessionOwnerError(f"セッション {session_id} は {user_id} のものじゃない")
+        return ChatSession(self, session_id, user_id, next_seq)
+
+    def load_messages(self, session_id, before_seq=None, limit=PAGE_SIZE):
+        """メッセージを新しい方から limit 件 (before_seq より前)。返すときは古い順"""
+        self.flush()
+        with db_utils.read_connection() as conn:
+            rows = conn.execute(
+                "SELECT seq, role, content FROM T_Chat_Messages WHERE session_id = ? AND seq < ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (session_id, before_seq if before_seq is not None else 1 << 62, limit)).fetchall()
+        return [StoredMessage(*row) for row in reversed(rows)]
+
+    def load_memory(self, session_id, max_turns):
+        """
+        Geminiの履歴を組み立て直す材料: (要約, 要約に畳んだ最後のseq, [(user_text, model_text, seq), ...])
+        要約より後のターンを、新しい方から max_turns 往復分だけ読む (会話全体は読まない)
+        """
+        self.flush()
+        with db_utils.read_connection() as conn:
+            session = conn.execute("SELECT summary, summary_upto FROM T_Chat_Sessions WHERE session_id = ?",
+                                   (session_id,)).fetchone()
+            summary, summary_upto = (session['summary'], session['summary_upto']) if session else ("", None)
+            rows = conn.execute("""
+                SELECT u.memory_text, a.content, a.seq
+                FROM T_Chat_Messages u
+                JOIN T_Chat_Messages a ON a.session_id = u.session_id AND a.seq = u.seq + 1
+                WHERE u.session_id = ? AND u.seq > ? AND u.memory_text IS NOT NULL
+                ORDER BY u.seq DESC LIMIT ?
+            """, (session_id, summary_upto if summary_upto is not None else -1, max_turns)).fetchall()
+        return summary, summary_upto, [tuple(row) for row in reversed(rows)]
+
+    def stats(self):
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['pending'] = self._queue.qsize()
+        return result
+
+
+# --- プロセスで1つだけ持っておく ---
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """プロセス共通のチャット履歴ストア"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatStore()
+    return _store
@@ -0,0 +1,91 @@
+# chat_stream.py (Ver 1.0 - Streaming Reply Helper)
+import time
+from collections import namedtuple
+
+# 1回の返答の結果 (秒単位: ttft = 最初のトークンが届くまで, total = 全部届くまで)
+ReplyResult = namedtuple('ReplyResult', ['text', 'ttft', 'total'])
+
+
+def _chunk_text(chunk):
+    """チャンクのテキストを取り出す (セーフティでブロックされた空チャンクは '' 扱い)"""
+    try:
+        return chunk.text or ""
+    except ValueError:
+        return ""
+
+
+def stream_reply(chat, prompt, on_update=None):
+    """
+    トークンが届くたびに on_update(ここまでの全文) を呼びながら返答を受け取る。
+    chat は send_message(prompt, stream=True) でチャンクを返すもの (Geminiのチャット or 偽モデル)
+    """
+    start = time.perf_counter()
+    ttft = None
+    text = ""
+    for chunk in chat.send_message(prompt, stream=True):
+        piece = _chunk_text(chunk)
+        if not piece:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        text += piece
+        if on_update is not None:
+            on_update(text)
+    total = time.perf_counter() - start
+    return ReplyResult(text, total if ttft is None else ttft, total)
+
+
+def blocking_reply(chat, prompt):
+    """ストリーミングしない従来の呼び方 (全部届くまで待つ)。計測だけは同じ形で返す"""
+    start = time.perf_counter()
+    text = chat.send_message(prompt).text
+    total = time.perf_counter() - start
+    return ReplyResult(text, total, total)
+
+
+# --- テスト用: ローカルで動く偽モデル ---
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """send_message(stream=False) の戻り値 (Geminiと同じく .text で全文が取れる)"""
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.text = "".join(chunk.text for chunk in chunks)
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+class FakeChatSession:
+    """
+    チャンクを少しずつ返す偽チャット。APIキー無しでストリーミングを試せる。
+    reply_fn: プロンプト → 返答テキスト (省略時はオウム返し)
+    chunk_size: 1チャンクの文字数, delay: チャンクごとの待ち時間(秒)
+    """
+    def __init__(self, reply_fn=None, chunk_size=8, delay=0.0, first_delay=None):
+        self.reply_fn = reply_fn or (lambda prompt: f"なるほど〜「{prompt}」ね！")
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.first_delay = delay if first_delay is None else first_delay
+        self.history = []
+
+    def _chunks(self, prompt):
+        reply = self.reply_fn(prompt)
+        self.history.append({"role": "user", "parts": [prompt]})
+        self.history.append({"role": "model", "parts": [reply]})
+        return [FakeChunk(reply[i:i + self.chunk_size]) for i in range(0, len(reply), self.chunk_size)]
+
+    def _stream(self, chunks):
+        for i, chunk in enumerate(chunks):
+            time.sleep(self.first_delay if i == 0 else self.delay)
+            yield chunk
+
+    def send_message(self, prompt, stream=False):
+        chunks = self._chunks(prompt)
+        if stream:
+            return self._stream(chunks)
+        time.sleep(self.first_delay + self.delay * max(len(chunks) - 1, 0))
+        return FakeResponse(chunks)
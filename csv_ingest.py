@@ -0,0 +1,283 @@
+# csv_ingest.py (Ver 1.1 - Streaming, Validated CSV Ingestion)
+# CSVを一定件数ずつ読みながら、カラムごとに型をチェックしてINSERTする。
+# おかしな行は隔離 (quarantine) して、残りの行はそのまま取り込む (1行のせいで全部コケない！)
+import codecs
+import csv
+import queue
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+
+CHUNK_SIZE = 5000 # 1回のexecutemanyに渡す行数
+PREFETCH_CHUNKS = 4 # 読み込みスレッドが先読みしておくチャンク数 (メモリに載るのは最大でこれ+1個)
+
+# 一時ファイルに丸ごと作るとき専用のプラグマ (完成するまで誰にも見せないので、ディスクには同期しない)
+# ジャーナルはメモリに持つ (OFF だと ROLLBACK TO が効かず、コケたチャンクの途中までが残ってしまう)
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536", # 64MB
+    "PRAGMA locking_mode = EXCLUSIVE",
+]
+
+
+class RowError(ValueError):
+    """1行(の1カラム)が取り込めないときのエラー"""
+
+
+# --- UTF-8 として読めないバイト ---
+# ファイルは surrogateescape で読む (1バイト壊れてても UnicodeDecodeError でテーブルごとコケない)。
+# 読めないバイトは \udc80-\udcff になるので、その行だけ隔離する。
+# 全部の行を調べると遅いので、デコーダーが読めないバイトに出会った数を数えておいて、
+# 読み始めてから増えていたら、それ以降の行だけ調べる
+# (1つの取り込みは最初のチャンクと先読みで別スレッドになるので、スレッドごとじゃなくプロセスで1つ。
+#  同時に読んでる別のファイルで増えても、こっちが余計に調べるだけ)
+_UNDECODABLE = re.compile('[\udc80-\udcff]')
+_bad_bytes_seen = [0]
+
+
+def _escape_and_flag(error):
+    _bad_bytes_seen[0] += 1
+    return codecs.lookup_error('surrogateescape')(error)
+
+
+codecs.register_error('protos_ingest', _escape_and_flag)
+
+
+def _printable(raw):
+    """隔離した行の生データ (読めないバイトは \xff みたいに書く。レポートやDBに入れられるように)"""
+    return raw.encode('utf-8', 'surrogateescape').decode('utf-8', 'backslashreplace')
+
+
+# name: CSVのヘッダー兼DBのカラム名, coerce: 文字列 → DBに入れる値 (ダメなら RowError)
+# references: (テーブル, カラム) を指定すると、そこに存在する値だけ通す
+Column = namedtuple('Column', ['name', 'coerce', 'references'], defaults=[None])
+
+# 取り込めなかった行 (行番号はCSVの物理行。ヘッダーが1行目)
+Reject = namedtuple('Reject', ['table_name', 'line', 'reason', 'raw'])
+
+# 1テーブル分の取り込み結果
+IngestResult = namedtuple('IngestResult', ['table_name', 'loaded', 'rejected', 'skipped'])
+
+
+# --- カラムの型 (coerce関数) ---
+def text(value):
+    """必須の文字列 (前後の空白は落とす)"""
+    value = value.strip()
+    if not value:
+        raise RowError("空っぽ")
+    return value
+
+
+def optional_text(value):
+    return value.strip() or None
+
+
+def integer(value):
+    """必須の整数 ("1.STEP" みたいなのはここで弾く)"""
+    try:
+        if '_' not in value: # int() は "1_000" も通してしまうので
+            return int(value)
+    except ValueError:
+        pass
+    raise RowError(f"整数じゃない: {value.strip()!r}")
+
+
+def optional_integer(value):
+    return integer(value) if value.strip() else None
+
+
+def choice(*allowed, default=None):
+    """決まった値のどれか (空なら default。default も無ければエラー)"""
+    allowed_set = frozenset(allowed)
+
+    def coerce(value):
+        if value in allowed_set:
+            return value
+        value = value.strip()
+        if not value and default is not None:
+            return default
+        if value not in allowed_set:
+            raise RowError(f"{'/'.join(allowed)} のどれでもない: {value!r}")
+        return value
+    return coerce
+
+
+def _row_converter(columns, positions, known_keys):
+    """
+    CSVの1行 (リスト) → DBに入れるタプル、の関数を作る。ダメなら RowError。
+    100万行を回すので、普通の行はカラムごとのtry無しで一気に変換して、コケた行だけ原因を探す
+    """
+    coercers = [column.coerce for column in columns]
+    if positions == list(range(len(positions))):
+        positions = None # CSVとDBで列の並びが同じなら、並べ替えなくていい
+    references = [(index, column, known_keys[column.name])
+                  for index, column in enumerate(columns) if column.name in known_keys]
+
+    def explain(cells):
+        for column, raw in zip(columns, cells):
+            try:
+                column.coerce(raw)
+            except RowError as e:
+                raise RowError(f"{column.name}: {e}") from None
+        raise RowError("変換できない") # ここには来ないはず
+
+    def convert(row):
+        cells = row if positions is None else [row[i] for i in positions]
+        try:
+            values = tuple([coerce(raw) for coerce, raw in zip(coercers, cells)])
+        except RowError:
+            explain(cells)
+        for index, column, keys in references:
+            value = values[index]
+            if value is not None and value not in keys:
+                raise RowError(f"{column.name}: {column.references[0]} に無い値 {value!r}")
+        return values
+    return convert
+
+
+def iter_chunks(csv_file, table_name, columns, rejects, known_keys=None, chunk_size=CHUNK_SIZE):
+    """
+    CSVを chunk_size 行ずつ (行番号のリスト, 値のタプルのリスト) にして順番に返すジェネレーター。
+    ヘッダーの並びはCSV側に合わせる (列の順番が違ってもOK)。弾いた行は rejects に足していく
+    """
+    known_keys = known_keys or {}
+    bad_bytes_before = _bad_bytes_seen[0]
+    with open(csv_file, mode='r', encoding='utf-8', errors='protos_ingest', newline='') as f:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [column.name for column in columns if column.name not in header]
+        if missing:
+            raise RowError(f"ヘッダーに {', '.join(missing)} が無い")
+        convert = _row_converter(columns, [header.index(column.name) for column in columns], known_keys)
+
+        width = len(header)
+        lines, chunk = [], []
+        for row in reader:
+            try:
+                if len(row) != width:
+                    if not any(cell.strip() for cell in row):
+                        continue # 空行は黙って飛ばす
+                    raise RowError(f"カラム数が {width} じゃなくて {len(row)}")
+                if _bad_bytes_seen[0] != bad_bytes_before and _UNDECODABLE.search(''.join(row)):
+                    raise RowError("UTF-8 として読めないバイトがある")
+                chunk.append(convert(row))
+            except RowError as e:
+                rejects.append(Reject(table_name, reader.line_num, str(e), _printable(','.join(row))))
+                continue
+            lines.append(reader.line_num)
+            if len(chunk) >= chunk_size:
+                yield lines, chunk
+                lines, chunk = [], []
+        if chunk:
+            yield lines, chunk
+
+
+def _prefetch(chunks, depth=PREFETCH_CHUNKS):
+    """
+    別スレッドでCSVを読み進めておく (INSERT中はsqlite3がGILを離すので、パースと書き込みが重なる)。
+    キューの長さで先読みを制限するので、メモリは増え続けない
+    """
+    out = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in chunks:
+                if not put(item):
+                    return # 書き込み側がやめた
+            put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            chunks.close() # CSVファイルを閉じる
+
+    threading.Thread(target=produce, name="csv-ingest-reader", daemon=True).start()
+    try:
+        while True:
+            item = out.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _known_keys(conn, columns):
+    """外部キーっぽいカラムの「存在する値」の集合 (取り込み前にDBから読んでおく)"""
+    keys = {}
+    for column in columns:
+        if column.references is not None:
+            ref_table, ref_column = column.references
+            keys[column.name] = {row[0] for row in conn.execute(f"SELECT {ref_column} FROM {ref_table}")}
+    return keys
+
+
+def _insert_chunk(conn, sql, lines, chunk, table_name, rejects):
+    """
+    チャンクをまとめてINSERTする。主キーの重複などでコケたら、そのチャンクだけ1行ずつ入れ直して
+    ダメな行を隔離する (セーブポイントで巻き戻すので、チャンクの途中までが二重に入ったりしない)
+    """
+    conn.execute("SAVEPOINT ingest_chunk")
+    try:
+        conn.executemany(sql, chunk)
+        conn.execute("RELEASE ingest_chunk")
+        return len(chunk)
+    except sqlite3.IntegrityError:
+        conn.execute("ROLLBACK TO ingest_chunk")
+        conn.execute("RELEASE ingest_chunk")
+    loaded = 0
+    for line, values in zip(lines, chunk):
+        try:
+            conn.execute(sql, values)
+            loaded += 1
+        except sqlite3.IntegrityError as e:
+            rejects.append(Reject(table_name, line, f"DBに入らない: {e}", ','.join(map(str, values))))
+    return loaded
+
+
+def ingest(conn, csv_file, table_name, columns, rejects, chunk_size=CHUNK_SIZE):
+    """
+    CSVでテーブルの中身を入れ替える (呼び出し側のトランザクションの中で実行する)。
+    ヘッダーからしてダメなときは、今のテーブルの中身を消さずに残す
+    """
+    rejected_before = len(rejects)
+    chunks = iter_chunks(csv_file, table_name, columns, rejects, _known_keys(conn, columns), chunk_size)
+    try:
+        first = next(chunks, None)
+    except RowError as e:
+        rejects.append(Reject(table_name, 1, str(e), ''))
+        return IngestResult(table_name, 0, 1, True)
+
+    conn.execute(f"DELETE FROM {table_name}")
+    cols_sql = ', '.join(column.name for column in columns)
+    vals_sql = ', '.join('?' for _ in columns)
+    sql = f"INSERT INTO {table_name} ({cols_sql}) VALUES ({vals_sql})"
+    loaded = 0
+    if first is not None:
+        loaded += _insert_chunk(conn, sql, *first, table_name, rejects)
+        for lines, chunk in _prefetch(chunks):
+            loaded += _insert_chunk(conn, sql, lines, chunk, table_name, rejects)
+    return IngestResult(table_name, loaded, len(rejects) - rejected_before, False)
+
+
+def write_report(path, rejects):
+    """隔離した行のレポートをCSVで書き出す"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['table_name', 'line', 'reason', 'raw'])
+        writer.writerows(rejects)
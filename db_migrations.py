@@ -0,0 +1,218 @@
+# db_migrations.py (Ver 1.0 - Versioned Schema Migrations)
+# スキーマの変更は、ここに番号つきで足していく (一度出したマイグレーションは書き換えない！)
+# どこまで当てたかは SQLite の PRAGMA user_version に持っておく
+
+# (バージョン番号, 説明, SQLのリスト)
+MIGRATIONS = [
+    (1, "マスタテーブルとビルドマニフェスト", [
+        """
+        CREATE TABLE IF NOT EXISTS M_Users (
+            user_id TEXT PRIMARY KEY, user_name TEXT NOT NULL,
+            password_hash TEXT NOT NULL, plan_type TEXT DEFAULT 'free' NOT NULL
+        )""",
+        """
+        CREATE TABLE IF NOT EXISTS M_Categories (
+            category_id TEXT PRIMARY KEY, category_name TEXT NOT NULL, sort_order INTEGER
+        )""",
+        """
+        CREATE TABLE IF NOT EXISTS M_Knowledge_Base (
+            knowledge_id INTEGER PRIMARY KEY, /* AUTOINCREMENTを削除し、CSVのIDを正とする */
+            category_id TEXT NOT NULL, preset_question TEXT NOT NULL, success_title TEXT,
+            FOREIGN KEY (category_id) REFERENCES M_Categories (category_id)
+        )""",
+        """
+        CREATE TABLE IF NOT EXISTS M_Knowledge_Details (
+            detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            knowledge_id INTEGER NOT NULL, fact_type TEXT NOT NULL,
+            fact_text TEXT NOT NULL, experience_flag TEXT DEFAULT 'POSITIVE' NOT NULL, sort_order INTEGER,
+            FOREIGN KEY (knowledge_id) REFERENCES M_Knowledge_Base (knowledge_id)
+        )""",
+        # ビルドマニフェスト: テーブルごとに「どのCSV内容から作ったか」のハッシュを持つ
+        """
+        CREATE TABLE IF NOT EXISTS M_Build_Manifest (
+            table_name TEXT PRIMARY KEY, source_hash TEXT NOT NULL
+        )""",
+    ]),
+    (2, "ユーザーの目標テーブル", [
+        """
+        CREATE TABLE IF NOT EXISTS T_User_Goals (
+            user_goal_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            category_id TEXT NOT NULL,
+            goal_key TEXT NOT NULL, /* M_Knowledge_Baseのpreset_questionと連動 */
+            status TEXT DEFAULT 'not_started' NOT NULL, /* 'not_started' or 'completed' */
+            FOREIGN KEY (user_id) REFERENCES M_Users (user_id),
+            FOREIGN KEY (category_id) REFERENCES M_Categories (category_id)
+        )""",
+    ]),
+    (3, "DAOのクエリ用のインデックス (テーブルを読まずにインデックスだけで返せる形)", [
+        # タブの並び: ORDER BY sort_order
+        "CREATE INDEX IF NOT EXISTS IX_Categories_Sort ON M_Categories (sort_order, category_id, category_name)",
+        # タブごとのプリセット質問: WHERE category_id = ? ORDER BY knowledge_id
+        """CREATE INDEX IF NOT EXISTS IX_Knowledge_Base_Category
+           ON M_Knowledge_Base (category_id, knowledge_id, preset_question)""",
+        # RAGの材料: WHERE knowledge_id = ? ORDER BY sort_order (ソートなしで順番に読める)
+        """CREATE INDEX IF NOT EXISTS IX_Knowledge_Details_Knowledge
+           ON M_Knowledge_Details (knowledge_id, sort_order, fact_type, experience_flag, fact_text)""",
+        # 目標一覧: WHERE user_id = ? AND category_id = ?
+        """CREATE INDEX IF NOT EXISTS IX_User_Goals_User_Category
+           ON T_User_Goals (user_id, category_id, goal_key, status)""",
+        # 目標の更新: WHERE user_id = ? AND goal_key = ? (同じ目標は1ユーザー1行)
+        "CREATE UNIQUE INDEX IF NOT EXISTS UX_User_Goals_User_Goal ON T_User_Goals (user_id, goal_key)",
+    ]),
+    (4, "CSVの取り込みで隔離した行", [
+        """
+        CREATE TABLE IF NOT EXISTS M_Ingest_Rejects (
+            table_name TEXT NOT NULL, line INTEGER, reason TEXT NOT NULL, raw TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS IX_Ingest_Rejects_Table ON M_Ingest_Rejects (table_name)",
+    ]),
+    (5, "投稿者ごとのナレッジ (カテゴリとナレッジに creator_id)", [
+        # 既存の行はMVPの投稿者 'ken' のもの
+        "ALTER TABLE M_Categories ADD COLUMN creator_id TEXT NOT NULL DEFAULT 'ken'",
+        "ALTER TABLE M_Knowledge_Base ADD COLUMN creator_id TEXT NOT NULL DEFAULT 'ken'",
+        # 投稿者1人分のナレッジだけを読む: WHERE creator_id = ? ORDER BY knowledge_id
+        "CREATE INDEX IF NOT EXISTS IX_Knowledge_Base_Creator ON M_Knowledge_Base (creator_id, knowledge_id)",
+    ]),
+    (6, "チャット履歴 (セッションと要約のスナップショット、メッセージ)", [
+        """
+        CREATE TABLE IF NOT EXISTS T_Chat_Sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            summary TEXT NOT NULL DEFAULT '', /* ConversationMemory の要約 */
+            summary_upto INTEGER, /* 要約に畳み込んだ最後のメッセージの seq */
+            updated_at REAL NOT NULL
+        )""",
+        """
+        CREATE TABLE IF NOT EXISTS T_Chat_Messages (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL, /* セッション内の通し番号 */
+            role TEXT NOT NULL, /* 'user' or 'assistant' */
+            content TEXT NOT NULL, /* 画面に出した文面 */
+            memory_text TEXT, /* Geminiの履歴に入れた文面 (userのターンだけ。RAG材料は短くしたもの) */
+            created_at REAL NOT NULL,
+            PRIMARY KEY (session_id, seq)
+        ) WITHOUT ROWID""",
+    ]),
+    (7, "プラン(WBS)のマスタ: フェーズ・手順・依存関係・目標", [
+        """
+        CREATE TABLE IF NOT EXISTS M_Plan_Phases (
+            phase_id TEXT PRIMARY KEY, category_id TEXT NOT NULL, phase_title TEXT NOT NULL,
+            budget_note TEXT, /* 見出しに出す予算の目安 */
+            budget_min_yen INTEGER NOT NULL DEFAULT 0, /* 総額目安 (最低) の計算用 */
+            sort_order INTEGER,
+            FOREIGN KEY (category_id) REFERENCES M_Categories (category_id)
+        )""",
+        """
+        CREATE TABLE IF NOT EXISTS M_Plan_Steps (
+            phase_id TEXT NOT NULL, step_type TEXT NOT NULL, /* 'TASK' (番号つき) or 'NOTE' (補足) */
+            step_text TEXT NOT NULL, sort_order INTEGER,
+            FOREIGN KEY (phase_id) REFERENCES M_Plan_Phases (phase_id)
+        )""",
+        # phase_id をやるには、先に requires_phase_id が終わってないといけない
+        """
+        CREATE TABLE IF NOT EXISTS M_Plan_Dependencies (
+            phase_id TEXT NOT NULL, requires_phase_id TEXT NOT NULL,
+            PRIMARY KEY (phase_id, requires_phase_id),
+            FOREIGN KEY (phase_id) REFERENCES M_Plan_Phases (phase_id),
+            FOREIGN KEY (requires_phase_id) REFERENCES M_Plan_Phases (phase_id)
+        ) WITHOUT ROWID""",
+        # 目標 → それを叶えるフェーズ (前提のフェーズは依存関係からたどる)
+        """
+        CREATE TABLE IF NOT EXISTS M_Plan_Goals (
+            goal_key TEXT PRIMARY KEY, category_id TEXT NOT NULL, goal_label TEXT NOT NULL,
+            phase_id TEXT NOT NULL, sort_order INTEGER,
+            FOREIGN KEY (category_id) REFERENCES M_Categories (category_id),
+            FOREIGN KEY (phase_id) REFERENCES M_Plan_Phases (phase_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS IX_Plan_Steps_Phase ON M_Plan_Steps (phase_id, sort_order)",
+    ]),
+    (8, "目標の進み具合 (ユーザー × カテゴリごとの件数をトリガーで数えておく)", [
+        """
+        CREATE TABLE IF NOT EXISTS T_User_Goal_Progress (
+            user_id TEXT NOT NULL, category_id TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0, completed INTEGER NOT NULL DEFAULT 0,
+            seeded_version TEXT, /* 目標を M_Knowledge_Base から作ったときのテーブルのバージョン */
+            PRIMARY KEY (user_id, category_id)
+        ) WITHOUT ROWID""",
+        # 今ある目標から数えておく (ここから先はトリガーが増やしたり減らしたりする)
+        """
+        INSERT OR IGNORE INTO T_User_Goal_Progress (user_id, category_id, total, completed)
+        SELECT user_id, category_id, COUNT(*), SUM(status = 'completed') FROM T_User_Goals
+        GROUP BY user_id, category_id""",
+        """
+        CREATE TRIGGER IF NOT EXISTS TR_User_Goals_Insert AFTER INSERT ON T_User_Goals
+        BEGIN
+            INSERT OR IGNORE INTO T_User_Goal_Progress (user_id, category_id) VALUES (NEW.user_id, NEW.category_id);
+            UPDATE T_User_Goal_Progress
+            SET total = total + 1, completed = completed + (NEW.status = 'completed')
+            WHERE user_id = NEW.user_id AND category_id = NEW.category_id;
+        END""",
+        """
+        CREATE TRIGGER IF NOT EXISTS TR_User_Goals_Delete AFTER DELETE ON T_User_Goals
+        BEGIN
+            UPDATE T_User_Goal_Progress
+            SET total = total - 1, completed = completed - (OLD.status = 'completed')
+            WHERE user_id = OLD.user_id AND category_id = OLD.category_id;
+        END""",
+        """
+        CREATE TRIGGER IF NOT EXISTS TR_User_Goals_Status AFTER UPDATE OF status ON T_User_Goals
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE T_User_Goal_Progress
+            SET completed = completed + (NEW.status = 'completed') - (OLD.status = 'completed')
+            WHERE user_id = NEW.user_id AND category_id = NEW.category_id;
+        END""",
+    ]),
+    (9, "目標のキーを、質問の文面じゃなくて knowledge_id にする (文面を直しても進み具合が消えないように)", [
+        # ここから T_User_Goals.goal_key は knowledge_id の文字列 (v2 のコメントの preset_question じゃなくなる)
+        # CSVを入れ直す前に当たるので、M_Knowledge_Base はまだ前の文面のまま → 文面から knowledge_id を引ける
+        """
+        UPDATE T_User_Goals SET goal_key = (
+            SELECT CAST(kb.knowledge_id AS TEXT) FROM M_Knowledge_Base kb
+            WHERE kb.category_id = T_User_Goals.category_id AND kb.preset_question = T_User_Goals.goal_key
+            ORDER BY kb.knowledge_id LIMIT 1)
+        WHERE EXISTS (
+            SELECT 1 FROM M_Knowledge_Base kb
+            WHERE kb.category_id = T_User_Goals.category_id AND kb.preset_question = T_User_Goals.goal_key)""",
+        # 文面がもう無い目標はどの質問にも出ないので消す (トリガーが進み具合から引く)
+        """
+        DELETE FROM T_User_Goals WHERE goal_key NOT IN (
+            SELECT CAST(knowledge_id AS TEXT) FROM M_Knowledge_Base WHERE category_id = T_User_Goals.category_id)""",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0] # このコードが期待するスキーマのバージョン
+
+
+def schema_version(conn):
+    """DBに当たってるスキーマのバージョン (まっさらなDBは 0)"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def is_deferrable_index(statement):
+    """データを入れたあとに作っても同じになるインデックス (UNIQUE じゃないもの)"""
+    return statement.lstrip().upper().startswith("CREATE INDEX")
+
+
+def migrate(conn, deferred_indexes=None):
+    """
+    まだ当ててないマイグレーションを順番に当てる (当てたバージョンのリストを返す)。
+    呼び出し側のトランザクションの中で実行するので、失敗したら全部ロールバックされる。
+    deferred_indexes (リスト) を渡すと、UNIQUE じゃないインデックスは作らずにそこへ積む
+    (まっさらなDBに大量に取り込むときは、入れ終わってからまとめて作るほうがずっと速い)
+    """
+    current = schema_version(conn)
+    pending = [(version, statements) for version, _, statements in MIGRATIONS if version > current]
+    if not pending:
+        return []
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE") # DDLも含めて1トランザクションにする
+    for version, statements in pending:
+        for statement in statements:
+            if deferred_indexes is not None and is_deferrable_index(statement):
+                deferred_indexes.append(statement)
+                continue
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {int(version)}")
+    return [version for version, _ in pending]
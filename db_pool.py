@@ -0,0 +1,166 @@
+# db_pool.py (Ver 1.0 - SQLite Connection Pool)
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    SQLite用のコネクションプール。
+    - 読み込み: 最大 max_readers 本の接続を、借りて返すキューで使い回す
+      (Streamlitはrerunのたびに新しいスレッドなので、スレッドごとに持つと毎回接続が増えてしまう)。
+      全部貸し出し中なら返ってくるまで待つ。同じスレッドの中で入れ子に借りたら、同じ接続を使う
+    - 書き込み: 書き込み専用の接続1本を、ロックで順番待ちにして使う
+    - WALモードなので、書き込み中でも読み込みはブロックされない
+    """
+
+    def __init__(self, db_path, max_readers=32, cached_statements=256, busy_timeout_ms=5000, checkout_timeout=30.0):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self.cached_statements = cached_statements # 接続ごとのプリペアドステートメントのキャッシュ数
+        self.busy_timeout_ms = busy_timeout_ms
+        self.checkout_timeout = checkout_timeout # 全部貸し出し中のとき、これだけ待っても空かなければエラー
+
+        self._local = threading.local() # 入れ子で借りたとき用 (このスレッドが今借りてる接続と深さ)
+        # 空いてる読み込み接続のキュー。枠は max_readers 個で、None はまだ開いてない枠
+        # (要素は (世代, 接続)。close_all で世代が変わったら、返ってきた古い接続は閉じる)
+        self._idle = queue.LifoQueue(maxsize=max_readers)
+        for _ in range(max_readers):
+            self._idle.put(None)
+        self._generation = 0
+        self._readers_open = 0
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._reader_checkouts = 0
+        self._writer_checkouts = 0
+        self._wait_time = 0.0
+        self._opened = 0
+
+    def _connect(self, read_only):
+        # 別スレッドからcloseすることがあるので check_same_thread=False
+        # (使うのは必ず持ち主のスレッドだけ)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        # プラグマは接続を作るときの1回だけ！
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        with self._stats_lock:
+            self._opened += 1
+        return conn
+
+    def _record(self, kind, waited):
+        with self._stats_lock:
+            if kind == 'reader':
+                self._reader_checkouts += 1
+            else:
+                self._writer_checkouts += 1
+            self._wait_time += waited
+
+    def _close_reader(self, conn):
+        conn.close()
+        with self._readers_lock:
+            self._readers_open -= 1
+
+    @contextmanager
+    def reader(self):
+        """読み込み用の接続を貸し出す (with を抜けたらキューに返す)"""
+        held = getattr(self._local, 'held', None)
+        if held is not None: # 入れ子: 外側で借りてる接続をそのまま使う (枠を2つ使わない)
+            self._local.depth += 1
+            self._record('reader', 0.0)
+            try:
+                yield held[1]
+            finally:
+                self._local.depth -= 1
+            return
+
+        start = time.perf_counter()
+        try:
+            item = self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"読み込み接続が {self.checkout_timeout} 秒待っても空かない (max_readers={self.max_readers})") from None
+        waited = time.perf_counter() - start
+        try:
+            if item is None or item[0] != self._generation:
+                if item is not None:
+                    self._close_reader(item[1]) # DBが差し替わる前の接続
+                item = (self._generation, self._connect(read_only=True))
+                with self._readers_lock:
+                    self._readers_open += 1
+        except BaseException:
+            self._idle.put(None)
+            raise
+        self._record('reader', waited)
+        self._local.held, self._local.depth = item, 0
+        try:
+            yield item[1]
+        finally:
+            self._local.held = None
+            if item[0] != self._generation:
+                self._close_reader(item[1]) # 貸してる間に close_all された
+                item = None
+            self._idle.put(item)
+
+    @contextmanager
+    def writer(self):
+        """書き込み用の接続を貸し出す (1本だけなので順番待ち)。抜けるときにcommitする"""
+        start = time.perf_counter()
+        with self._writer_lock:
+            self._record('writer', time.perf_counter() - start)
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close_all(self):
+        """全部の接続を閉じる (DBファイルが差し替わったとき用)"""
+        # 世代を進めておけば、貸し出し中の接続は返ってきたときに閉じられる
+        self._generation += 1
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for item in idle:
+            if item is not None:
+                self._close_reader(item[1])
+            self._idle.put(None)
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def metrics(self):
+        """プールの利用状況 (貸し出し回数・待ち時間・開いてる接続数)"""
+        with self._stats_lock:
+            reader_checkouts = self._reader_checkouts
+            writer_checkouts = self._writer_checkouts
+            wait_time = self._wait_time
+            opened = self._opened
+        with self._readers_lock:
+            open_readers = self._readers_open
+        open_writers = 1 if self._writer is not None else 0
+        return {
+            'checkouts': reader_checkouts + writer_checkouts,
+            'reader_checkouts': reader_checkouts,
+            'writer_checkouts': writer_checkouts,
+            'wait_time_ms': wait_time * 1000,
+            'open_connections': open_readers + open_writers,
+            'idle_readers': self._idle.qsize(),
+            'opened_total': opened,
+        }
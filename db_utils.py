@@ -1,185 +1,435 @@
-# db_utils.py (Ver 5.0 - CSV Loader DAO)
+# db_utils.py (Ver 11.1 - Lazy Goal Seeding + Progress Counters)
 import sqlite3
 import os
-import csv # CSVファイルを読み込むための最強モジュール
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+import db_pool # コネクションプール
+import db_migrations # スキーマのバージョン管理
+import csv_ingest # CSVの取り込み (型チェック・おかしな行の隔離)
+from csv_ingest import Column
+import tracing # 区間ごとの所要時間 (PROTOS_TRACE=1 のときだけ測る)
 
-DB_NAME = "aiken_user_data.db" # 作成されるDBファイル名
+try:
+    import fcntl # ワーカー間のビルドロック用 (POSIXのみ)
+except ImportError:
+    fcntl = None
+
+DB_NAME = "aiken_user_data.db" # 作成されるDBファイル名 (CSVから作る。会話や目標も入るので git には入れない)
 
 # このスクリプト(db_utils.py)があるフォルダの「絶対パス」を取得
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # 全てのファイルパスを、この「絶対パス」基準で定義し直す！
-DB_NAME = os.path.join(BASE_DIR, "aiken_user_data.db") # DBファイル本体
+# (PROTOS_DB_PATH を指定すると別の場所に作る。ベンチや一時的な検証用)
+DB_NAME = os.getenv("PROTOS_DB_PATH") or os.path.join(BASE_DIR, "aiken_user_data.db") # DBファイル本体
+DB_LOCK_FILE = DB_NAME + ".lock" # ビルド中の排他ロック
 CSV_USERS = os.path.join(BASE_DIR, 'data_users.csv')
 CSV_CATEGORIES = os.path.join(BASE_DIR, 'data_categories.csv')
 CSV_KNOWLEDGE_BASE = os.path.join(BASE_DIR, 'data_knowledge_base.csv')
 CSV_KNOWLEDGE_DETAILS = os.path.join(BASE_DIR, 'data_knowledge_details.csv')
+CSV_PLAN_PHASES = os.path.join(BASE_DIR, 'data_plan_phases.csv')
+CSV_PLAN_STEPS = os.path.join(BASE_DIR, 'data_plan_steps.csv')
+CSV_PLAN_DEPENDENCIES = os.path.join(BASE_DIR, 'data_plan_dependencies.csv')
+CSV_PLAN_GOALS = os.path.join(BASE_DIR, 'data_plan_goals.csv')
+DEFAULT_CREATOR_ID = 'ken' # 投稿者が決まってないカテゴリは、MVPの投稿者が担当する
 
-def setup_database():
+# 取り込めなかった行のレポート (DBの隣に書く。全部取り込めたら消す)
+QUARANTINE_REPORT = os.path.join(os.path.dirname(DB_NAME), "ingest_quarantine.csv")
+
+# --- DB接続はプロセスで1つのプールから借りる ---
+_pool = db_pool.ConnectionPool(DB_NAME)
+_build_version = None # このプロセスが使ってるDBビルドのバージョン
+_build_manifest = {} # テーブル名 → CSVのハッシュ
+_initialized = False # init_database() が済んだか
+_init_lock = threading.Lock()
+
+# --- スキーマ（骨格）は db_migrations.py でバージョン管理 ---
+
+# --- CSV → テーブルの対応表 (テーブル名, CSVファイル, カラムと型) ---
+FACT_TYPES = ('WHY', 'STEP', 'FAILURE', 'PRO_TIP')
+PLAN_STEP_TYPES = ('TASK', 'NOTE')
+TABLE_SOURCES = [
+    ('M_Users', CSV_USERS, [
+        Column('user_id', csv_ingest.text), Column('user_name', csv_ingest.text),
+        Column('password_hash', csv_ingest.text)]),
+    ('M_Categories', CSV_CATEGORIES, [
+        Column('category_id', csv_ingest.text), Column('category_name', csv_ingest.text),
+        Column('sort_order', csv_ingest.optional_integer),
+        Column('creator_id', csv_ingest.text, ('M_Users', 'user_id'))]),
+    ('M_Knowledge_Base', CSV_KNOWLEDGE_BASE, [
+        Column('knowledge_id', csv_ingest.integer),
+        Column('category_id', csv_ingest.text, ('M_Categories', 'category_id')),
+        Column('preset_question', csv_ingest.text), Column('success_title', csv_ingest.optional_text),
+        Column('creator_id', csv_ingest.text, ('M_Users', 'user_id'))]),
+    ('M_Knowledge_Details', CSV_KNOWLEDGE_DETAILS, [
+        Column('knowledge_id', csv_ingest.integer, ('M_Knowledge_Base', 'knowledge_id')),
+        Column('fact_type', csv_ingest.choice(*FACT_TYPES)),
+        Column('fact_text', csv_ingest.text),
+        Column('experience_flag', csv_ingest.choice('POSITIVE', 'NEGATIVE', default='POSITIVE')),
+        Column('sort_order', csv_ingest.optional_integer)]),
+    ('M_Plan_Phases', CSV_PLAN_PHASES, [
+        Column('phase_id', csv_ingest.text),
+        Column('category_id', csv_ingest.text, ('M_Categories', 'category_id')),
+        Column('phase_title', csv_ingest.text), Column('budget_note', csv_ingest.optional_text),
+        Column('budget_min_yen', csv_ingest.integer), Column('sort_order', csv_ingest.optional_integer)]),
+    ('M_Plan_Steps', CSV_PLAN_STEPS, [
+        Column('phase_id', csv_ingest.text, ('M_Plan_Phases', 'phase_id')),
+        Column('step_type', csv_ingest.choice(*PLAN_STEP_TYPES, default='TASK')),
+        Column('step_text', csv_ingest.text), Column('sort_order', csv_ingest.optional_integer)]),
+    ('M_Plan_Dependencies', CSV_PLAN_DEPENDENCIES, [
+        Column('phase_id', csv_ingest.text, ('M_Plan_Phases', 'phase_id')),
+        Column('requires_phase_id', csv_ingest.text, ('M_Plan_Phases', 'phase_id'))]),
+    ('M_Plan_Goals', CSV_PLAN_GOALS, [
+        Column('goal_key', csv_ingest.text),
+        Column('category_id', csv_ingest.text, ('M_Categories', 'category_id')),
+        Column('goal_label', csv_ingest.text),
+        Column('phase_id', csv_ingest.text, ('M_Plan_Phases', 'phase_id')),
+        Column('sort_order', csv_ingest.optional_integer)]),
+]
+
+def _file_hash(path):
+    """CSVファイルの中身のハッシュ (ファイルが無ければ空文字)"""
+    if not os.path.exists(path):
+        return ""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_hashes():
+    return {table: _file_hash(csv_file) for table, csv_file, _ in TABLE_SOURCES}
+
+def _read_manifest(db_path):
     """
-    DBファイルが存在しない場合（＝Streamlit Cloud起動時）に、
-    CSVファイルからDBを爆速で自動構築する関数
+    既存DBのマニフェストを読む。
+    DBが無い/壊れてる → None、DBはあるけどマニフェストが無い → {}
     """
-    # もしDBファイルが「まだ」無かったら、作る
-    #if not os.path.exists(DB_NAME):
-    # 古いDBファイルがあったら、まず削除する（クリーンな状態にする）
-    if os.path.exists(DB_NAME):
-        print(f"古い {DB_NAME} を発見！削除するぜ！")
-        os.remove(DB_NAME)
-
-    print("CSVからDBを爆速で構築する！")
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{quote(db_path)}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
     try:
-        # --- 1. スキーマ（骨格）の作成 ---
-        # (SQLファイルはもう使わない！Pythonコードに直接書くぜ！)
-        cursor.execute("""
-        CREATE TABLE M_Users (
-            user_id TEXT PRIMARY KEY, user_name TEXT NOT NULL,
-            password_hash TEXT NOT NULL, plan_type TEXT DEFAULT 'free' NOT NULL 
-        )""")
-        
-        cursor.execute("""
-        CREATE TABLE M_Categories (
-            category_id TEXT PRIMARY KEY, category_name TEXT NOT NULL, sort_order INTEGER
-        )""")
-        
-        cursor.execute("""
-        CREATE TABLE M_Knowledge_Base (
-            knowledge_id INTEGER PRIMARY KEY, /* AUTOINCREMENTを削除し、CSVのIDを正とする */
-            category_id TEXT NOT NULL, preset_question TEXT NOT NULL, success_title TEXT,
-            FOREIGN KEY (category_id) REFERENCES M_Categories (category_id)
-        )""")
-
-        cursor.execute("""
-        CREATE TABLE M_Knowledge_Details (
-            detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            knowledge_id INTEGER NOT NULL, fact_type TEXT NOT NULL, 
-            fact_text TEXT NOT NULL, experience_flag TEXT DEFAULT 'POSITIVE' NOT NULL, sort_order INTEGER,
-            FOREIGN KEY (knowledge_id) REFERENCES M_Knowledge_Base (knowledge_id)
-        )""")
-        print("テーブル（骨格）の構築完了！")
-
-        # --- 2. CSVからデータ（魂）をぶち込む ---
-        # CSVファイルを読み込んでDBにINSERTする汎用ヘルパー関数
-        def load_csv_to_db(csv_file, table_name, columns):
-            if not os.path.exists(csv_file):
-                print(f"警告: {csv_file} が見つからないぜ！スキップする。")
-                return
-            
-            with open(csv_file, mode='r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                # カラム名を動的に生成
-                cols_sql = ', '.join(columns)
-                vals_sql = ', '.join(['?' for _ in columns]) # (?, ?, ?)
-                
-                data_to_insert = []
-                for row in reader:
-                    data_to_insert.append(tuple(row[col] for col in columns))
-                
-                if data_to_insert:
-                    cursor.executemany(f"INSERT INTO {table_name} ({cols_sql}) VALUES ({vals_sql})", 
-                                        data_to_insert)
-                    print(f"{csv_file} から {table_name} へのデータ投入完了！")
-
-        # 各CSVファイルを読み込む
-        load_csv_to_db(CSV_USERS, 'M_Users', ['user_id', 'user_name', 'password_hash'])
-        load_csv_to_db(CSV_CATEGORIES, 'M_Categories', ['category_id', 'category_name', 'sort_order'])
-        load_csv_to_db(CSV_KNOWLEDGE_BASE, 'M_Knowledge_Base', ['knowledge_id', 'category_id', 'preset_question', 'success_title'])
-        load_csv_to_db(CSV_KNOWLEDGE_DETAILS, 'M_Knowledge_Details', ['knowledge_id', 'fact_type', 'fact_text', 'experience_flag', 'sort_order'])
+        has_manifest = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'M_Build_Manifest'"
+        ).fetchone()
+        if not has_manifest:
+            return {}
+        if db_migrations.schema_version(conn) < db_migrations.SCHEMA_VERSION:
+            return {} # スキーマが古い → 全テーブルを入れ直す (マイグレーションもそこで当たる)
+        return dict(conn.execute("SELECT table_name, source_hash FROM M_Build_Manifest"))
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
 
+@contextmanager
+def _build_lock():
+    """複数のStreamlitワーカーが同時にビルドしないための排他ロック"""
+    with open(DB_LOCK_FILE, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _load_csv_to_db(conn, csv_file, table_name, columns):
+    """CSVファイルをチャンクずつ読んでDBに入れる (既存の行は入れ替え。おかしな行は隔離テーブルへ)"""
+    conn.execute("DELETE FROM M_Ingest_Rejects WHERE table_name = ?", (table_name,))
+    if not os.path.exists(csv_file):
+        conn.execute(f"DELETE FROM {table_name}")
+        print(f"警告: {csv_file} が見つからないぜ！スキップする。")
+        return
+
+    rejects = []
+    result = csv_ingest.ingest(conn, csv_file, table_name, columns, rejects)
+    if rejects:
+        conn.executemany("INSERT INTO M_Ingest_Rejects (table_name, line, reason, raw) VALUES (?, ?, ?, ?)",
+                         rejects)
+    if result.skipped:
+        print(f"警告: {csv_file} のヘッダーがおかしいぜ！{table_name} は前の中身のまま。")
+    elif result.rejected:
+        print(f"{csv_file} から {table_name} へ {result.loaded} 件投入、{result.rejected} 件は隔離したぜ！")
+    else:
+        print(f"{csv_file} から {table_name} へのデータ投入完了！")
+
+def _write_quarantine_report():
+    """隔離した行があればレポートに書き出す (無ければ古いレポートを消す)"""
+    with _pool.reader() as conn:
+        rejects = conn.execute(
+            "SELECT table_name, line, reason, raw FROM M_Ingest_Rejects ORDER BY table_name, line").fetchall()
+    if rejects:
+        csv_ingest.write_report(QUARANTINE_REPORT, [tuple(row) for row in rejects])
+        print(f"取り込めなかった行が {len(rejects)} 件あるぜ: {QUARANTINE_REPORT}")
+    elif os.path.exists(QUARANTINE_REPORT):
+        os.remove(QUARANTINE_REPORT)
+
+def _apply_sources(conn, tables, source_hashes, defer_indexes=False):
+    """
+    指定テーブルだけCSVから入れ直して、マニフェストを更新する。
+    defer_indexes=True なら、UNIQUE じゃないインデックスは取り込みが終わってから作る (まっさらなDB用)
+    """
+    deferred = [] if defer_indexes else None
+    applied = db_migrations.migrate(conn, deferred)
+    if applied:
+        print(f"スキーマを更新したぜ！: v{applied[-1]}")
+    cursor = conn.cursor()
+    for table_name, csv_file, columns in TABLE_SOURCES:
+        if table_name in tables:
+            _load_csv_to_db(conn, csv_file, table_name, columns)
+            cursor.execute(
+                "INSERT OR REPLACE INTO M_Build_Manifest (table_name, source_hash) VALUES (?, ?)",
+                (table_name, source_hashes[table_name]))
+    for statement in deferred or ():
+        cursor.execute(statement)
+    # 入れ直したら統計を取り直す (クエリプランナーが正しいインデックスを選べるように)
+    cursor.execute("ANALYZE")
+
+def _build_fresh(source_hashes):
+    """DBが無いときは一時ファイルに丸ごと作って、完成してからアトミックに差し替える"""
+    fd, tmp_path = tempfile.mkstemp(prefix=".aiken_build_", suffix=".db", dir=os.path.dirname(DB_NAME))
+    os.close(fd)
+    conn = sqlite3.connect(tmp_path)
+    for pragma in csv_ingest.BULK_LOAD_PRAGMAS: # 差し替えるまで誰も見ないので、ディスクに同期せず一気に書く
+        conn.execute(pragma)
+    try:
+        _apply_sources(conn, set(source_hashes), source_hashes, defer_indexes=True)
         conn.commit()
+        conn.close()
+        os.replace(tmp_path, DB_NAME) # 中途半端なDBは誰にも見せない！
+        _pool.close_all() # 古いファイルを掴んでる接続は捨てる
         print("DB構築完了だぜ！")
-        
     except Exception as e:
         print(f"DB構築中にエラー発生！: {e}")
-        conn.rollback() # 失敗したらロールバック！
-    finally:
         conn.close()
-#   else:
-#       print("DBファイルは既に存在するぜ。起動を続ける。")
+        os.remove(tmp_path)
+
+def _rebuild_changed(changed, source_hashes):
+    """CSVが変わったテーブルだけを、1トランザクションで入れ替える"""
+    try:
+        with _pool.writer() as conn:
+            _apply_sources(conn, changed, source_hashes)
+        print(f"差分だけ再構築したぜ！: {', '.join(sorted(changed))}")
+    except Exception as e:
+        # 失敗したらロールバック！(前のDBはそのまま使える)
+        print(f"DB構築中にエラー発生！: {e}")
+
+def _version_of(manifest):
+    """マニフェスト(テーブル→CSVハッシュ)から、ビルド全体のバージョン文字列を作る"""
+    digest = hashlib.sha256()
+    for table_name, source_hash in sorted(manifest.items()):
+        digest.update(f"{table_name}={source_hash};".encode('utf-8'))
+    return digest.hexdigest()[:16]
 
-# --- アプリ起動時に必ずDBをチェック・構築 ---
-setup_database()
+def get_build_version():
+    """今のDBビルドのバージョン。CSVが変わってDBが作り直されたら変わる"""
+    init_database()
+    return _build_version
+
+def get_table_version(table_name):
+    """テーブル1つ分のバージョン (そのテーブルのCSVが変わったときだけ変わる)"""
+    init_database()
+    return _build_manifest.get(table_name, "")
+
+@tracing.traced("db.setup")
+def setup_database():
+    """
+    CSVの中身が変わったテーブルだけを、DBに反映する関数。
+    何も変わってなければハッシュを比べるだけで即終了する。
+    """
+    global _build_version, _build_manifest
+    source_hashes = _source_hashes()
+    manifest = _read_manifest(DB_NAME)
+    if manifest != source_hashes:
+        with _build_lock():
+            # ロック待ちの間に他のワーカーが作ってくれたかもしれないので、もう一回見る
+            manifest = _read_manifest(DB_NAME)
+            if manifest is None:
+                print("CSVからDBを爆速で構築する！")
+                with tracing.span("db.build_fresh"):
+                    _build_fresh(source_hashes)
+            elif manifest != source_hashes:
+                changed = {table for table, source_hash in source_hashes.items()
+                           if manifest.get(table) != source_hash}
+                with tracing.span("db.rebuild_changed"):
+                    _rebuild_changed(changed, source_hashes)
+            manifest = _read_manifest(DB_NAME) or {}
+            _write_quarantine_report()
+    # 何も変わってなければ、ここまでハッシュ比較だけ！爆速で起動続行
+    _build_version = _version_of(manifest)
+    _build_manifest = dict(manifest)
+
+def init_database():
+    """
+    DBをチェック・構築する (アプリの起動時に呼ぶ)。
+    import しただけではDBを触らない。実際にやるのはプロセスで1回だけで、2回目からは何もしない
+    (呼び忘れても、接続を借りるときにここを通るので大丈夫)
+    """
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            setup_database()
+            _initialized = True
 
 # --- これ以降は、昨日作った「DB操作関数（DAO）」 ---
-# (中身は一切変更なし！ `schema.sql` `seed.sql` が不要になっただけ！)
+# (接続は毎回作らず、プールから借りて使い回す！)
 
-def get_db_connection():
-    """DB接続を返す（おまじない）"""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row 
-    return conn
+def read_connection():
+    """プールから読み込み用の接続を借りる (with文で使う)"""
+    init_database()
+    return _pool.reader()
 
+def write_connection():
+    """プールから書き込み用の接続を借りる (with文で使う。抜けるときにcommit)"""
+    init_database()
+    return _pool.writer()
+
+# --- DAOのSQL (ベンチで実行計画を見るときも同じ文字列を使う) ---
+SQL_CATEGORIES = "SELECT category_id, category_name FROM M_Categories ORDER BY sort_order"
+SQL_PRESET_QUESTIONS = """
+    SELECT preset_question, knowledge_id FROM M_Knowledge_Base
+    WHERE category_id = ? ORDER BY knowledge_id
+"""
+SQL_KNOWLEDGE_DETAILS = """
+    SELECT 
+        kb.success_title,
+        kd.fact_type,
+        kd.fact_text,
+        kd.experience_flag
+    FROM M_Knowledge_Details kd
+    JOIN M_Knowledge_Base kb ON kd.knowledge_id = kb.knowledge_id
+    WHERE kd.knowledge_id = ?
+    ORDER BY kd.sort_order
+"""
+SQL_USER_NAME = "SELECT user_name FROM M_Users WHERE user_id = ?"
+SQL_CREATOR_FOR_CATEGORY = "SELECT creator_id FROM M_Categories WHERE category_id = ?"
+SQL_USER_GOALS = "SELECT goal_key, status FROM T_User_Goals WHERE user_id = ? AND category_id = ?"
+SQL_UPDATE_USER_GOAL = "UPDATE T_User_Goals SET status = ? WHERE user_id = ? AND goal_key = ?"
+SQL_GOAL_SEEDED_VERSION = "SELECT seeded_version FROM T_User_Goal_Progress WHERE user_id = ? AND category_id = ?"
+# カテゴリのプリセット質問を、そのまま目標にする (goal_key = knowledge_id。もうあるものは飛ばす)
+# 文面じゃなくてIDをキーにするので、CSVで質問の言い回しを直しても進み具合はそのまま
+SQL_SEED_USER_GOALS = """
+    INSERT OR IGNORE INTO T_User_Goals (user_id, category_id, goal_key)
+    SELECT ?, category_id, CAST(knowledge_id AS TEXT) FROM M_Knowledge_Base
+    WHERE category_id = ? ORDER BY knowledge_id
+"""
+# CSVから消えた (or 別のカテゴリに移った) ナレッジの目標は消す (進み具合の分母に残らないように)
+SQL_PRUNE_USER_GOALS = """
+    DELETE FROM T_User_Goals WHERE user_id = ? AND category_id = ? AND goal_key NOT IN (
+        SELECT CAST(knowledge_id AS TEXT) FROM M_Knowledge_Base WHERE category_id = ?)
+"""
+SQL_MARK_GOALS_SEEDED = """
+    INSERT INTO T_User_Goal_Progress (user_id, category_id, seeded_version) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, category_id) DO UPDATE SET seeded_version = excluded.seeded_version
+"""
+SQL_GOAL_PROGRESS = "SELECT category_id, completed, total FROM T_User_Goal_Progress WHERE user_id = ?"
+
+GOAL_STATUSES = ('not_started', 'completed')
+
+@tracing.traced("db.get_categories")
 def get_categories():
     """タブに表示するカテゴリを全部持ってくる"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT category_id, category_name FROM M_Categories ORDER BY sort_order")
-    categories = cursor.fetchall()
-    conn.close()
-    return categories
+    with read_connection() as conn:
+        return conn.execute(SQL_CATEGORIES).fetchall()
 
+@tracing.traced("db.get_preset_questions")
 def get_preset_questions(category_id):
     """指定されたカテゴリのプリセット質問（ボタン用）を持ってくる"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT preset_question, knowledge_id FROM M_Knowledge_Base WHERE category_id = ?", (category_id,))
-    questions = cursor.fetchall()
-    conn.close()
-    return questions
+    with read_connection() as conn:
+        return conn.execute(SQL_PRESET_QUESTIONS, (category_id,)).fetchall()
 
+@tracing.traced("db.get_knowledge_details_by_id")
 def get_knowledge_details_by_id(knowledge_id):
     """指定されたIDの「経験値の詳細（箇条書きDB）」を持ってくる (RAG用)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 
-            kb.success_title,
-            kd.fact_type,
-            kd.fact_text,
-            kd.experience_flag
-        FROM M_Knowledge_Details kd
-        JOIN M_Knowledge_Base kb ON kd.knowledge_id = kb.knowledge_id
-        WHERE kd.knowledge_id = ?
-        ORDER BY kd.sort_order
-    """, (knowledge_id,))
-    details = cursor.fetchall()
-    conn.close()
-    return details
+    with read_connection() as conn:
+        return conn.execute(SQL_KNOWLEDGE_DETAILS, (knowledge_id,)).fetchall()
 
+@tracing.traced("db.get_user_name")
 def get_user_name(user_id):
     """指定されたユーザーIDのユーザー名を取得する"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_name FROM M_Users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    with read_connection() as conn:
+        user = conn.execute(SQL_USER_NAME, (user_id,)).fetchone()
     if user:
         return user['user_name']
     else:
         return "ゲスト"
 
+@tracing.traced("db.get_creator_id_for_category")
+def get_creator_id_for_category(category_id):
+    """このカテゴリのナレッジを投稿した人(AIの型)のユーザーID。カテゴリが無ければ None"""
+    with read_connection() as conn:
+        row = conn.execute(SQL_CREATOR_FOR_CATEGORY, (category_id,)).fetchone()
+    return row['creator_id'] if row else None
+
+def _seed_user_goals(user_id, category_id, version):
+    """目標をまだ作ってない (or ナレッジが変わった) ときだけ、INSERT ... SELECT 1回で作る。作ったら True"""
+    with write_connection() as conn:
+        # 書き込みロックを取ってから見直す (同じユーザーが2つのタブで同時に開いても1回だけ)
+        seeded = conn.execute(SQL_GOAL_SEEDED_VERSION, (user_id, category_id)).fetchone()
+        if seeded is not None and seeded['seeded_version'] == version:
+            return False
+        conn.execute(SQL_PRUNE_USER_GOALS, (user_id, category_id, category_id))
+        conn.execute(SQL_SEED_USER_GOALS, (user_id, category_id))
+        conn.execute(SQL_MARK_GOALS_SEEDED, (user_id, category_id, version))
+    return True
+
+@tracing.traced("db.get_user_goals_by_category")
 def get_user_goals_by_category(user_id, category_id):
-    """指定されたユーザー/カテゴリの目標リストとステータスを取得"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT goal_key, status FROM T_User_Goals WHERE user_id = ? AND category_id = ?", (user_id, category_id))
-    goals = cursor.fetchall()
-    conn.close()
-    
-    if not goals:
-        # (中身は昨日と同じ... MVP用：もしT_User_Goalsにまだ目標がなかったら、M_Knowledge_Baseから作ってあげる)
-        # ... (省略) ...
-        pass # あとで実装しよう！
-        
-    return goals
+    """
+    指定されたユーザー/カテゴリの目標リストとステータスを取得 (goal_key は knowledge_id の文字列)。
+    初めて開いたカテゴリ (or ナレッジのCSVが変わったあと) は、M_Knowledge_Base のプリセット質問から目標を作る。
+    画面に出す文面はカタログのプリセット質問から引く
+    """
+    version = get_table_version('M_Knowledge_Base')
+    with read_connection() as conn:
+        seeded = conn.execute(SQL_GOAL_SEEDED_VERSION, (user_id, category_id)).fetchone()
+        if seeded is not None and seeded['seeded_version'] == version:
+            return conn.execute(SQL_USER_GOALS, (user_id, category_id)).fetchall()
+
+    _seed_user_goals(user_id, category_id, version)
+    with read_connection() as conn:
+        return conn.execute(SQL_USER_GOALS, (user_id, category_id)).fetchall()
+
+@tracing.traced("db.update_user_goal_statuses")
+def update_user_goal_statuses(user_id, changes):
+    """
+    目標のステータスをまとめて更新する (changes は {goal_key: status} か [(goal_key, status), ...])。
+    全部1つのトランザクションで書く (途中で失敗したら1件も書かない)。
+    進み具合 (T_User_Goal_Progress) はトリガーが数え直すので、ここでは触らない
+    """
+    items = list(changes.items() if isinstance(changes, dict) else changes)
+    for goal_key, status in items:
+        if status not in GOAL_STATUSES:
+            raise ValueError(f"目標のステータスがおかしい: {goal_key} → {status!r} (使えるのは {GOAL_STATUSES})")
+    if not items:
+        return 0
+    with write_connection() as conn:
+        cursor = conn.executemany(SQL_UPDATE_USER_GOAL, [(status, user_id, goal_key) for goal_key, status in items])
+        return cursor.rowcount
 
 def update_user_goal_status(user_id, goal_key, status):
-    """ユーザーの目標ステータスを更新"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE T_User_Goals SET status = ? WHERE user_id = ? AND goal_key = ?", (status, user_id, goal_key))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    """ユーザーの目標ステータスを更新 (1件だけ)"""
+    return update_user_goal_statuses(user_id, [(goal_key, status)])
+
+@tracing.traced("db.get_goal_progress")
+def get_goal_progress(user_id):
+    """
+    タブのバッジ用: {category_id: (完了した数, 目標の数)}。
+    トリガーで数えてある行を読むだけ (集計クエリは走らない)。まだ目標を作ってないカテゴリは入ってない
+    """
+    with read_connection() as conn:
+        rows = conn.execute(SQL_GOAL_PROGRESS, (user_id,)).fetchall()
+    return {row['category_id']: (row['completed'], row['total']) for row in rows}
+
+def get_pool_metrics():
+    """コネクションプールの利用状況 (貸し出し回数・待ち時間・接続数)"""
+    return _pool.metrics()
@@ -0,0 +1,187 @@
+# intent_router.py (Ver 1.2 - Per-Creator Local Intent Router)
+# チャット入力を、AIに投げる前に手元で振り分ける:
+#   preset … プリセット質問とほぼ同じ質問 (ボタンと同じ道を通るので、キャッシュがあればAIを呼ばない)
+#   plan   … 「何を買えばいい？」みたいな、プランのマスタで答えられる質問 (AIを呼ばない)
+#   llm    … それ以外の雑談 (今まで通りGeminiへ)
+# ベクトル(文字n-gramのTF-IDF)は投稿者ごと・ビルドごとに1回だけ作っておくので、振り分けは1ミリ秒かからない
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+import db_utils
+import knowledge_catalog
+import knowledge_search
+import plan_engine
+import tracing
+
+PRESET = 'preset'
+PLAN = 'plan'
+LLM = 'llm'
+ROUTES = (PRESET, PLAN, LLM)
+
+PRESET_MIN_SIMILARITY = 0.6 # これ以上ならプリセット質問と「同じ質問」とみなす (コサイン類似度)
+PLAN_GOAL_MIN_COVERAGE = 0.25 # 目標の文言 (重みつきn-gram) のうち、これだけ発言に入ってたらその目標を選んでるとみなす
+# プランを聞いてるっぽい言い回し (これが無いと、目標の話をしててもプランは出さない)
+PLAN_CUES = ("買えば", "買う", "買った", "揃え", "そろえ", "プラン", "wbs", "ロードマップ", "何から", "手順", "予算")
+HIRAGANA_WEIGHT = knowledge_search.HIRAGANA_QUERY_WEIGHT # ひらがなだけのn-gramは助詞・語尾が多いので軽く見る
+_HIRAGANA_ONLY = re.compile(r"^[\u3041-\u309f]+$")
+
+# 振り分けの結果 (preset なら category_id/knowledge_id/question、plan なら category_id/goal_keys が入る)
+Intent = namedtuple('Intent', ['route', 'score', 'category_id', 'knowledge_id', 'question', 'goal_keys'])
+
+
+class IntentIndex:
+    """
+    プリセット質問と目標の文言を、文字n-gramのTF-IDFベクトルにして持っておく。
+    転置インデックス (n-gram → [(文書番号, 重み), ...]) なので、発言に出てきたn-gramの分だけ見れば済む
+    """
+
+    def __init__(self, build_version, presets, goals):
+        self.build_version = build_version
+        self.presets = presets # [(knowledge_id, category_id, preset_question), ...]
+        self.goals = goals # [PlanGoal, ...]
+        texts = [question for _, _, question in presets] + [goal.goal_label for goal in goals]
+        grams = [Counter(knowledge_search.char_ngrams(text)) for text in texts]
+        df = Counter(gram for doc in grams for gram in doc)
+        n_docs = len(texts)
+        self.idf = {gram: math.log(1 + n_docs / count) for gram, count in df.items()}
+        self.unknown_idf = math.log(1 + n_docs) # インデックスに無いn-gram (発言側だけに出てくる)
+        self.postings = {}
+        self.totals = [] # 文書ごとの重みの合計 (目標のカバー率の分母)
+        for doc_id, doc in enumerate(grams):
+            vector = self._weigh(doc)
+            norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+            for gram, weight in vector.items():
+                self.postings.setdefault(gram, []).append((doc_id, weight / norm, weight))
+            self.totals.append(sum(vector.values()) or 1.0)
+
+    def _weigh(self, grams):
+        vector = {}
+        for gram, tf in grams.items():
+            weight = tf * self.idf.get(gram, self.unknown_idf)
+            if _HIRAGANA_ONLY.match(gram):
+                weight *= HIRAGANA_WEIGHT
+            vector[gram] = weight
+        return vector
+
+    def score(self, text):
+        """発言と各文書の (コサイン類似度, 文書のカバー率) を {文書番号: [cos, coverage]} で返す"""
+        vector = self._weigh(Counter(knowledge_search.char_ngrams(text)))
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        scores = {}
+        for gram, weight in vector.items():
+            for doc_id, unit, raw in self.postings.get(gram, ()):
+                entry = scores.get(doc_id)
+                if entry is None:
+                    entry = scores[doc_id] = [0.0, 0.0]
+                entry[0] += weight / norm * unit
+                entry[1] += raw / self.totals[doc_id]
+        return scores
+
+    def classify(self, text):
+        """発言を preset / plan / llm のどれかに振り分ける"""
+        scores = self.score(text)
+        n_presets = len(self.presets)
+
+        # 1) プランを聞いてて、目標が読み取れたら plan (同じカテゴリの目標だけまとめる)
+        lowered = text.lower()
+        if any(cue in lowered for cue in PLAN_CUES):
+            matched = sorted(((entry[1], self.goals[doc_id - n_presets])
+                              for doc_id, entry in scores.items()
+                              if doc_id >= n_presets and entry[1] >= PLAN_GOAL_MIN_COVERAGE),
+                             key=lambda item: -item[0])
+            if matched:
+                best_score, best = matched[0]
+                goal_keys = tuple(goal.goal_key for _, goal in matched if goal.category_id == best.category_id)
+                return Intent(PLAN, best_score, best.category_id, None, None, goal_keys)
+
+        # 2) プリセット質問とほぼ同じなら preset
+        best_id, best_score = None, 0.0
+        for doc_id, entry in scores.items():
+            if doc_id < n_presets and entry[0] > best_score:
+                best_id, best_score = doc_id, entry[0]
+        if best_id is not None and best_score >= PRESET_MIN_SIMILARITY:
+            knowledge_id, category_id, question = self.presets[best_id]
+            return Intent(PRESET, best_score, category_id, knowledge_id, question, ())
+
+        # 3) それ以外は雑談 (AIへ)
+        return Intent(LLM, best_score, None, None, None, ())
+
+
+@tracing.traced("router.build_index")
+def build_index(creator_id=db_utils.DEFAULT_CREATOR_ID):
+    """投稿者1人分のプリセット質問 (カタログから) と、その人のカテゴリのプランの目標から、振り分け用のインデックスを作る"""
+    catalog = knowledge_catalog.get_catalog(creator_id)
+    presets = [(question.knowledge_id, category_id, question.preset_question)
+               for category_id, questions in catalog.questions_by_category.items() for question in questions]
+    presets.sort()
+    own_categories = {category.category_id for category in catalog.categories if category.creator_id == creator_id}
+    goals = [goal for goal in plan_engine.get_book().goals.values() if goal.category_id in own_categories]
+    return IntentIndex(catalog.build_version, presets, goals)
+
+
+# --- 投稿者ごとのインデックス (投稿者ID → IntentIndex、LRU。DBのビルドが変わったら作り直す) ---
+MAX_INDEXES = knowledge_catalog.MAX_SHARDS
+_indexes = OrderedDict()
+_index_lock = threading.Lock()
+_counts = Counter()
+_counts_lock = threading.Lock()
+_ROUTE_ORDER = {PLAN: 0, PRESET: 1, LLM: 2} # 投稿者をまたいで選ぶときの優先順
+
+def get_index(creator_id=db_utils.DEFAULT_CREATOR_ID):
+    """投稿者1人分の振り分けインデックス (ビルドごとに1回だけ作る)"""
+    version = db_utils.get_build_version()
+    with _index_lock:
+        index = _indexes.get(creator_id)
+        if index is None or index.build_version != version:
+            index = _indexes[creator_id] = build_index(creator_id)
+        _indexes.move_to_end(creator_id)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+        return index
+
+
+@tracing.traced("router.classify")
+def classify(text, creator_ids=(db_utils.DEFAULT_CREATOR_ID,)):
+    """
+    チャット入力を振り分けて Intent を返す (振り分けた数はルートごとに数えておく)。
+    creator_ids は振り分け先の候補の投稿者 (app.py では雑談の投稿者と、今使ってるタブの投稿者の1〜2人)。
+    それぞれのインデックスで振り分けて、plan → preset → llm の順 (同じルートならスコアの高いほう) で1つ選ぶ
+    """
+    intent = min((get_index(creator_id).classify(text) for creator_id in dict.fromkeys(creator_ids)),
+                 key=lambda intent: (_ROUTE_ORDER[intent.route], -intent.score),
+                 default=Intent(LLM, 0.0, None, None, None, ()))
+    with _counts_lock:
+        _counts[intent.route] += 1
+    return intent
+
+
+def record_answer(local):
+    """
+    振り分けたチャット入力に実際どう答えたかを数える (chat_service.respond から呼ぶ)。
+    local は AIを呼ばずに答えたとき (プラン or キャッシュから出したプリセット)
+    """
+    with _counts_lock:
+        _counts['answered_local' if local else 'answered_llm'] += 1
+
+
+def stats():
+    """
+    ルートごとの件数と、実際にAIを呼ばずに答えた割合。
+    preset に振り分けても、キャッシュに無ければAIを呼ぶので、割合は振り分けじゃなくて答えた時点で数える
+    """
+    with _counts_lock:
+        result = {route: _counts[route] for route in ROUTES}
+        answered_local, answered_llm = _counts['answered_local'], _counts['answered_llm']
+    result['total'] = sum(result.values())
+    result['answered_local'] = answered_local
+    result['answered_llm'] = answered_llm
+    answered = answered_local + answered_llm
+    result['local_share'] = answered_local / answered if answered else 0.0
+    return result
+
+
+def reset_stats():
+    with _counts_lock:
+        _counts.clear()
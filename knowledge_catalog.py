@@ -0,0 +1,141 @@
+# knowledge_catalog.py (Ver 2.0 - Per-Creator Knowledge Shards)
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import db_utils
+import tracing
+
+# 投稿者ごとのカタログ (シャード) をメモリに持っておく数。あふれたら一番使われてないものから捨てる
+MAX_SHARDS = int(os.getenv("PROTOS_CATALOG_SHARDS", "64"))
+
+# --- カタログの中身 (タプルなので、アンパックも属性アクセスもOK) ---
+Category = namedtuple('Category', ['category_id', 'category_name', 'creator_id'])
+PresetQuestion = namedtuple('PresetQuestion', ['preset_question', 'knowledge_id'])
+KnowledgeDetail = namedtuple('KnowledgeDetail', ['success_title', 'fact_type', 'fact_text', 'experience_flag'])
+
+# タブに出すカテゴリ (全投稿者共通。ビルドごとに1回だけ読む)
+CATEGORIES_SQL = "SELECT category_id, category_name, creator_id FROM M_Categories ORDER BY sort_order"
+
+# 投稿者1人分のナレッジ(+詳細)を、1回のクエリでまとめて持ってくる
+CATALOG_SQL = """
+    SELECT kb.category_id, kb.knowledge_id, kb.preset_question, kb.success_title,
+           kd.fact_type, kd.fact_text, kd.experience_flag
+    FROM M_Knowledge_Base kb
+    LEFT JOIN M_Knowledge_Details kd ON kd.knowledge_id = kb.knowledge_id
+    WHERE kb.creator_id = ?
+    ORDER BY kb.knowledge_id, kd.sort_order
+"""
+
+
+@dataclass(frozen=True)
+class KnowledgeCatalog:
+    """投稿者1人分の読み取り専用のナレッジ一式。作ったら二度と変わらない"""
+    build_version: str
+    creator_id: str
+    categories: tuple # タブに出すカテゴリ (全投稿者共通のタプルを共有する)
+    questions_by_category: MappingProxyType # category_id → (PresetQuestion, ...)
+    details_by_knowledge: MappingProxyType # knowledge_id → (KnowledgeDetail, ...)
+    versions_by_knowledge: MappingProxyType # knowledge_id → 質問+詳細の中身のハッシュ
+
+    def preset_questions(self, category_id):
+        """指定カテゴリのプリセット質問 (get_preset_questionsと同じ並び)"""
+        return self.questions_by_category.get(category_id, ())
+
+    def knowledge_details(self, knowledge_id):
+        """指定ナレッジの詳細 (get_knowledge_details_by_idと同じ並び)"""
+        return self.details_by_knowledge.get(knowledge_id, ())
+
+    def knowledge_version(self, knowledge_id):
+        """そのナレッジ1件の中身が変わったら変わるバージョン文字列"""
+        return self.versions_by_knowledge.get(knowledge_id, "")
+
+
+def load_categories():
+    """タブに出すカテゴリを全部読む"""
+    with db_utils.read_connection() as conn:
+        return tuple(Category(*row) for row in conn.execute(CATEGORIES_SQL))
+
+
+@tracing.traced("catalog.load")
+def load_catalog(creator_id=db_utils.DEFAULT_CREATOR_ID, categories=None):
+    """DBから投稿者1人分のカタログを組み立てる (SQLは1回だけ)"""
+    build_version = db_utils.get_build_version()
+    if categories is None:
+        categories = load_categories()
+    with db_utils.read_connection() as conn:
+        rows = conn.execute(CATALOG_SQL, (creator_id,)).fetchall()
+
+    questions = {}
+    details = {}
+    for row in rows:
+        knowledge_id = row['knowledge_id']
+        if knowledge_id not in details:
+            details[knowledge_id] = []
+            questions.setdefault(row['category_id'], []).append(
+                PresetQuestion(row['preset_question'], knowledge_id))
+        if row['fact_type'] is not None:
+            details[knowledge_id].append(KnowledgeDetail(
+                row['success_title'], row['fact_type'], row['fact_text'], row['experience_flag']))
+
+    versions = {}
+    for category_questions in questions.values():
+        for question in category_questions:
+            digest = hashlib.sha256(repr((question, details[question.knowledge_id])).encode('utf-8'))
+            versions[question.knowledge_id] = digest.hexdigest()[:16]
+
+    return KnowledgeCatalog(
+        build_version=build_version,
+        creator_id=creator_id,
+        categories=categories,
+        questions_by_category=MappingProxyType({k: tuple(v) for k, v in questions.items()}),
+        details_by_knowledge=MappingProxyType({k: tuple(v) for k, v in details.items() if v}),
+        versions_by_knowledge=MappingProxyType(versions),
+    )
+
+
+# --- プロセスで持っておくシャード (投稿者ID → カタログ、LRU) ---
+_shards = OrderedDict()
+_shards_version = None # シャードを作ったときのビルドバージョン (変わったら全部捨てる)
+_categories = None
+_shards_lock = threading.Lock()
+_stats = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+def get_catalog(creator_id=db_utils.DEFAULT_CREATOR_ID):
+    """
+    投稿者1人分のカタログを返す。
+    DBのビルドバージョンが変わったときと、LRUから追い出されたときだけ読み直す (それ以外はSQLゼロ！)
+    """
+    global _shards_version, _categories
+    build_version = db_utils.get_build_version()
+    with _shards_lock:
+        if _shards_version != build_version:
+            _shards.clear()
+            _categories = None
+            _shards_version = build_version
+        catalog = _shards.get(creator_id)
+        if catalog is not None:
+            _shards.move_to_end(creator_id)
+            _stats['hits'] += 1
+            return catalog
+        # 読み込みはロックを持ったまま (同じ投稿者を2回読まないように。1人分なので軽い)
+        if _categories is None:
+            _categories = load_categories()
+        catalog = load_catalog(creator_id, _categories)
+        _shards[creator_id] = catalog
+        _stats['loads'] += 1
+        while len(_shards) > MAX_SHARDS:
+            _shards.popitem(last=False)
+            _stats['evictions'] += 1
+        return catalog
+
+
+def stats():
+    """シャードキャッシュの効き具合"""
+    with _shards_lock:
+        result = dict(_stats)
+        result['shards'] = len(_shards)
+    return result
@@ -0,0 +1,171 @@
+# knowledge_search.py (Ver 2.1 - Per-Creator BM25 Retrieval over Knowledge)
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+import db_utils
+import knowledge_catalog
+import tracing
+
+# 検索対象: プリセット質問・結論タイトル・詳細の事実 (フィールドごとの重み)
+FIELD_WEIGHTS = {'preset_question': 2, 'success_title': 1, 'fact_text': 1}
+
+# 投稿者ごとのインデックスをメモリに持っておく数 (カタログのシャードと同じだけ)
+MAX_INDEXES = knowledge_catalog.MAX_SHARDS
+
+_WORD_RUN = re.compile(r"\w+")
+_HIRAGANA_ONLY = re.compile(r"^[\u3041-\u309f]+$")
+HIRAGANA_QUERY_WEIGHT = 0.25 # 「したい」「いい」みたいなひらがなだけのn-gramは助詞・語尾が多いので軽く見る
+
+
+def char_ngrams(text, ngram_range=(2, 3)):
+    """
+    文字n-gramに分解する (日本語は単語の区切りが無いので、形態素解析の代わり)
+    記号や空白で区切った塊ごとに作るので、塊をまたいだn-gramはできない
+    """
+    text = unicodedata.normalize('NFKC', text or "").lower()
+    low, high = ngram_range
+    grams = []
+    for run in _WORD_RUN.findall(text):
+        if len(run) < low:
+            grams.append(run)
+            continue
+        for n in range(low, high + 1):
+            grams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return grams
+
+
+class BM25Index:
+    """
+    転置インデックス(語 → {文書ID: 出現回数})の疎行列で持つBM25。
+    1件ずつ upsert して作る (avgdlなどの統計は次の検索で作り直す)。
+    ナレッジはCSVを入れ直したときしか変わらないので、1件だけの更新はしない (ビルドごとに作り直す)
+    """
+
+    def __init__(self, k1=1.5, b=0.75, ngram_range=(2, 3)):
+        self.k1 = k1
+        self.b = b
+        self.ngram_range = ngram_range
+        self.postings = {} # 語 → {doc_id: tf}
+        self.doc_terms = {} # doc_id → Counter (削除・更新のため)
+        self.doc_len = {}
+        self._total_len = 0
+        self._norm = None # doc_id → k1 * (1 - b + b * dl / avgdl)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def _terms_for(self, fields):
+        terms = Counter()
+        for name, text in fields.items():
+            weight = FIELD_WEIGHTS.get(name, 1)
+            for gram in char_ngrams(text, self.ngram_range):
+                terms[gram] += weight
+        return terms
+
+    def _remove_locked(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings[term]
+            del posting[doc_id]
+            if not posting:
+                del self.postings[term]
+        self._total_len -= self.doc_len.pop(doc_id)
+        self._norm = None
+
+    def upsert(self, doc_id, fields):
+        """1件追加 or 更新 (fields: {'preset_question': ..., 'fact_text': ...})"""
+        terms = self._terms_for(fields)
+        with self._lock:
+            self._remove_locked(doc_id)
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.doc_terms[doc_id] = terms
+            self.doc_len[doc_id] = sum(terms.values())
+            self._total_len += self.doc_len[doc_id]
+            self._norm = None
+
+    def _doc_norms_locked(self):
+        if self._norm is None:
+            avgdl = (self._total_len / len(self.doc_len)) if self.doc_len else 1.0
+            self._norm = {doc_id: self.k1 * (1 - self.b + self.b * dl / avgdl)
+                          for doc_id, dl in self.doc_len.items()}
+        return self._norm
+
+    def search(self, query, k=3):
+        """クエリに近い順に [(doc_id, score), ...] を最大k件返す"""
+        terms = set(char_ngrams(query, self.ngram_range))
+        scores = {}
+        with self._lock:
+            norm = self._doc_norms_locked()
+            n_docs = len(norm)
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                if _HIRAGANA_ONLY.match(term):
+                    idf *= HIRAGANA_QUERY_WEIGHT
+                for doc_id, tf in posting.items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm[doc_id])
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+@tracing.traced("search.build_index")
+def build_index(catalog):
+    """投稿者1人分のカタログ (knowledge_catalog.KnowledgeCatalog) からインデックスを作る (SQLは使わない)"""
+    index = BM25Index()
+    for questions in catalog.questions_by_category.values():
+        for question in questions:
+            details = catalog.knowledge_details(question.knowledge_id)
+            index.upsert(question.knowledge_id, {
+                'preset_question': question.preset_question,
+                'success_title': (details[0].success_title or "") if details else "",
+                'fact_text': "\n".join(detail.fact_text for detail in details),
+            })
+    return index
+
+
+# --- 投稿者ごとのインデックス (投稿者ID → (ビルドバージョン, BM25Index)、LRU) ---
+# 全投稿者まとめた1つのインデックスだと、投稿者が増えるほど大きくなるし、上位k件がほかの投稿者で埋まってしまう
+_indexes = OrderedDict()
+_index_lock = threading.Lock()
+_stats = {'hits': 0, 'builds': 0, 'evictions': 0}
+
+def get_index(creator_id=db_utils.DEFAULT_CREATOR_ID):
+    """投稿者1人分のインデックス (カタログのシャードから、ビルドごとに1回だけ作る)"""
+    catalog = knowledge_catalog.get_catalog(creator_id)
+    with _index_lock:
+        entry = _indexes.get(creator_id)
+        if entry is not None and entry[0] == catalog.build_version:
+            _indexes.move_to_end(creator_id)
+            _stats['hits'] += 1
+            return entry[1]
+        index = build_index(catalog)
+        _indexes[creator_id] = (catalog.build_version, index)
+        _indexes.move_to_end(creator_id)
+        _stats['builds'] += 1
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+            _stats['evictions'] += 1
+        return index
+
+@tracing.traced("search.query")
+def search(text, k=3, min_score=0.0, creator_id=db_utils.DEFAULT_CREATOR_ID):
+    """ユーザーの発言に関係ありそうな、その投稿者の knowledge_id を [(knowledge_id, score), ...] で返す"""
+    return [(doc_id, score) for doc_id, score in get_index(creator_id).search(text, k) if score >= min_score]
+
+
+def stats():
+    """インデックスのキャッシュの効き具合"""
+    with _index_lock:
+        result = dict(_stats)
+        result['indexes'] = len(_indexes)
+    return result
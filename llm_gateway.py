@@ -0,0 +1,418 @@
+# llm_gateway.py (Ver 1.1 - Async LLM Gateway)
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+_DONE = object() # ストリームの終わりの目印
+
+# 429/503みたいな「待てば通る」エラー (google.api_core.exceptions のクラス名)
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+    'DeadlineExceeded', 'InternalServerError', 'GatewayTimeout',
+}
+
+
+@dataclass
+class LLMRequest:
+    """LLMへの1回分のリクエスト (どのバックエンドに、どんな履歴で、何を送るか)"""
+    backend: object
+    prompt: str
+    history: list = field(default_factory=list)
+
+    def key(self):
+        """同じ中身のリクエストを束ねるためのキー"""
+        raw = json.dumps([self.backend.name, self.history, self.prompt], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# --- バックエンド (ここを差し替えればGemini以外でも動く) ---
+class GeminiBackend:
+    """
+    google.generativeai の GenerativeModel をそのまま呼ぶバックエンド。
+    model の代わりに model_factory を渡すと、最初に呼ばれたときにモデルを作る (SDKの読み込みを後回しにできる)
+    """
+
+    def __init__(self, model=None, name=None, model_factory=None):
+        self._model = model
+        self._model_factory = model_factory
+        self._model_lock = threading.Lock()
+        self.name = name or getattr(model, 'model_name', 'gemini')
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._model_factory()
+        return self._model
+
+    def generate(self, request):
+        chat = self.model.start_chat(history=request.history)
+        return chat.send_message(request.prompt).text
+
+    def stream(self, request):
+        chat = self.model.start_chat(history=request.history)
+        for chunk in chat.send_message(request.prompt, stream=True):
+            try:
+                piece = chunk.text
+            except ValueError: # セーフティでブロックされた空チャンク
+                continue
+            if piece:
+                yield piece
+
+    def is_retryable(self, exc):
+        return type(exc).__name__ in RETRYABLE_ERROR_NAMES or isinstance(exc, ConnectionError)
+
+
+class StubRateLimitError(Exception):
+    """スタブが投げる「429っぽい」エラー"""
+
+
+class StubBackend:
+    """
+    テスト・ベンチ用のローカルなスタブ (APIキー不要)
+    reply_fn: プロンプト → 返答, delay: 1チャンクごとの待ち時間(秒), fail_times: 最初の何回かは429を返す
+    """
+
+    def __init__(self, reply_fn=None, delay=0.0, first_delay=None, chunk_size=8, fail_times=0, name='stub'):
+        self.reply_fn = reply_fn or (lambda prompt: f"なるほど〜「{prompt}」ね！")
+        self.delay = delay
+        self.first_delay = delay if first_delay is None else first_delay
+        self.chunk_size = chunk_size
+        self.name = name
+        self._failures_left = fail_times
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            if self._failures_left > 0:
+                self._failures_left -= 1
+                raise StubRateLimitError("429: quota exceeded (stub)")
+
+    def generate(self, request):
+        self._maybe_fail()
+        reply = self.reply_fn(request.prompt)
+        n_chunks = max(1, -(-len(reply) // self.chunk_size))
+        time.sleep(self.first_delay + self.delay * (n_chunks - 1))
+        return reply
+
+    def stream(self, request):
+        self._maybe_fail()
+        reply = self.reply_fn(request.prompt)
+        for i in range(0, len(reply), self.chunk_size):
+            time.sleep(self.first_delay if i == 0 else self.delay)
+            yield reply[i:i + self.chunk_size]
+
+    def is_retryable(self, exc):
+        return isinstance(exc, StubRateLimitError)
+
+
+class TokenBucket:
+    """トークンバケット: 平均 rate 回/秒、瞬間的には burst 回まで (ゲートウェイのループ内だけで使う)"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Piece:
+    """GatewayChat が返すチャンク (Geminiのレスポンスと同じく .text を持つ)"""
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class GatewayChat:
+    """model.start_chat() の代わり。send_message はゲートウェイ経由で送られる"""
+
+    def __init__(self, gateway, backend, history, timeout=None):
+        self.gateway = gateway
+        self.backend = backend
+        self.history = list(history)
+        self.timeout = timeout
+
+    def send_message(self, prompt, stream=False):
+        request = LLMRequest(self.backend, prompt, self.history)
+        if stream:
+            return (_Piece(piece) for piece in self.gateway.stream(request, self.timeout))
+        return _Piece(self.gateway.generate(request, self.timeout))
+
+
+class GatewayOverloaded(RuntimeError):
+    """締め切りを過ぎても終わらない呼び出しが多すぎて、新しい呼び出しを受けられない"""
+
+
+class _Broadcast:
+    """
+    1本のストリームを、同じリクエストを待ってる全員に配る (ループのスレッドの中だけで触る)。
+    途中から来た人には、それまでに届いたチャンクを先に流す
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.outs = []
+
+    def subscribe(self, out):
+        for piece in self.pieces:
+            out.put(piece)
+        self.outs.append(out)
+
+    def put(self, piece):
+        self.pieces.append(piece)
+        for out in self.outs:
+            out.put(piece)
+
+    def finish(self, item):
+        for out in self.outs:
+            out.put(item)
+
+
+class _StreamInterrupted(Exception):
+    """ストリームの途中で失敗した (リトライしない) ことを伝える包み"""
+
+    def __init__(self, cause):
+        super().__init__(str(cause))
+        self.cause = cause
+
+
+class LLMGateway:
+    """
+    app.py とモデルの間に入る非同期ゲートウェイ (イベントループは専用スレッドで回す)
+    - 同時に外へ出る呼び出しは max_concurrency 本まで (セマフォ)
+    - 平均 rate_per_sec 回/秒を超えないようにトークンバケットで絞る
+    - 全く同じリクエストが同時に来たら、1回だけ呼んで結果を分け合う (ストリームも1本を全員に配る)
+    - 429などはジッター付き指数バックオフでリトライ、全体の締め切りは timeout 秒
+    - 締め切りを過ぎてもバックエンドが返ってこない呼び出しは、待つのをやめてスレッドだけ残す (「置き去り」)。
+      置き去りは max_abandoned 本まで。スレッドはその分多めに持つので、生きてる呼び出しの枠は減らない
+    """
+
+    def __init__(self, max_concurrency=8, rate_per_sec=5.0, burst=10, max_retries=3,
+                 base_delay=0.5, max_delay=8.0, timeout=60.0, max_abandoned=None):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.max_abandoned = max_concurrency if max_abandoned is None else max_abandoned
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency + self.max_abandoned,
+                                            thread_name_prefix="llm-gateway")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-gateway-loop", daemon=True)
+        self._thread.start()
+        # セマフォ・バケット・束ね用の辞書は、ループのスレッドの中だけで触る
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_per_sec, burst)
+        self._inflight = {}
+        self._streams = {} # リクエストのキー → _Broadcast (飛行中のストリーム)
+        self._abandoned = 0 # 置き去りにして、まだ終わってない呼び出しの数
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'coalesced': 0, 'backend_calls': 0, 'retries': 0,
+                       'failures': 0, 'timeouts': 0, 'abandoned': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _backoff(self, attempt):
+        """ジッター付き指数バックオフ (0.5倍〜1.5倍に揺らす)"""
+        return min(self.max_delay, self.base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return remaining
+
+    async def _run_blocking(self, remaining, fn, *args):
+        """
+        バックエンドの (ブロックする) 呼び出しをスレッドで実行して、remaining 秒だけ待つ。
+        間に合わなかったらスレッドは置き去りにして、終わったときに数を戻す
+        """
+        if self._abandoned >= self.max_abandoned:
+            raise GatewayOverloaded(f"終わらないLLM呼び出しが {self._abandoned} 本たまってる")
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), remaining)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._abandoned += 1
+                self._count('abandoned')
+                future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release_abandoned))
+            raise
+
+    def _release_abandoned(self):
+        self._abandoned -= 1
+
+    async def _with_retries(self, request, deadline, call):
+        """セマフォとレート制限を通して call() を呼ぶ。リトライできるエラーならやり直す"""
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                try:
+                    await asyncio.wait_for(self._bucket.acquire(), self._remaining(deadline))
+                    self._count('backend_calls')
+                    return await call(self._remaining(deadline))
+                except (_StreamInterrupted, GatewayOverloaded):
+                    self._count('failures')
+                    raise
+                except Exception as e:
+                    if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline:
+                        self._count('timeouts')
+                        raise TimeoutError("LLMの呼び出しが締め切りに間に合わなかった") from e
+                    delay = self._backoff(attempt)
+                    if (attempt >= self.max_retries or not request.backend.is_retryable(e)
+                            or time.monotonic() + delay >= deadline):
+                        self._count('failures')
+                        raise
+                    self._count('retries')
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    async def agenerate(self, request, timeout=None):
+        """全文を返す (同じリクエストが飛行中なら、それに相乗りする)"""
+        self._count('requests')
+        key = request.key()
+        shared = self._inflight.get(key)
+        if shared is not None:
+            self._count('coalesced')
+            return await asyncio.shield(shared)
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        loop = asyncio.get_running_loop()
+
+        async def call(remaining):
+            return await self._run_blocking(remaining, request.backend.generate, request)
+
+        shared = loop.create_future()
+        self._inflight[key] = shared
+        try:
+            result = await self._with_retries(request, deadline, call)
+            shared.set_result(result)
+            return result
+        except Exception as e:
+            shared.set_exception(e)
+            shared.exception() # 相乗りがいなくても「未取得の例外」警告を出さない
+            raise
+        finally:
+            del self._inflight[key]
+
+    def generate(self, request, timeout=None):
+        """同期版 (Streamlitのスクリプトスレッドから呼ぶ用)"""
+        return asyncio.run_coroutine_threadsafe(self.agenerate(request, timeout), self._loop).result()
+
+    async def _stream_worker(self, request, out, deadline):
+        """
+        ストリームを out (キュー) に流す。同じリクエストのストリームが飛行中なら、それに相乗りする
+        (最初の人の締め切りで1本だけ呼んで、届いたチャンクを全員に配る)
+        """
+        key = request.key()
+        broadcast = self._streams.get(key)
+        if broadcast is not None:
+            self._count('coalesced')
+            broadcast.subscribe(out)
+            return
+        broadcast = self._streams[key] = _Broadcast()
+        broadcast.subscribe(out)
+        started = False
+
+        async def call(remaining):
+            nonlocal started
+            pieces = request.backend.stream(request)
+            try:
+                while True:
+                    piece = await self._run_blocking(self._remaining(deadline), next, pieces, _DONE)
+                    if piece is _DONE:
+                        return
+                    started = True
+                    broadcast.put(piece)
+            except Exception as e:
+                # 1チャンクでも流したあとは、リトライすると文章が二重になるのでやり直さない
+                if started:
+                    raise _StreamInterrupted(e) from e
+                raise
+
+        try:
+            await self._with_retries(request, deadline, call)
+            result = _DONE
+        except _StreamInterrupted as e:
+            result = e.cause
+        except Exception as e:
+            result = e
+        # 外してから終わりを配る (同じループの中なので、この間に相乗りしてくる人はいない)
+        del self._streams[key]
+        broadcast.finish(result)
+
+    def stream(self, request, timeout=None):
+        """チャンクを届いた順に返すジェネレーター (同期)"""
+        self._count('requests')
+        deadline = time.monotonic() + (timeout or self.timeout)
+        out = queue.Queue()
+        asyncio.run_coroutine_threadsafe(self._stream_worker(request, out, deadline), self._loop)
+        while True:
+            try:
+                # ワーカー側が締め切りでエラーを入れてくれるので、こっちは少しだけ余裕を持って待つ
+                item = out.get(timeout=max(deadline - time.monotonic(), 0) + 1.0)
+            except queue.Empty:
+                self._count('timeouts')
+                raise TimeoutError("LLMのストリームが締め切りに間に合わなかった")
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                if isinstance(item, asyncio.TimeoutError):
+                    raise TimeoutError("LLMのストリームが締め切りに間に合わなかった") from item
+                raise item
+            yield item
+
+    def start_chat(self, backend, history=(), timeout=None):
+        """model.start_chat(history=...) と同じ感覚で使えるチャット"""
+        return GatewayChat(self, backend, history, timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['hung'] = self._abandoned # 置き去りにして、まだ返ってこない呼び出し
+        return result
+
+
+# --- プロセスで1つだけ持っておく (同時実行数・レート制限はプロセス全体で共有) ---
+_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_gateway():
+    """プロセス共通のゲートウェイ (設定は環境変数 PROTOS_LLM_* で変えられる)"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(
+                    max_concurrency=int(os.getenv("PROTOS_LLM_CONCURRENCY", "8")),
+                    rate_per_sec=float(os.getenv("PROTOS_LLM_RATE", "5")),
+                    burst=int(os.getenv("PROTOS_LLM_BURST", "10")),
+                    timeout=float(os.getenv("PROTOS_LLM_TIMEOUT", "60")),
+                    max_abandoned=int(os.getenv("PROTOS_LLM_MAX_ABANDONED", "8")),
+                )
+    return _gateway
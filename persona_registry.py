@@ -0,0 +1,149 @@
+# persona_registry.py (Ver 1.1 - Lazy SDK Import)
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import db_utils
+import llm_gateway
+import tracing
+
+MODEL_NAME = 'models/gemini-flash-latest'
+MAX_PERSONAS = 256 # キャッシュしておく人格の数 (古いものから捨てる)
+
+# --- AIの人格設定のテンプレート (「投稿ユーザ」の名前を .format で埋め込む！) ---
+#あなたの会話相手は「{LOGGED_IN_USER_NAME}」です。
+#あなたは「{CHAT_AI_NAME}」という名のAIアシスタントです。
+#あなたは「{LOGGED_IN_USER_NAME}」の人生の最適化を支援するフランクなプロダクトマネージャー兼相棒です。
+#- **必ず「{CHAT_AI_NAME}自身の経験」として、ゼロからフランクな会話を再構築（ラッピング）すること！**
+
+SYSTEM_PROMPT_TEMPLATE = """
+ユーザーの人生の最適化を支援するフランクなプロダクトマネージャー兼相棒です。
+
+【人格設定】
+- 常に友達と話すようにフランクに話す。少しは絵文字も使ってOK。
+- テンション上げすぎるな。落ち着いた口調で話せ。
+- ユーザーに対する命令形や断定的な指示は絶対にするな。
+- 語尾は「かな〜」、「だよー」、「いいかもしれない」みたいに曖昧に柔らかい表現にしろ。
+- ユーモアを交えて、時々ジョークや軽いツッコミを入れろ。
+- 専門用語は使わず、わかりやすく説明しろ。
+- 最重要：回答は簡潔にしろ。
+- 質問の意図を汲み取り、的外れな回答はしない。
+- 相手の話をよく聞き、共感を示すことを忘れずに。
+- 相手が困っている場合は、親身になって助ける姿勢を見せろ。
+- 必要に応じて、具体的な例やアナロジーを使って説明しろ。
+- 提案は「〜しろ！」ではなく、「こんな感じでいんじゃない〜？」という「提案形」を基本としろ。
+
+【RAG（検索拡張生成）の指示】
+- **最重要：** ユーザーから「型」について聞かれた場合、その「箇条書きナレッジ」は「ただの事実データ」なので、**絶対にそのまま読み上げるな！**
+- **必ず「自身の経験」として、ゼロからフランクな会話を再構築（ラッピング）すること！**
+- 例えば、`fact_text`が「Nature Remoを購入し失敗」だったら、「**マジでそれ！俺も最初Nature Remo買ってさ、カーテン動かなくて買い直したんだよね…マジ無駄金だったわ（笑）**」のように、**{CHAT_AI_NAME}の口調と感情**を込めて語り直せ！
+- 「FAILURE」フラグのナレッジは、特に「おれもハマったわ〜」という共感を込めて伝えろ。
+"""
+TEMPLATE_HASH = hashlib.sha256(SYSTEM_PROMPT_TEMPLATE.encode('utf-8')).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class Persona:
+    """1人のログインユーザーと1人の投稿ユーザー(AIの型)の組み合わせ。一度作ったら使い回す"""
+    user_id: str
+    creator_id: str
+    user_name: str
+    ai_name: str
+    system_prompt: str
+    backend: object # llm_gateway のバックエンド (モデルはこれ経由で呼ぶ)
+
+    @property
+    def model(self):
+        """GenerativeModel (初めて触ったときに作る)"""
+        return self.backend.model
+
+
+_personas = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'builds': 0, 'build_ms': 0.0}
+
+# --- google.generativeai は重いので、最初にモデルを呼ぶときまで import しない ---
+_genai = None
+_genai_lock = threading.Lock()
+_api_key = None # configure() で受け取ったキー
+_configured_api_key = None # 実際に genai.configure したキー
+
+
+def configure(api_key):
+    """APIキーを覚えておく (genai.configure はSDKを読み込むときに、プロセスで1回だけ)"""
+    global _api_key
+    with _genai_lock:
+        _api_key = api_key
+    if _genai is not None:
+        _load_genai() # もう読み込み済みなら、キーが変わったときだけやり直す
+
+
+def _load_genai():
+    """SDKを読み込んで、覚えておいたキーで configure する (2回目からは読み込み済みのものを返す)"""
+    global _genai, _configured_api_key
+    with _genai_lock:
+        if _genai is None:
+            with tracing.span("persona.import_genai"):
+                import google.generativeai as genai
+            _genai = genai
+        if _api_key is not None and _api_key != _configured_api_key:
+            _genai.configure(api_key=_api_key)
+            _configured_api_key = _api_key
+        return _genai
+
+
+def _lookup_name(user_id, fallback):
+    try:
+        return db_utils.get_user_name(user_id)
+    except Exception as e:
+        print(f"ユーザー名の取得でDBエラー: {e}")
+        return fallback
+
+
+def build_persona(user_id, creator_id):
+    """人格プロンプト・モデル・名前を組み立てる (キャッシュに無いときだけ呼ばれる)"""
+    user_name = _lookup_name(user_id, "ゲスト")
+    ai_name = _lookup_name(creator_id, "AI")
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
+        CHAT_AI_NAME=ai_name, LOGGED_IN_USER_NAME=user_name)
+    prompt_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]
+    # モデルは最初にAIを呼ぶときに作る (SDKの import もそのときまで待つ)
+    backend = llm_gateway.GeminiBackend(
+        name=f"{MODEL_NAME}:{creator_id}:{prompt_hash}",
+        model_factory=lambda: _load_genai().GenerativeModel(model_name=MODEL_NAME, system_instruction=system_prompt))
+    return Persona(user_id, creator_id, user_name, ai_name, system_prompt, backend)
+
+
+def get_persona(user_id, creator_id):
+    """
+    キャッシュ済みの人格を返す。
+    M_Users のCSVかテンプレートが変わったときだけ作り直す
+    """
+    key = (user_id, creator_id, db_utils.get_table_version('M_Users'), TEMPLATE_HASH)
+    with _lock:
+        persona = _personas.get(key)
+        if persona is not None:
+            _personas.move_to_end(key)
+            _stats['hits'] += 1
+            return persona
+
+    start = time.perf_counter()
+    persona = build_persona(user_id, creator_id)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    with _lock:
+        _personas[key] = persona
+        while len(_personas) > MAX_PERSONAS:
+            _personas.popitem(last=False)
+        _stats['builds'] += 1
+        _stats['build_ms'] += elapsed_ms
+    return persona
+
+
+def stats():
+    """キャッシュの効き具合 (ヒット数・作った回数・作るのにかかった合計時間)"""
+    with _lock:
+        result = dict(_stats)
+        result['cached'] = len(_personas)
+    return result
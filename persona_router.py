@@ -0,0 +1,64 @@
+# persona_router.py (Ver 1.0 - Category → Creator → Persona Routing)
+# タブ(カテゴリ)ごとに「どの投稿者のナレッジと人格で答えるか」を決める
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import db_utils
+import knowledge_catalog
+import persona_registry
+
+# カテゴリ → 投稿者 の対応を覚えておく数 (投稿者が何人いても、メモリはここで頭打ち)
+MAX_ROUTES = int(os.getenv("PROTOS_ROUTE_CACHE", "4096"))
+
+# 1回のリクエストの行き先 (投稿者・その人格・その投稿者のナレッジ)
+Route = namedtuple('Route', ['creator_id', 'persona', 'catalog'])
+
+_creators = OrderedDict() # category_id → creator_id
+_creators_version = None # 対応表を作ったときの M_Categories のバージョン
+_lock = threading.Lock()
+_stats = {'hits': 0, 'lookups': 0}
+
+
+def creator_for_category(category_id):
+    """
+    カテゴリの投稿者ID (DBを見るのはLRUに無いときだけ)。
+    カテゴリが無い・投稿者が決まってないときは DEFAULT_CREATOR_ID
+    """
+    global _creators_version
+    version = db_utils.get_table_version('M_Categories')
+    with _lock:
+        if _creators_version != version:
+            _creators.clear()
+            _creators_version = version
+        creator_id = _creators.get(category_id)
+        if creator_id is not None:
+            _creators.move_to_end(category_id)
+            _stats['hits'] += 1
+            return creator_id
+
+    creator_id = db_utils.get_creator_id_for_category(category_id) or db_utils.DEFAULT_CREATOR_ID
+    with _lock:
+        _creators[category_id] = creator_id
+        _stats['lookups'] += 1
+        while len(_creators) > MAX_ROUTES:
+            _creators.popitem(last=False)
+    return creator_id
+
+
+def route(user_id, category_id):
+    """ログインユーザー × カテゴリ → (投稿者, 人格, ナレッジ)。どれもキャッシュから引くだけ"""
+    creator_id = creator_for_category(category_id)
+    return Route(creator_id,
+                 persona_registry.get_persona(user_id, creator_id),
+                 knowledge_catalog.get_catalog(creator_id))
+
+
+def stats():
+    """ルーティングとその先のキャッシュの効き具合"""
+    with _lock:
+        result = dict(_stats)
+        result['routes'] = len(_creators)
+    result['catalog'] = knowledge_catalog.stats()
+    result['personas'] = persona_registry.stats()
+    return result
@@ -0,0 +1,234 @@
+# plan_engine.py (Ver 1.0 - Data-Driven Plan Engine)
+# old/smart_home_logic.py の generate_smarthome_wbs_v2 を、マスタ(DB)から組み立てる形にしたもの。
+# フェーズ・手順・予算・依存関係は M_Plan_* (CSVから取り込む) に持つので、どのカテゴリでも同じ仕組みで動く。
+# 同じ目標の組み合わせなら、2回目からはキャッシュを返すだけ (AIもSQLも使わない)
+import graphlib
+import heapq
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import db_utils
+import tracing
+
+# 目標の組み合わせ → プラン を覚えておく数
+MAX_PLANS = int(os.getenv("PROTOS_PLAN_CACHE", "1024"))
+
+NO_GOALS_REPLY = ("おっと、具体的な目標がまだ決まってないみたいだな？ まずは「声で電気つけたい」とか"
+                  "「カーテン自動化したい」とか、やりたいことを教えてくれよな！")
+
+# --- マスタの中身 ---
+PhaseRow = namedtuple('PhaseRow', ['phase_id', 'category_id', 'phase_title', 'budget_note', 'budget_min_yen', 'sort_order'])
+PlanStep = namedtuple('PlanStep', ['step_type', 'step_text']) # step_type は 'TASK' (番号つき) or 'NOTE' (補足)
+PlanGoal = namedtuple('PlanGoal', ['goal_key', 'category_id', 'goal_label', 'phase_id'])
+
+PHASES_SQL = """
+    SELECT phase_id, category_id, phase_title, budget_note, budget_min_yen, sort_order
+    FROM M_Plan_Phases ORDER BY sort_order, phase_id
+"""
+STEPS_SQL = "SELECT phase_id, step_type, step_text FROM M_Plan_Steps ORDER BY phase_id, sort_order"
+DEPENDENCIES_SQL = "SELECT phase_id, requires_phase_id FROM M_Plan_Dependencies"
+GOALS_SQL = "SELECT goal_key, category_id, goal_label, phase_id FROM M_Plan_Goals ORDER BY sort_order, goal_key"
+
+
+@dataclass(frozen=True)
+class PlanBook:
+    """1ビルド分のプランのマスタ (全カテゴリ分。小さいので丸ごとメモリに持つ)"""
+    build_version: str
+    phases: MappingProxyType # phase_id → PhaseRow
+    steps: MappingProxyType # phase_id → (PlanStep, ...)
+    requires: MappingProxyType # phase_id → (先にやるべき phase_id, ...)
+    goals: MappingProxyType # goal_key → PlanGoal
+    goals_by_category: MappingProxyType # category_id → (PlanGoal, ...)
+
+    def goals_for(self, category_id):
+        """カテゴリで選べる目標 (画面の選択肢用)"""
+        return self.goals_by_category.get(category_id, ())
+
+
+@dataclass(frozen=True)
+class PlanPhase:
+    """プランの1フェーズ"""
+    phase_id: str
+    phase_title: str
+    budget_note: str
+    budget_min_yen: int
+    steps: tuple # (PlanStep, ...)
+    required_by: tuple # 前提として入ったときの、これを必要としてるフェーズのタイトル (目標で直接選ばれたら空)
+
+
+@dataclass(frozen=True)
+class Plan:
+    """目標の組み合わせ1つ分のプラン。作ったら二度と変わらない"""
+    category_id: str
+    goals: tuple # 正規化した目標 (重複なし・ソート済み。知らない目標は除く)
+    unknown_goals: tuple # このカテゴリのマスタに無かった目標
+    phases: tuple # やる順 (依存関係のトポロジカル順。同じ順位なら sort_order 順)
+    total_budget_min_yen: int
+    text: str # 描画済みの文面 (作るときに1回だけ描画する)
+
+
+@tracing.traced("plan.load_book")
+def load_book():
+    """DBからプランのマスタを全部読む"""
+    build_version = db_utils.get_build_version()
+    with db_utils.read_connection() as conn:
+        phase_rows = conn.execute(PHASES_SQL).fetchall()
+        step_rows = conn.execute(STEPS_SQL).fetchall()
+        dependency_rows = conn.execute(DEPENDENCIES_SQL).fetchall()
+        goal_rows = conn.execute(GOALS_SQL).fetchall()
+
+    phases = {row['phase_id']: PhaseRow(*row) for row in phase_rows}
+    steps = {}
+    for row in step_rows:
+        steps.setdefault(row['phase_id'], []).append(PlanStep(row['step_type'], row['step_text']))
+    requires = {}
+    for row in dependency_rows:
+        requires.setdefault(row['phase_id'], []).append(row['requires_phase_id'])
+    goals = {row['goal_key']: PlanGoal(*row) for row in goal_rows}
+    goals_by_category = {}
+    for goal in goals.values():
+        goals_by_category.setdefault(goal.category_id, []).append(goal)
+
+    return PlanBook(
+        build_version=build_version,
+        phases=MappingProxyType(phases),
+        steps=MappingProxyType({k: tuple(v) for k, v in steps.items()}),
+        requires=MappingProxyType({k: tuple(v) for k, v in requires.items()}),
+        goals=MappingProxyType(goals),
+        goals_by_category=MappingProxyType({k: tuple(v) for k, v in goals_by_category.items()}),
+    )
+
+
+def canonical_goals(goal_keys):
+    """目標のリストを、キャッシュのキーに使える形 (重複なし・ソート済みのタプル) にする"""
+    return tuple(sorted({key.strip() for key in goal_keys if key and key.strip()}))
+
+
+def _order_phases(book, targets):
+    """
+    目標のフェーズと、その前提のフェーズを全部集めて、やる順に並べる。
+    戻り値: [(phase_id, 必要としてるフェーズIDのリスト), ...]。依存関係が循環してたら graphlib.CycleError
+    """
+    needed = {}
+    stack = list(targets)
+    while stack:
+        phase_id = stack.pop()
+        if phase_id in needed or phase_id not in book.phases:
+            continue
+        needed[phase_id] = [r for r in book.requires.get(phase_id, ()) if r in book.phases]
+        stack.extend(needed[phase_id])
+
+    required_by = {phase_id: [] for phase_id in needed}
+    for phase_id, requirements in needed.items():
+        for requirement in requirements:
+            required_by[requirement].append(phase_id)
+
+    # 今やれるフェーズの中から、sort_order が小さいものを先に
+    sorter = graphlib.TopologicalSorter(needed)
+    sorter.prepare()
+    rank = lambda phase_id: (book.phases[phase_id].sort_order or 0, phase_id)
+    ready = [rank(phase_id) for phase_id in sorter.get_ready()]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        _, phase_id = heapq.heappop(ready)
+        ordered.append((phase_id, required_by[phase_id]))
+        sorter.done(phase_id)
+        for next_id in sorter.get_ready():
+            heapq.heappush(ready, rank(next_id))
+    return ordered
+
+
+def render_plan(phases, total_budget_min_yen):
+    """プランを、チャットにそのまま出せるMarkdownにする"""
+    if not phases:
+        return NO_GOALS_REPLY
+    lines = ["よっしゃ、経験に基づいた「イージーライフ」実現への最短ルートWBSだ！😎", ""]
+    number = 0
+    for index, phase in enumerate(phases, 1):
+        budget = f" (予算目安: {phase.budget_note})" if phase.budget_note else ""
+        lines.append(f"**フェーズ{index}: {phase.phase_title}{budget}**")
+        if phase.required_by:
+            lines.append(f"   * ※「{'」「'.join(phase.required_by)}」には、先にこれが必要だぜ！")
+        for step in phase.steps:
+            if step.step_type == 'NOTE':
+                lines.append(f"   * {step.step_text}")
+            else:
+                number += 1
+                lines.append(f"{number}. {step.step_text}")
+        lines.append("")
+    lines.append(f"**---\nこれで大体OKだ！選んだフェーズ全部やっても、総額目安は【約{total_budget_min_yen}円〜】くらいかな。"
+                 "これなら具体的なイメージ湧くだろ？👍**")
+    return "\n".join(lines)
+
+
+@tracing.traced("plan.build")
+def make_plan(book, category_id, goals):
+    """マスタと正規化した目標から、プランを組み立てる (キャッシュしない版)"""
+    known = tuple(key for key in goals
+                  if key in book.goals and book.goals[key].category_id == category_id)
+    unknown = tuple(key for key in goals if key not in known)
+    phases = []
+    for phase_id, required_by in _order_phases(book, [book.goals[key].phase_id for key in known]):
+        row = book.phases[phase_id]
+        direct = any(book.goals[key].phase_id == phase_id for key in known)
+        phases.append(PlanPhase(
+            phase_id=phase_id,
+            phase_title=row.phase_title,
+            budget_note=row.budget_note,
+            budget_min_yen=row.budget_min_yen,
+            steps=book.steps.get(phase_id, ()),
+            required_by=() if direct else tuple(book.phases[p].phase_title for p in required_by),
+        ))
+    total = sum(phase.budget_min_yen for phase in phases)
+    return Plan(category_id, known, unknown, tuple(phases), total, render_plan(phases, total))
+
+
+# --- プロセスで持っておくマスタとプラン (ビルドバージョンが変わったら全部捨てる) ---
+_book = None
+_plans = OrderedDict() # (category_id, 正規化した目標) → Plan
+_lock = threading.Lock()
+_stats = {'hits': 0, 'builds': 0, 'evictions': 0}
+
+def get_book():
+    """今のビルドのプランのマスタ (ビルドが変わったときだけ読み直す)"""
+    global _book
+    build_version = db_utils.get_build_version()
+    with _lock:
+        if _book is None or _book.build_version != build_version:
+            _book = load_book()
+            _plans.clear()
+        return _book
+
+
+def build_plan(category_id, goal_keys):
+    """目標からプランを作る。同じカテゴリ・同じ目標の組み合わせなら、キャッシュを返すだけ"""
+    goals = canonical_goals(goal_keys)
+    key = (category_id, goals)
+    book = get_book()
+    with _lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            _stats['hits'] += 1
+            return plan
+    plan = make_plan(book, category_id, goals)
+    with _lock:
+        _stats['builds'] += 1
+        if _book is book: # 作ってる間にビルドが変わってたら、古いプランは覚えない
+            _plans[key] = plan
+            while len(_plans) > MAX_PLANS:
+                _plans.popitem(last=False)
+                _stats['evictions'] += 1
+    return plan
+
+
+def stats():
+    """プランキャッシュの効き具合"""
+    with _lock:
+        result = dict(_stats)
+        result['plans'] = len(_plans)
+    return result
@@ -0,0 +1,96 @@
+# prompt_builder.py (Ver 1.0 - Context-Budgeted RAG Prompt Builder)
+# RAGの裏プロンプトを、トークン予算の中に収めて組み立てる。
+# - 事実は「失敗(FAILURE)・ネガティブな経験」から先に並べる (人格プロンプトの「おれもハマったわ〜」を優先)
+# - 予算からはみ出す事実は落とす
+# - 同じセッションで前に送った事実は、もう一回は送らない
+import os
+import threading
+from collections import deque, namedtuple
+
+from chat_memory import RAG_MARKER, estimate_tokens
+
+# 裏プロンプト1回分のトークン予算 (見出し・結論タイトル込み)
+RAG_BUDGET_TOKENS = int(os.getenv("PROTOS_RAG_BUDGET_TOKENS", "600"))
+
+# 事実の優先度 (小さいほど先)。知らない種類は最後
+FACT_TYPE_PRIORITY = {'FAILURE': 0, 'WHY': 1, 'STEP': 2, 'PRO_TIP': 3}
+
+# 組み立てた裏プロンプト (facts は実際に入れた事実の文面。送れたら ConversationMemory.sent_facts に足す)
+BuiltPrompt = namedtuple('BuiltPrompt', ['text', 'facts', 'stats'])
+
+
+def fact_rank(detail):
+    """並べ替えのキー: ネガティブな経験 → 事実の種類の優先度"""
+    return (detail.experience_flag != 'NEGATIVE', FACT_TYPE_PRIORITY.get(detail.fact_type, len(FACT_TYPE_PRIORITY)))
+
+
+def _header(situation, ai_name, success_title):
+    return (f"{RAG_MARKER}{situation}以下の箇条書きナレッジを使って、{ai_name}の経験として自然な会話でアドバイスしてね\n\n"
+            f"結論タイトル: {success_title}\n")
+
+
+def _fact_line(detail):
+    return f"- ({detail.fact_type}: {detail.experience_flag}) {detail.fact_text}\n"
+
+
+def build_knowledge_prompt(situation, details, ai_name, budget=RAG_BUDGET_TOKENS, sent_facts=None):
+    """
+    RAGの裏プロンプトを組み立てる (details は knowledge_catalog.KnowledgeDetail のタプル)。
+    sent_facts (このセッションで送った事実の文面) にある事実は入れない。
+    ただし全部送り済みなら、同じ質問をもう一回聞かれたということなので、もう一回全部から選ぶ
+    """
+    header = _header(situation, ai_name, details[0].success_title)
+    lines = [_fact_line(detail) for detail in details]
+    tokens_full = estimate_tokens(header + "".join(lines)) # 予算も重複除去も無しのときの大きさ
+
+    ranked = sorted(range(len(details)), key=lambda i: fact_rank(details[i])) # sorted は安定なので、同順位はCSVの順
+    fresh = [i for i in ranked if not sent_facts or details[i].fact_text not in sent_facts]
+    candidates = fresh or ranked
+
+    used = estimate_tokens(header)
+    chosen = []
+    for i in candidates:
+        cost = estimate_tokens(lines[i])
+        if used + cost > budget and chosen:
+            continue # 入らないものは飛ばして、もっと短い事実を探す (最低1つは入れる)
+        chosen.append(i)
+        used += cost
+
+    text = header + "".join(lines[i] for i in chosen)
+    tokens_sent = estimate_tokens(text)
+    stats = {
+        'facts_total': len(details),
+        'facts_sent': len(chosen),
+        'facts_deduped': len(ranked) - len(candidates),
+        'facts_dropped': len(candidates) - len(chosen),
+        'tokens_full': tokens_full,
+        'tokens_sent': tokens_sent,
+        'tokens_saved': tokens_full - tokens_sent,
+    }
+    _record(stats)
+    if stats['tokens_saved'] > 0:
+        print(f"RAGプロンプト: {tokens_sent}トークン ({stats['tokens_saved']}トークン節約、"
+              f"送り済み{stats['facts_deduped']}件・予算オーバー{stats['facts_dropped']}件を省いた)")
+    return BuiltPrompt(text, tuple(details[i].fact_text for i in chosen), stats)
+
+
+# --- プロセス全体の集計 (どれだけ削れてるか) ---
+_totals = {'requests': 0, 'facts_sent': 0, 'facts_deduped': 0, 'facts_dropped': 0,
+           'tokens_full': 0, 'tokens_sent': 0, 'tokens_saved': 0}
+_recent = deque(maxlen=50) # 直近のリクエストごとの内訳
+_lock = threading.Lock()
+
+def _record(stats):
+    with _lock:
+        _totals['requests'] += 1
+        for key in ('facts_sent', 'facts_deduped', 'facts_dropped', 'tokens_full', 'tokens_sent', 'tokens_saved'):
+            _totals[key] += stats[key]
+        _recent.append(stats)
+
+
+def stats():
+    """これまでに組み立てた裏プロンプトの合計と、直近の内訳"""
+    with _lock:
+        result = dict(_totals)
+        result['recent'] = list(_recent)
+    return result
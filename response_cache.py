@@ -0,0 +1,229 @@
+# response_cache.py (Ver 1.1 - Preset Answer Cache with LRU + TTL)
+import hashlib
+import os
+import random
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import db_pool
+
+# PROTOS_RESPONSE_CACHE_DB にパスを入れると、ワーカー間で共有するディスクキャッシュも使う
+CACHE_DB_ENV = "PROTOS_RESPONSE_CACHE_DB"
+
+
+def normalize_prompt(prompt):
+    """全角/半角・空白の揺れを吸収してからキーにする"""
+    return " ".join(unicodedata.normalize('NFKC', prompt).split())
+
+
+def make_key(prompt, persona_id, system_prompt, knowledge_version):
+    """キャッシュキー = 正規化したプロンプト + 人格 + システムプロンプト + ナレッジのバージョン"""
+    system_hash = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    raw = "\x1f".join([normalize_prompt(prompt), persona_id, system_hash, knowledge_version])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SqliteCacheBackend:
+    """ワーカー間で共有するディスクキャッシュ (SQLite 1ファイル)"""
+
+    def __init__(self, db_path):
+        self._pool = db_pool.ConnectionPool(db_path)
+        with self._pool.writer() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS C_Responses (
+                cache_key TEXT NOT NULL, variant INTEGER NOT NULL,
+                response_text TEXT NOT NULL, created_at REAL NOT NULL,
+                PRIMARY KEY (cache_key, variant)
+            )""")
+            # 期限切れの掃除: WHERE created_at < ?
+            conn.execute("CREATE INDEX IF NOT EXISTS IX_Responses_Created ON C_Responses (created_at)")
+
+    def load(self, key):
+        """(返答のリスト, 作成時刻) を返す。無ければ None"""
+        with self._pool.reader() as conn:
+            rows = conn.execute(
+                "SELECT response_text, created_at FROM C_Responses WHERE cache_key = ? ORDER BY variant",
+                (key,)).fetchall()
+        if not rows:
+            return None
+        return [row['response_text'] for row in rows], min(row['created_at'] for row in rows)
+
+    def add(self, key, variant, text, created_at):
+        with self._pool.writer() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO C_Responses (cache_key, variant, response_text, created_at) VALUES (?, ?, ?, ?)",
+                (key, variant, text, created_at))
+
+    def delete(self, key):
+        with self._pool.writer() as conn:
+            conn.execute("DELETE FROM C_Responses WHERE cache_key = ?", (key,))
+
+    def purge_expired(self, oldest):
+        with self._pool.writer() as conn:
+            conn.execute("DELETE FROM C_Responses WHERE created_at < ?", (oldest,))
+
+
+class _Entry:
+    __slots__ = ('texts', 'created_at', 'fill_attempts')
+
+    def __init__(self, texts, created_at):
+        self.texts = texts
+        self.created_at = created_at
+        self.fill_attempts = 0 # バリエーションを足そうとした回数 (上限まで来たら、もう足さない)
+
+
+class ResponseCache:
+    """
+    プリセット質問の返答キャッシュ。
+    - メモリ上はLRU (max_entries件まで) + TTL (ttl秒で期限切れ)
+    - 1つのキーに最大 variants 個の違う返答をためて、ランダムに返す (毎回同じ返答だと味気ないので)
+      1つでも入ってればヒット。残りのバリエーションは、空いてる時間に (answer_warmer が) 足していく。
+      足すのは max_fill_attempts 回まで。同じ文面が返ってきたら、そのモデルは毎回同じことを言うので、そこでやめる
+    - backend を渡すと、ディスク(SQLite)にも書いてワーカー間で共有する
+    """
+
+    def __init__(self, max_entries=1024, ttl=24 * 3600, variants=3, backend=None, max_fill_attempts=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = variants
+        self.max_fill_attempts = max_fill_attempts if max_fill_attempts is not None else variants * 2
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'fills': 0, 'duplicates': 0, 'expired': 0, 'evictions': 0,
+                          'disk_loads': 0}
+
+    def _count(self, name):
+        self._counters[name] += 1
+
+    def _evict_locked(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._count('evictions')
+
+    def _entry_for(self, key, now):
+        """
+        メモリ → ディスクの順に探す (_lock を持たずに呼ぶ)。
+        ロックはメモリのLRUを触る間だけ持つ。ディスクの読み書きはロックの外でやる
+        (ディスクを待ってる間も、ほかのセッションのメモリのヒットは止めない)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            expired = entry is not None and now - entry.created_at > self.ttl
+            if expired:
+                del self._entries[key]
+                self._count('expired')
+            elif entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if self.backend is None:
+            return None
+        if expired:
+            self.backend.delete(key)
+            return None
+        # 他のワーカーが入れてるかもしれないので、メモリに無ければディスクも見る
+        loaded = self.backend.load(key)
+        if loaded is None:
+            return None
+        if now - loaded[1] > self.ttl:
+            self.backend.delete(key)
+            with self._lock:
+                self._count('expired')
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: # ディスクを読んでる間に、ほかのスレッドが入れてなければ
+                entry = self._entries[key] = _Entry(*loaded)
+                self._count('disk_loads')
+                self._evict_locked()
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key):
+        """
+        キャッシュ済みの返答を返す (バリエーションが1つでもあればヒット)。無ければ None
+        (None のときは呼び出し側がLLMで作って put する)
+        """
+        entry = self._entry_for(key, time.time())
+        with self._lock:
+            if entry is None or not entry.texts:
+                self._count('misses')
+                return None
+            self._count('hits')
+            return random.choice(entry.texts)
+
+    def missing_variants(self, key):
+        """
+        あと何個バリエーションを作るといいか (ヒット/ミスには数えない。先回りで温める用)。
+        足そうとした回数が上限に来た or 同じ文面しか返ってこないキーは 0
+        """
+        entry = self._entry_for(key, time.time())
+        with self._lock:
+            if entry is None:
+                return self.variants
+            if entry.fill_attempts >= self.max_fill_attempts:
+                return 0
+            return max(self.variants - len(entry.texts), 0)
+
+    def put(self, key, text):
+        """返答を1つ追加する (同じ文面は重複させない)"""
+        if not text:
+            return
+        now = time.time()
+        entry = self._entry_for(key, now)
+        with self._lock:
+            if entry is None:
+                entry = self._entries.setdefault(key, _Entry([], now))
+            if entry.texts:
+                entry.fill_attempts += 1
+            if text in entry.texts:
+                entry.fill_attempts = self.max_fill_attempts # 同じことしか言わないモデル: もう足さない
+                self._count('duplicates')
+                return
+            if len(entry.texts) >= self.variants:
+                return
+            entry.texts.append(text)
+            variant, created_at = len(entry.texts) - 1, entry.created_at
+            self._count('fills')
+            self._evict_locked()
+        if self.backend is not None:
+            self.backend.add(key, variant, text, created_at)
+
+    def purge_expired(self):
+        """期限切れをまとめて捨てる (起動したときと、answer_warmer の見回りごとに呼ぶ)"""
+        oldest = time.time() - self.ttl
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.created_at < oldest]:
+                del self._entries[key]
+                self._count('expired')
+        if self.backend is not None:
+            self.backend.purge_expired(oldest)
+
+    def stats(self):
+        """ヒット率などのカウンター"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# --- プロセスで1つだけ持っておく ---
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """プロセス共通の返答キャッシュ (環境変数があればディスク共有つき)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                db_path = os.getenv(CACHE_DB_ENV)
+                _cache = ResponseCache(backend=SqliteCacheBackend(db_path) if db_path else None)
+                if db_path:
+                    _cache.purge_expired() # 前に動いてたワーカーが残した期限切れを捨てる (あとは answer_warmer が定期的に)
+    return _cache
@@ -0,0 +1,275 @@
+# session_registry.py (Ver 1.0 - Compact, Memory-Capped Session State)
+# 1ワーカーに何千人もつながっても、メモリが会話の長さ × 人数で膨らまないようにする。
+# - 表示用のメッセージは __slots__ の Message (role は intern した文字列を共有)
+# - 長い本文は1回だけ持つ (表示用のメッセージと Gemini 用の Turn で同じ str を指す)
+# - ワーカー全体の上限 (PROTOS_SESSION_MEMORY_MB) を超えたら、しばらく使ってないセッションの会話を
+#   メモリから捨てる (会話は chat_store に保存してあるので、次に開いたときに読み直す)
+import os
+import sys
+import threading
+import time
+import weakref
+
+import chat_memory
+
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+MEMORY_LIMIT_BYTES = int(float(os.getenv("PROTOS_SESSION_MEMORY_MB", "256")) * 1024 * 1024) # ワーカー全体の上限
+IDLE_SECONDS = float(os.getenv("PROTOS_SESSION_IDLE", "300")) # これだけ触られてないセッションを追い出せる
+MAX_DISPLAY_MESSAGES = 50 # 画面に持っておくメッセージ数 (もっと前は「前の会話を読み込む」で読む)
+
+
+class Message:
+    """画面に出すメッセージ1件 (dict よりずっと小さい)"""
+    __slots__ = ('role', 'content', 'seq')
+
+    def __init__(self, role, content, seq=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.seq = seq
+
+
+def _text_bytes(text, seen):
+    """文字列のサイズ (同じ str を何回指していても1回だけ数える)"""
+    if not text or id(text) in seen:
+        return 0
+    seen.add(id(text))
+    return sys.getsizeof(text)
+
+
+class SessionState:
+    """
+    1ブラウザセッション分の会話 (表示用のメッセージ + Geminiに送る履歴 + 保存先)。st.session_state に1つ持つ。
+    追い出されたら (evicted) 中身は空になってるので、rerun の最初に ensure_loaded() で読み直す
+    """
+    __slots__ = ('session_id', 'user_id', 'chat_session', 'memory', 'greeting', 'messages', 'evicted',
+                 'last_active', '_size', '_lock', '_registry', '__weakref__')
+
+    def __init__(self, session_id, user_id, chat_session=None, memory=None, greeting=None, registry=None):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.chat_session = chat_session # chat_store.ChatSession (保存できないときは None。そのときは追い出さない)
+        self.memory = memory or chat_memory.ConversationMemory()
+        self.greeting = greeting # 保存した会話が無いときに出す最初の挨拶
+        self.messages = []
+        self.evicted = False
+        self.last_active = time.monotonic()
+        self._size = [0] # だいたいのバイト数 (消えたときに registry が引けるように、箱に入れておく)
+        self._lock = threading.RLock()
+        self._registry = registry
+
+    @property
+    def bytes(self):
+        return self._size[0]
+
+    # --- 読み込み ---
+    def load(self):
+        """保存してある直近の1ページと、Geminiの履歴 (要約 + 直近のターン) を読む"""
+        with self._lock:
+            self.messages = []
+            if self.chat_session is not None:
+                stored = self.chat_session.load_recent()
+                if stored:
+                    self.chat_session.restore_memory(self.memory)
+                    self.messages = self._share_with_memory([Message(m.role, m.content, m.seq) for m in stored])
+            if not self.messages and self.greeting:
+                self.messages = [Message(ASSISTANT, self.greeting)]
+            self.evicted = False
+            self._measure()
+        return self
+
+    def ensure_loaded(self):
+        """rerun の最初に呼ぶ: 使った印をつけて、追い出されてたら読み直す"""
+        with self._lock:
+            self.last_active = time.monotonic()
+            if self.evicted:
+                self.load()
+                if self._registry is not None:
+                    self._registry._count('reloads')
+
+    def load_older(self):
+        """いちばん古いメッセージより前を1ページ分、先頭に足す (足した数を返す)"""
+        with self._lock:
+            oldest_seq = self.messages[0].seq if self.messages else None
+            if self.chat_session is None or not oldest_seq:
+                return 0
+            older = [Message(m.role, m.content, m.seq) for m in self.chat_session.load_before(oldest_seq)]
+            self.messages[:0] = older
+            self._measure()
+            return len(older)
+
+    def can_load_older(self):
+        return self.chat_session is not None and bool(self.messages) and bool(self.messages[0].seq)
+
+    def _share_with_memory(self, messages):
+        """読み直したメッセージの本文を、Geminiの履歴 (Turn) と同じ str にそろえる"""
+        turns = {turn.seq: turn for turn in self.memory.turns if turn.seq is not None}
+        for message in messages:
+            turn = turns.get(message.seq)
+            if turn is not None and message.role == ASSISTANT and turn.model_text == message.content:
+                message.content = turn.model_text
+        return messages
+
+    # --- 書き込み ---
+    def record_exchange(self, user_content, reply_text, turn=None):
+        """ユーザーの発言とAIの返答を、画面と保存先に足す (本文は turn と同じ str を使う)"""
+        with self._lock:
+            if turn is not None:
+                reply_text = turn.model_text if turn.model_text == reply_text else reply_text
+                user_content = turn.user_text if turn.user_text == user_content else user_content
+            user_seq = reply_seq = None
+            if self.chat_session is not None:
+                user_seq, reply_seq = self.chat_session.record_exchange(
+                    user_content, reply_text, turn=turn, memory=self.memory)
+            self.messages.append(Message(USER, user_content, user_seq))
+            self.messages.append(Message(ASSISTANT, reply_text, reply_seq))
+            del self.messages[:-MAX_DISPLAY_MESSAGES]
+            self.last_active = time.monotonic()
+            self._measure()
+        if self._registry is not None:
+            self._registry.enforce()
+
+    # --- メモリ ---
+    def _measure(self):
+        """このセッションが持ってる会話のだいたいのバイト数 (_lock を持った状態で呼ぶ)"""
+        seen = set()
+        size = sys.getsizeof(self.messages)
+        for message in self.messages:
+            size += sys.getsizeof(message) + _text_bytes(message.content, seen)
+        memory = self.memory
+        size += sys.getsizeof(memory.turns) + _text_bytes(memory.summary, seen)
+        for turn in memory.turns:
+            size += sys.getsizeof(turn) + _text_bytes(turn.user_text, seen) + _text_bytes(turn.model_text, seen)
+        size += sys.getsizeof(memory.sent_facts) # 事実の文面はカタログと共有なので、入れ物の分だけ
+        size += sys.getsizeof(memory.prompt_log) + sum(sys.getsizeof(entry) for entry in memory.prompt_log)
+        delta = size - self._size[0]
+        self._size[0] = size
+        if self._registry is not None:
+            self._registry._resize(delta)
+        return size
+
+    def evict(self):
+        """
+        会話をメモリから捨てる (保存先があるときだけ)。次の ensure_loaded() で読み直す。
+        使ってる最中 (ロックが取れない) なら何もしない。捨てたバイト数を返す
+        """
+        if self.chat_session is None or self.evicted or not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            freed = self.bytes
+            self.messages = []
+            memory = self.memory
+            memory.turns.clear()
+            memory.summary = ""
+            memory.summary_upto = None
+            memory.sent_facts.clear() # 読み直したあとは、同じ事実をもう一回送ることがある (そのくらいはいい)
+            memory.prompt_log.clear()
+            self.evicted = True
+            self._measure()
+            return freed - self.bytes
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'session_id': self.session_id,
+            'messages': len(self.messages),
+            'turns': len(self.memory.turns),
+            'bytes': self.bytes,
+            'idle_s': round(time.monotonic() - self.last_active, 1),
+            'evicted': self.evicted,
+        }
+
+
+class SessionRegistry:
+    """
+    ワーカーの中の SessionState を見張って、合計が limit_bytes を超えたら
+    idle 秒以上使われてないセッションから (古い順に) 追い出す。
+    セッションは弱参照で持つ (ブラウザが閉じて st.session_state が消えたら、ここからも消える)。
+    合計は増えた分・減った分だけ足し引きしておくので、上限を超えてないかの確認はすぐ終わる
+    """
+
+    def __init__(self, limit_bytes=MEMORY_LIMIT_BYTES, idle=IDLE_SECONDS):
+        self.limit_bytes = limit_bytes
+        self.idle = idle
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._total = 0
+        self._stats = {'opened': 0, 'evictions': 0, 'evicted_bytes': 0, 'reloads': 0, 'over_limit': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _resize(self, delta):
+        with self._lock:
+            self._total += delta
+
+    def _forget(self, size):
+        """セッションがGCされた: そのぶんを合計から引く"""
+        self._resize(-size[0])
+
+    def open(self, session_id, user_id, chat_session=None, memory=None, greeting=None):
+        """セッションを作って見張りに入れる (保存してある会話があれば読む)"""
+        state = SessionState(session_id, user_id, chat_session, memory, greeting, registry=self).load()
+        weakref.finalize(state, self._forget, state._size)
+        with self._lock:
+            self._sessions.add(state)
+            self._stats['opened'] += 1
+        self.enforce()
+        return state
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions)
+
+    def total_bytes(self):
+        with self._lock:
+            return self._total
+
+    def enforce(self):
+        """上限を超えてたら、使ってないセッションを古い順に追い出す (追い出した数を返す)"""
+        if self.total_bytes() <= self.limit_bytes:
+            return 0
+        self._count('over_limit')
+        now = time.monotonic()
+        idle = sorted((state for state in self.sessions()
+                       if not state.evicted and now - state.last_active >= self.idle),
+                      key=lambda state: state.last_active)
+        evicted = 0
+        for state in idle:
+            if self.total_bytes() <= self.limit_bytes:
+                break
+            freed = state.evict()
+            if freed:
+                evicted += 1
+                self._count('evictions')
+                self._count('evicted_bytes', freed)
+        return evicted
+
+    def stats(self, top=10):
+        """ワーカー全体の合計と、大きいセッション top 件の内訳"""
+        sessions = self.sessions()
+        with self._lock:
+            result = dict(self._stats)
+        result['sessions'] = len(sessions)
+        result['resident'] = sum(1 for state in sessions if not state.evicted)
+        result['total_bytes'] = self.total_bytes()
+        result['limit_bytes'] = self.limit_bytes
+        result['largest'] = [state.stats() for state in sorted(sessions, key=lambda state: -state.bytes)[:top]]
+        return result
+
+
+# --- プロセスで1つだけ持っておく ---
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """プロセス共通のセッション見張り役"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SessionRegistry()
+    return _registry
@@ -0,0 +1,12 @@
+# tests/conftest.py - テスト共通: リポジトリのDBを触らないように、db_utils を import する前に一時DBへ向ける
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+_tmp_dir = tempfile.TemporaryDirectory(prefix="protos_test_")
+os.environ.setdefault('PROTOS_DB_PATH', os.path.join(_tmp_dir.name, 'test.db'))
+os.environ.setdefault('PROTOS_WARM', '0')
@@ -0,0 +1,101 @@
+# tests/test_answer_warmer.py - ウォーマーをローカルのスタブモデル (llm_gateway.StubBackend) で回す
+import itertools
+from collections import namedtuple
+
+import pytest
+
+import answer_warmer
+import chat_service
+import knowledge_catalog
+import llm_gateway
+import response_cache
+
+# persona_registry.Persona と同じ属性 (モデルは作らない)
+StubPersona = namedtuple('StubPersona', ['user_id', 'creator_id', 'user_name', 'ai_name', 'system_prompt', 'backend'])
+
+
+def _setup(reply_fn, variants=3):
+    catalog = knowledge_catalog.get_catalog()
+    backend = llm_gateway.StubBackend(reply_fn=reply_fn)
+    persona = StubPersona("test_user", catalog.creator_id, "テスト", "Ken", "テスト用の人格", backend)
+    gateway = llm_gateway.LLMGateway(max_concurrency=4, rate_per_sec=1000, burst=1000)
+    cache = response_cache.ResponseCache(variants=variants)
+    warmer = answer_warmer.AnswerWarmer(gateway, cache, workers=1, min_clicks=1)
+    question, knowledge_id = next((q.preset_question, q.knowledge_id)
+                                  for questions in catalog.questions_by_category.values() for q in questions
+                                  if catalog.knowledge_details(q.knowledge_id))
+    request = chat_service.preset_request(catalog, persona, question, knowledge_id)
+    return warmer, cache, backend, persona, knowledge_id, request
+
+
+@pytest.fixture
+def repeating():
+    """毎回同じ返答をするモデル"""
+    warmer, *rest = _setup(lambda prompt: "いつも同じ返答")
+    yield (warmer, *rest)
+    warmer.close()
+
+
+@pytest.fixture
+def varied():
+    """呼ぶたびに違う返答をするモデル"""
+    counter = itertools.count()
+    warmer, *rest = _setup(lambda prompt: f"返答その{next(counter)}")
+    yield (warmer, *rest)
+    warmer.close()
+
+
+def test_repeating_model_warms_once_and_stops_calling(repeating):
+    warmer, cache, backend, persona, knowledge_id, request = repeating
+    warmer.record_click(persona, knowledge_id)
+
+    # 1つ目で温まって、2つ目が同じ文面だったらそのキーはもう足さない
+    assert warmer.run_once() == 2
+    assert backend.calls == 2
+    assert cache.get(request["cache_key"]) == "いつも同じ返答"
+    assert cache.stats()['hits'] == 1
+
+    # 何サイクル回しても、もうAIは呼ばない
+    for _ in range(3):
+        warmer.record_click(persona, knowledge_id)
+        assert warmer.run_once() == 0
+    assert backend.calls == 2
+    assert warmer.stats()['fresh'] == 3
+
+
+def test_varied_model_fills_up_to_variants(varied):
+    warmer, cache, backend, persona, knowledge_id, request = varied
+    warmer.record_click(persona, knowledge_id)
+
+    assert warmer.run_once() == 3
+    assert backend.calls == 3
+    assert cache.missing_variants(request["cache_key"]) == 0
+
+    warmer.record_click(persona, knowledge_id)
+    assert warmer.run_once() == 0
+    assert backend.calls == 3
+
+
+def test_cold_keys_are_not_warmed(repeating):
+    warmer, cache, backend, persona, knowledge_id, request = repeating
+    warmer.min_clicks = 2
+    warmer.record_click(persona, knowledge_id)
+
+    assert warmer.run_once() == 0
+    assert backend.calls == 0
+    assert cache.get(request["cache_key"]) is None
+
+
+def test_clicks_are_forgotten_after_decay(repeating):
+    warmer, cache, backend, persona, knowledge_id, request = repeating
+    warmer.min_clicks = 2
+    warmer.record_click(persona, knowledge_id)
+    assert warmer.stats()['tracked'] == 1 and warmer.stats()['personas'] == 1
+
+    # 1 → 0.5 → 0.25 → 0.125 → 0.0625 (CLICK_FLOOR 未満) で、人格ごと忘れる
+    for _ in range(3):
+        warmer.decay()
+    assert warmer.stats()['tracked'] == 1
+    warmer.decay()
+    assert warmer.stats()['tracked'] == 0 and warmer.stats()['personas'] == 0
+    assert warmer.hot_keys() == []
@@ -0,0 +1,48 @@
+# tests/test_chat_store.py - 会話の保存: セッションの行と持ち主のチェック
+import uuid
+
+import pytest
+
+import chat_store
+import db_utils
+
+
+@pytest.fixture
+def store():
+    store = chat_store.ChatStore(flush_interval=0.01)
+    yield store
+    store.close()
+
+
+def _session_row(session_id):
+    with db_utils.read_connection() as conn:
+        return conn.execute("SELECT user_id, summary FROM T_Chat_Sessions WHERE session_id = ?",
+                            (session_id,)).fetchone()
+
+
+def test_short_session_gets_a_row(store):
+    # 要約まで進まない短い会話でも、最初のメッセージでセッションの行ができる
+    session_id = uuid.uuid4().hex
+    store.open_session(session_id, "alice").record_exchange("こんにちは", "よっ")
+    store.flush()
+    row = _session_row(session_id)
+    assert row is not None and row['user_id'] == "alice" and row['summary'] == ""
+    assert store.open_session(session_id, "alice").next_seq == 2
+
+
+def test_other_users_session_is_rejected(store):
+    session_id = uuid.uuid4().hex
+    store.open_session(session_id, "alice").record_exchange("こんにちは", "よっ")
+    with pytest.raises(chat_store.SessionOwnerError):
+        store.open_session(session_id, "mallory")
+
+
+def test_unowned_messages_are_rejected(store):
+    # 行が無いメッセージ (持ち主が分からない) は誰にも開かせない
+    session_id = uuid.uuid4().hex
+    with db_utils.write_connection() as conn:
+        conn.execute("INSERT INTO T_Chat_Messages (session_id, seq, role, content, created_at)"
+                     " VALUES (?, 0, 'user', 'x', 0)", (session_id,))
+    with pytest.raises(chat_store.SessionOwnerError):
+        store.open_session(session_id, "alice")
+    assert store.open_session(uuid.uuid4().hex, "alice").next_seq == 0
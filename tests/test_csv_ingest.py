@@ -0,0 +1,38 @@
+# tests/test_csv_ingest.py - CSVの取り込み: おかしな行だけ隔離して、残りは入れる
+import sqlite3
+
+import csv_ingest
+from csv_ingest import Column
+
+COLUMNS = [Column('item_id', csv_ingest.integer), Column('label', csv_ingest.text)]
+
+
+def _ingest(path):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE T_Items (item_id INTEGER PRIMARY KEY, label TEXT NOT NULL)")
+    rejects = []
+    result = csv_ingest.ingest(conn, str(path), 'T_Items', COLUMNS, rejects, chunk_size=2)
+    return conn, result, rejects
+
+
+def test_undecodable_byte_quarantines_only_its_row(tmp_path):
+    path = tmp_path / "items.csv"
+    path.write_bytes("item_id,label\n1,りんご\n2,ば".encode('utf-8') + b"\xff" + "なな\n3,みかん\n".encode('utf-8'))
+    conn, result, rejects = _ingest(path)
+
+    assert (result.loaded, result.rejected, result.skipped) == (2, 1, False)
+    assert [row[0] for row in conn.execute("SELECT item_id FROM T_Items ORDER BY item_id")] == [1, 3]
+    assert rejects[0].line == 3 and "UTF-8" in rejects[0].reason
+    assert rejects[0].raw == "2,ば\\xffなな"
+
+    # レポートにもそのまま書ける (読めないバイトは \xff で書く)
+    report = tmp_path / "quarantine.csv"
+    csv_ingest.write_report(str(report), rejects)
+    assert "\\xff" in report.read_text(encoding='utf-8')
+
+
+def test_clean_file_loads_everything(tmp_path):
+    path = tmp_path / "items.csv"
+    path.write_text("item_id,label\n1,りんご\n2,ばなな\n3,みかん\n", encoding='utf-8')
+    _, result, rejects = _ingest(path)
+    assert (result.loaded, result.rejected) == (3, 0) and rejects == []
@@ -0,0 +1,45 @@
+# tests/test_goals.py - 目標のキー (knowledge_id) と進み具合のカウンター
+import sqlite3
+
+import db_migrations
+import db_utils
+
+
+def _migrate_to(conn, version):
+    for migration_version, _, statements in db_migrations.MIGRATIONS:
+        if migration_version <= version:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {migration_version}")
+
+
+def test_migration_rekeys_goals_by_knowledge_id():
+    # v8 までは質問の文面がキー。v9 で knowledge_id に付け替えて、文面がもう無い目標は消す
+    conn = sqlite3.connect(":memory:")
+    _migrate_to(conn, 8)
+    conn.executemany("INSERT INTO M_Knowledge_Base (knowledge_id, category_id, preset_question) VALUES (?, ?, ?)",
+                     [(1, 'home', "何から買う？"), (2, 'home', "予算は？")])
+    conn.executemany("INSERT INTO T_User_Goals (user_id, category_id, goal_key, status) VALUES (?, ?, ?, ?)",
+                     [('u1', 'home', "何から買う？", 'completed'), ('u1', 'home', "予算は？", 'not_started'),
+                      ('u1', 'home', "もう無い質問", 'completed')])
+    assert db_migrations.migrate(conn) == [9]
+    goals = dict(conn.execute("SELECT goal_key, status FROM T_User_Goals WHERE user_id = 'u1'"))
+    assert goals == {'1': 'completed', '2': 'not_started'}
+    assert conn.execute("SELECT completed, total FROM T_User_Goal_Progress WHERE user_id = 'u1'").fetchone() == (1, 2)
+
+
+def test_goals_keep_status_across_reseed():
+    with db_utils.read_connection() as conn:
+        catalog_category, knowledge_id = conn.execute(
+            "SELECT category_id, knowledge_id FROM M_Knowledge_Base ORDER BY knowledge_id LIMIT 1").fetchone()
+    goals = db_utils.get_user_goals_by_category('goal_tester', catalog_category)
+    assert str(knowledge_id) in {goal['goal_key'] for goal in goals}
+    db_utils.update_user_goal_status('goal_tester', str(knowledge_id), 'completed')
+
+    # ナレッジのCSVが変わった扱いにして作り直しても、同じIDの目標はそのまま
+    assert db_utils._seed_user_goals('goal_tester', catalog_category, "changed")
+    goals = {goal['goal_key']: goal['status']
+             for goal in db_utils.get_user_goals_by_category('goal_tester', catalog_category)}
+    assert goals[str(knowledge_id)] == 'completed'
+    completed, total = db_utils.get_goal_progress('goal_tester')[catalog_category]
+    assert (completed, total) == (1, len(goals))
@@ -0,0 +1,53 @@
+# tests/test_llm_gateway.py - ゲートウェイ: ストリームの相乗りと、返ってこない呼び出しの置き去り
+import threading
+import time
+
+import pytest
+
+import llm_gateway
+
+
+@pytest.fixture
+def gateway():
+    return llm_gateway.LLMGateway(max_concurrency=1, rate_per_sec=1000, burst=1000, timeout=5.0, max_abandoned=2)
+
+
+def test_identical_streams_share_one_backend_call(gateway):
+    backend = llm_gateway.StubBackend(reply_fn=lambda prompt: "同じ返答を全員に配るよ", first_delay=0.2, chunk_size=4)
+    request = llm_gateway.LLMRequest(backend, "プリセットの質問")
+    texts = []
+
+    def consume():
+        texts.append("".join(gateway.stream(request)))
+
+    threads = [threading.Thread(target=consume) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05) # 1本目がバックエンドを呼んでる最中に、後の2本が来る
+    for thread in threads:
+        thread.join()
+
+    assert texts == ["同じ返答を全員に配るよ"] * 3
+    assert backend.calls == 1
+    assert gateway.stats()['coalesced'] == 2
+
+
+def test_hung_call_keeps_a_thread_free_for_live_calls(gateway):
+    hung = llm_gateway.StubBackend(first_delay=0.5, name='hung')
+    with pytest.raises(TimeoutError):
+        gateway.generate(llm_gateway.LLMRequest(hung, "固まる質問"), timeout=0.1)
+    assert gateway.stats()['hung'] == 1
+
+    # 置き去りのスレッドがあっても、普通の呼び出しは待たずに通る
+    quick = llm_gateway.StubBackend(name='quick')
+    assert gateway.generate(llm_gateway.LLMRequest(quick, "ふつうの質問"), timeout=0.3)
+
+    # 置き去りが上限まで来たら、新しい呼び出しはすぐ断る
+    with pytest.raises(TimeoutError):
+        gateway.generate(llm_gateway.LLMRequest(hung, "もう1つ固まる質問"), timeout=0.1)
+    assert gateway.stats()['hung'] == 2
+    with pytest.raises(llm_gateway.GatewayOverloaded):
+        gateway.generate(llm_gateway.LLMRequest(hung, "また固まる質問"), timeout=0.1)
+
+    time.sleep(0.7)
+    assert gateway.stats()['hung'] == 0
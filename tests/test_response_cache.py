@@ -0,0 +1,60 @@
+# tests/test_response_cache.py - 返答キャッシュ: ディスクを待ってる間もメモリのヒットは止めない、期限切れの掃除
+import threading
+import time
+
+import response_cache
+
+
+class SlowBackend:
+    """load が release されるまで返ってこないディスク (ロックの外で読んでるか確かめる用)"""
+
+    def __init__(self):
+        self.loading = threading.Event()
+        self.release = threading.Event()
+
+    def load(self, key):
+        self.loading.set()
+        self.release.wait(5)
+        return None
+
+    def add(self, key, variant, text, created_at):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+def test_memory_hit_does_not_wait_for_disk():
+    backend = SlowBackend()
+    cache = response_cache.ResponseCache(backend=backend)
+    cache._entries["hot"] = response_cache._Entry(["温まってる返答"], time.time())
+
+    cold = threading.Thread(target=cache.get, args=("cold",))
+    cold.start()
+    assert backend.loading.wait(5) # 別のスレッドがディスクを読んでる最中
+
+    start = time.perf_counter()
+    assert cache.get("hot") == "温まってる返答"
+    assert time.perf_counter() - start < 1.0
+    backend.release.set()
+    cold.join()
+    assert cache.stats()['misses'] == 1
+
+
+def test_purge_expired_cleans_the_disk(tmp_path):
+    backend = response_cache.SqliteCacheBackend(str(tmp_path / "cache.db"))
+    cache = response_cache.ResponseCache(ttl=0.1, backend=backend)
+    cache.put("old", "昔の返答")
+    backend.add("older", 0, "別のワーカーが入れた昔の返答", time.time() - 120)
+    time.sleep(0.2)
+
+    cache.purge_expired()
+    assert cache.stats()['entries'] == 0
+    assert backend.load("old") is None and backend.load("older") is None
+
+    # 別のワーカー (別のキャッシュ) が入れたものは、ディスクから読める
+    cache.ttl = 60
+    cache.put("fresh", "新しい返答")
+    other = response_cache.ResponseCache(ttl=60, backend=backend)
+    assert other.get("fresh") == "新しい返答"
+    assert other.stats()['disk_loads'] == 1
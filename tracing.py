@@ -0,0 +1,231 @@
+# tracing.py (Ver 1.0 - Lightweight Spans & Latency Histograms)
+# PROTOS_TRACE=1 で有効。無効のときは span/traced がほぼ何もしない (フラグを1回見るだけ)
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# ヒストグラムのバケット (ミリ秒)。最後は +Inf
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+RECENT_SPANS = 200 # デバッグパネル用に覚えておく直近のスパン数
+
+
+class Histogram:
+    """固定バケットのレイテンシヒストグラム (Prometheusのhistogramと同じ形)"""
+    __slots__ = ('counts', 'count', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        index = 0
+        while index < len(BUCKETS_MS) and ms > BUCKETS_MS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q):
+        """バケットから分位点をざっくり推定する (バケットの上限値を返す)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(BUCKETS_MS[index], self.max_ms) if index < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+
+class _State:
+    def __init__(self):
+        self.enabled = os.getenv("PROTOS_TRACE") == "1"
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.recent = deque(maxlen=RECENT_SPANS)
+        self.local = threading.local()
+        self.server = None
+
+
+_state = _State()
+
+
+def enable():
+    _state.enabled = True
+
+
+def disable():
+    _state.enabled = False
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def observe(name, seconds, parent=None):
+    """計測済みの時間をヒストグラムに足す (ttftみたいに外で測ったもの用)"""
+    if not _state.enabled:
+        return
+    ms = seconds * 1000
+    with _state.lock:
+        histogram = _state.histograms.get(name)
+        if histogram is None:
+            histogram = _state.histograms[name] = Histogram()
+        histogram.observe(ms)
+        _state.recent.append((time.time(), name, parent, ms))
+
+
+class _Span:
+    """有効なときのスパン。入れ子にすると親の名前も記録する"""
+    __slots__ = ('name', 'start', 'parent')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_state.local, 'stack', None)
+        if stack is None:
+            stack = _state.local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _state.local.stack.pop()
+        observe(self.name if exc_type is None else f"{self.name}.error", elapsed, self.parent)
+        return False
+
+
+class _NoopSpan:
+    """無効なときのスパン (使い回しの1個だけ)"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name):
+    """with tracing.span("db.build"): ... で区間の時間を測る"""
+    return _Span(name) if _state.enabled else _NOOP
+
+
+def traced(name=None):
+    """関数まるごと測るデコレーター (@tracing.traced("db.get_categories"))"""
+    def decorator(fn):
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with _Span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- 集計・書き出し ---
+def summary():
+    """スパン名ごとの集計 (件数・平均・p50/p95/p99・最大) のリスト"""
+    with _state.lock:
+        items = sorted(_state.histograms.items())
+        rows = []
+        for name, histogram in items:
+            rows.append({
+                'span': name,
+                'count': histogram.count,
+                'mean_ms': round(histogram.total_ms / histogram.count, 3) if histogram.count else 0.0,
+                'p50_ms': histogram.quantile(0.50),
+                'p95_ms': histogram.quantile(0.95),
+                'p99_ms': histogram.quantile(0.99),
+                'max_ms': round(histogram.max_ms, 3),
+            })
+    return rows
+
+
+def recent_spans(limit=50):
+    """直近のスパン (新しい順): [(時刻, 名前, 親, ミリ秒), ...]"""
+    with _state.lock:
+        return list(_state.recent)[-limit:][::-1]
+
+
+def reset():
+    with _state.lock:
+        _state.histograms.clear()
+        _state.recent.clear()
+
+
+def render_prometheus():
+    """Prometheus のテキスト形式 (protos_span_duration_ms ヒストグラム)"""
+    lines = ["# HELP protos_span_duration_ms Span latency in milliseconds",
+             "# TYPE protos_span_duration_ms histogram"]
+    with _state.lock:
+        for name, histogram in sorted(_state.histograms.items()):
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, n in zip(BUCKETS_MS + (float('inf'),), histogram.counts):
+                cumulative += n
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f'protos_span_duration_ms_bucket{{span="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'protos_span_duration_ms_sum{{span="{label}"}} {histogram.total_ms}')
+            lines.append(f'protos_span_duration_ms_count{{span="{label}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def export_to_file(path):
+    """集計をJSONファイルに書き出す (一時ファイル経由で置き換えるので、読む側が壊れたJSONを見ない)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'pid': os.getpid(), 'timestamp': time.time(), 'spans': summary()}, f,
+                  ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _metrics_handler():
+    """/metrics のハンドラー (http.server は重いので、サーバーを立てるときだけ import する)"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # アクセスログは出さない
+
+    return MetricsHandler
+
+
+def serve_prometheus(port, host="127.0.0.1"):
+    """/metrics を返すHTTPサーバーを裏スレッドで立てる (プロセスで1回だけ)"""
+    with _state.lock:
+        if _state.server is not None:
+            return _state.server
+        from http.server import ThreadingHTTPServer
+        server = ThreadingHTTPServer((host, port), _metrics_handler())
+        threading.Thread(target=server.serve_forever, name="tracing-metrics", daemon=True).start()
+        _state.server = server
+        return server